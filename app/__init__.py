@@ -1,16 +1,31 @@
 """App module"""
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Dict
 
 import logging
-import ssl
 import sys
-import time
 
-import aiohttp
+if TYPE_CHECKING:
+    import aiohttp
 
 
 loggers = dict()
 
+# Stream that the log handlers write to, see set_log_stream
+_log_stream = sys.stdout
+
+
+def set_log_stream(stream):
+    """Write the logs of all (also future) custom loggers to the given stream
+
+    E.g. stderr when stdout carries data, see app.batch
+    """
+    global _log_stream
+    _log_stream = stream
+    for logger in loggers.values():
+        for handler in logger.handlers:
+            if isinstance(handler, logging.StreamHandler):
+                handler.setStream(stream)
+
 
 def setup_custom_logger(name) -> logging.Logger:
     """Create and return a custom logger"""
@@ -21,7 +36,7 @@ def setup_custom_logger(name) -> logging.Logger:
             fmt="%(asctime)s.%(msecs)03d %(name)s %(levelname)-8s %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
         )
-        handler = logging.StreamHandler(sys.stdout)
+        handler = logging.StreamHandler(_log_stream)
         handler.setFormatter(formatter)
         logger = logging.getLogger(name)
         logger.addHandler(handler)
@@ -30,42 +45,34 @@ def setup_custom_logger(name) -> logging.Logger:
         return logger
 
 
-def init_client_session() -> aiohttp.ClientSession:
-    """Create ClientSession with no-cache headers"""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:127.0) Gecko/20100101 Firefox/127.0",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Accept-Encoding": "gzip, deflate, br, zstd",
-        "DNT": "1",
-        "Sec-GPC": "1",
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "none",
-        "Sec-Fetch-User": "?1",
-        "Priority": "u=1",
-        "TE": "trailers"
-    }
-
-    async def add_nocache_headers(session, trace_config_ctx, params):
-        params.headers.update({
-            "X-No-Cache": str(time.time())
-        })
-
-    trace_config = aiohttp.TraceConfig()
-    trace_config.on_request_start.append(add_nocache_headers)
-
-    ssl_context = ssl.create_default_context()
-    ssl_context.set_ciphers("DEFAULT@SECLEVEL=1")
-    ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
-    ssl_context.maximum_version = ssl.TLSVersion.TLSv1_2
-    tcp_connector = aiohttp.TCPConnector(
-        ssl=ssl_context,
-        use_dns_cache=False,
-        ttl_dns_cache=300,
-        limit=100
-    )
-
-    return aiohttp.ClientSession(headers=headers, trace_configs=[trace_config], connector=tcp_connector)
\ No newline at end of file
+# Headers of the scrape requests, they look like a browser navigation
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "DNT": "1",
+    "Sec-GPC": "1",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Priority": "u=1",
+    "TE": "trailers"
+}
+
+
+def init_client_session(no_cache: bool = True) -> "aiohttp.ClientSession":
+    """Create ClientSession with browser headers
+
+    Note:
+        The app uses a session per destination class, see app.transport.Transport
+
+    Args:
+        no_cache: add a unique no-cache header to every request
+    """
+    from app.transport import SCRAPE, Transport
+
+    return Transport(no_cache=no_cache).session(SCRAPE)
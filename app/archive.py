@@ -0,0 +1,315 @@
+"""Archive of every parsed listing for price analytics
+
+Every listing is stored once per website and listing ID together with when
+it was first and last seen, its latest values and a trigger-maintained
+history of its price changes. The archive is a SQLite file that can be
+queried with SQL without loading it into memory, and exported in batches
+to Parquet or Arrow files (requires pyarrow).
+
+Usage:
+    python -m app.archive export archive.db listings.parquet [--table price_changes] [--since 30]
+    python -m app.archive trend archive.db [--website www.homegate.ch] [--kind Rent]
+"""
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app import setup_custom_logger
+from app.immo.model import ImmoData
+
+
+logger = setup_custom_logger(__name__)
+
+# Exported columns per table: (name, SQL expression, Arrow type)
+EXPORT_COLUMNS: Dict[str, List[Tuple[str, str, str]]] = {
+    "listings": [
+        ("website", "website", "string"),
+        ("listing_id", "listing_id", "string"),
+        ("title", "title", "string"),
+        ("url", "url", "string"),
+        ("address", "address", "string"),
+        ("postal_code", "postal_code", "string"),
+        ("price_kind", "price_kind", "string"),
+        ("currency", "currency", "string"),
+        ("price", "price", "float64"),
+        ("rooms", "rooms", "float64"),
+        ("living_space", "living_space", "float64"),
+        ("price_per_m2", "price / NULLIF(living_space, 0)", "float64"),
+        ("first_seen", "CAST(first_seen * 1000 AS INTEGER)", "timestamp"),
+        ("last_seen", "CAST(last_seen * 1000 AS INTEGER)", "timestamp"),
+        ("times_seen", "times_seen", "int64"),
+    ],
+    "price_changes": [
+        ("website", "website", "string"),
+        ("listing_id", "listing_id", "string"),
+        ("changed_at", "CAST(changed_at * 1000 AS INTEGER)", "timestamp"),
+        ("old_price", "old_price", "float64"),
+        ("new_price", "new_price", "float64"),
+    ],
+}
+
+# Timestamp column that --since filters on
+_SINCE_COLUMNS = {"listings": "last_seen", "price_changes": "changed_at"}
+
+_SCHEMA = [
+    # WITHOUT ROWID: the rows are stored in the primary key index, no second b-tree
+    "CREATE TABLE IF NOT EXISTS listings ("
+    "website TEXT NOT NULL, listing_id TEXT NOT NULL, title TEXT, url TEXT, address TEXT, "
+    "postal_code TEXT, price_kind TEXT, currency TEXT, price REAL, rooms REAL, "
+    "living_space REAL, first_seen REAL NOT NULL, last_seen REAL NOT NULL, "
+    "times_seen INTEGER NOT NULL, PRIMARY KEY (website, listing_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS listings_first_seen ON listings (first_seen)",
+    "CREATE TABLE IF NOT EXISTS price_changes ("
+    "website TEXT NOT NULL, listing_id TEXT NOT NULL, changed_at REAL NOT NULL, "
+    "old_price REAL, new_price REAL)",
+    "CREATE INDEX IF NOT EXISTS price_changes_listing ON price_changes (website, listing_id)",
+    "CREATE TRIGGER IF NOT EXISTS record_price_change AFTER UPDATE OF price ON listings "
+    "WHEN old.price IS NOT new.price BEGIN "
+    "INSERT INTO price_changes (website, listing_id, changed_at, old_price, new_price) "
+    "VALUES (new.website, new.listing_id, new.last_seen, old.price, new.price); END",
+]
+
+# A missing value (e.g. price on request) keeps the last known one
+_UPSERT = (
+    "INSERT INTO listings (website, listing_id, title, url, address, postal_code, price_kind, "
+    "currency, price, rooms, living_space, first_seen, last_seen, times_seen) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1) "
+    "ON CONFLICT (website, listing_id) DO UPDATE SET "
+    "title = excluded.title, url = excluded.url, address = excluded.address, "
+    "postal_code = excluded.postal_code, price_kind = excluded.price_kind, "
+    "currency = excluded.currency, price = coalesce(excluded.price, price), "
+    "rooms = coalesce(excluded.rooms, rooms), "
+    "living_space = coalesce(excluded.living_space, living_space), "
+    "last_seen = max(last_seen, excluded.last_seen), times_seen = times_seen + 1"
+)
+
+_TOUCH = (
+    "UPDATE listings SET last_seen = max(last_seen, ?), times_seen = times_seen + 1 "
+    "WHERE website = ? AND listing_id = ?"
+)
+
+
+class ListingArchive:
+    """Listings archive in a SQLite database file
+
+    Writes are buffered until `flush` is called (once per scrape), a
+    listing that is recorded several times in between is written once.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in _SCHEMA:
+                self.connection.execute(statement)
+        # (website, listing ID) -> row of the upsert
+        self._pending: Dict[Tuple[str, str], tuple] = {}
+        # (website, listing ID) -> last seen, of listings on unchanged pages
+        self._pending_touch: Dict[Tuple[str, str], float] = {}
+        logger.info("Opened listing archive %s", path)
+
+    def record(self, website: str, listings: Iterable[ImmoData], timestamp: float):
+        """Buffer the listings of a website as seen at the given timestamp"""
+        for listing in listings:
+            record = listing.to_dict()
+            key = (website, listing.id)
+            # The latest values win, first seen stays the earliest
+            first_seen = pending[11] if (pending := self._pending.get(key)) else timestamp
+            self._pending[key] = (
+                website,
+                listing.id,
+                record["title"],
+                record["url"],
+                record["address"],
+                record["postal_code"],
+                record["price_kind"],
+                record["currency"],
+                record["price_value"],
+                record["rooms_value"],
+                record["living_space_value"],
+                first_seen,
+                timestamp,
+            )
+
+    def touch(self, website: str, listing_ids: Iterable[str], timestamp: float):
+        """Buffer the already archived listings of an unchanged page as seen again"""
+        for listing_id in listing_ids:
+            self._pending_touch[(website, listing_id)] = timestamp
+
+    def flush(self):
+        """Write all buffered listings"""
+        if not self._pending and not self._pending_touch:
+            return
+
+        start = time.perf_counter()
+        with self.connection:
+            self.connection.executemany(_UPSERT, self._pending.values())
+            self.connection.executemany(
+                _TOUCH,
+                [
+                    (timestamp, website, listing_id)
+                    for (website, listing_id), timestamp in self._pending_touch.items()
+                    if (website, listing_id) not in self._pending
+                ],
+            )
+        logger.debug(
+            "archived %d listings and touched %d in %.1fms",
+            len(self._pending),
+            len(self._pending_touch),
+            (time.perf_counter() - start) * 1e3,
+        )
+        self._pending.clear()
+        self._pending_touch.clear()
+
+    def close(self):
+        """Flush and close the database"""
+        self.flush()
+        self.connection.close()
+
+    def query(self, sql: str, parameters: Sequence = ()) -> Iterator[tuple]:
+        """Run a query and yield its rows one by one, e.g. for ad-hoc analytics"""
+        self.flush()
+        yield from self.connection.execute(sql, parameters)
+
+    def price_per_m2_trend(
+        self, price_kind: str = "Rent", website: Optional[str] = None
+    ) -> List[Tuple[str, int, float]]:
+        """Average price per m² of the listings by the week they were first seen
+
+        Returns:
+            list of (week, number of listings, average price per m²): oldest week first
+        """
+        sql = (
+            "SELECT strftime('%Y-%W', first_seen, 'unixepoch') AS week, count(*), "
+            "avg(price / living_space) FROM listings "
+            "WHERE price_kind = ? AND price IS NOT NULL AND living_space > 0"
+        )
+        parameters: list = [price_kind]
+        if website:
+            sql += " AND website = ?"
+            parameters.append(website)
+        return list(self.query(sql + " GROUP BY week ORDER BY week", parameters))
+
+    def export(
+        self,
+        path: str,
+        table: str = "listings",
+        file_format: Optional[str] = None,
+        since: Optional[float] = None,
+        batch_size: int = 50_000,
+    ) -> int:
+        """Export a table to a Parquet or Arrow IPC file, batch by batch
+
+        Args:
+            path: file that is written
+            table: "listings" or "price_changes"
+            file_format: "parquet" or "arrow" (default: from the file extension)
+            since: only rows that were last seen (or changed) after this timestamp
+            batch_size: rows per record batch, at most one batch is in memory
+
+        Returns:
+            int: number of exported rows
+
+        Raises:
+            RuntimeError: if pyarrow isn't installed
+            ValueError: for an unknown table or format
+        """
+        try:
+            # Only needed for exports and slow to import
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("Exporting the archive requires `pip install pyarrow`") from None
+
+        if table not in EXPORT_COLUMNS:
+            raise ValueError(f"Unknown table {table}, expected one of {', '.join(EXPORT_COLUMNS)}")
+        file_format = file_format or ("parquet" if Path(path).suffix == ".parquet" else "arrow")
+        columns = EXPORT_COLUMNS[table]
+        types = {
+            "string": pyarrow.string(),
+            "float64": pyarrow.float64(),
+            "int64": pyarrow.int64(),
+            "timestamp": pyarrow.timestamp("ms", tz="UTC"),
+        }
+        schema = pyarrow.schema([(name, types[kind]) for name, _, kind in columns])
+
+        match file_format:
+            case "parquet":
+                import pyarrow.parquet
+
+                writer = pyarrow.parquet.ParquetWriter(path, schema, compression="zstd")
+            case "arrow":
+                import pyarrow.ipc
+
+                writer = pyarrow.ipc.new_file(path, schema)
+            case _:
+                raise ValueError(f"Unknown format {file_format}, expected parquet or arrow")
+
+        sql = f"SELECT {', '.join(expression for _, expression, _ in columns)} FROM {table}"
+        parameters: tuple = ()
+        if since is not None:
+            sql += f" WHERE {_SINCE_COLUMNS[table]} > ?"
+            parameters = (since,)
+
+        self.flush()
+        n_rows = 0
+        try:
+            cursor = self.connection.execute(sql, parameters)
+            while rows := cursor.fetchmany(batch_size):
+                arrays = [
+                    pyarrow.array([row[i] for row in rows], type=schema.field(i).type)
+                    for i in range(len(columns))
+                ]
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+                n_rows += len(rows)
+        finally:
+            writer.close()
+        logger.info("Exported %d rows of %s to %s", n_rows, table, path)
+        return n_rows
+
+
+def create_archive(path: Optional[str]) -> Optional[ListingArchive]:
+    """Return an archive for the given path, None (no archive) if it's empty"""
+    if path:
+        return ListingArchive(path)
+    return None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export a table to Parquet or Arrow")
+    export.add_argument("archive")
+    export.add_argument("output", help="*.parquet or *.arrow file")
+    export.add_argument("--table", choices=list(EXPORT_COLUMNS), default="listings")
+    export.add_argument("--format", choices=["parquet", "arrow"], help="default: from the extension")
+    export.add_argument("--since", type=float, help="only rows seen in the last n days")
+    trend = commands.add_parser("trend", help="average price per m² by week first seen")
+    trend.add_argument("archive")
+    trend.add_argument("--website", help="e.g. www.homegate.ch (default: all)")
+    trend.add_argument("--kind", default="Rent", help="price kind, Rent or Price")
+    args = arg_parser.parse_args()
+
+    archive = ListingArchive(args.archive)
+    try:
+        match args.command:
+            case "export":
+                since = time.time() - args.since * 24 * 3600 if args.since else None
+                archive.export(args.output, args.table, args.format, since)
+            case "trend":
+                print(f"{'week':<10}{'listings':>10}{'per m²':>10}")
+                for week, n_listings, price_per_m2 in archive.price_per_m2_trend(
+                    args.kind, args.website
+                ):
+                    print(f"{week:<10}{n_listings:>10}{price_per_m2:>10.2f}")
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""One-shot mode: scrape every URL once and stream the listings as NDJSON
+
+Every listing of every result page (up to SCRAPE_MAX_PAGES per URL) is
+written as a JSON line as soon as its page is parsed, nothing is sent to
+Discord and no state is kept, the listings are recorded in the archive if
+ARCHIVE_PATH is set. The timings per URL are logged at the end
+(to stderr if the listings go to stdout), the exit code is 1 if any URL
+failed.
+
+Usage:
+    python -m app.batch [--output listings.ndjson] [--concurrency 4] [URL ...]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, List, Optional, TextIO
+from urllib.parse import urlparse
+
+from app import set_log_stream, setup_custom_logger
+from app.archive import create_archive
+from app.config import Config
+from app.immo.error import ImmoParserError
+from app.immo.model import ImmoData
+from app.immo.pool import ParserPool
+from app.manager import ImmoManager
+from app.resilience import Resilience, RetryPolicy
+from app.scheduler import HostLimiter
+from app.scraper import ScraperNetworkError
+from app.transport import SCRAPE, Transport
+
+
+log = setup_custom_logger(__name__)
+
+
+class UrlStats:
+    """Outcome and timings of the scrape of a single URL"""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.pages = 0
+        self.listings = 0
+        # Seconds from the start of the scrape to the first written listing
+        self.first_listing: Optional[float] = None
+        self.duration = 0.0
+        self.error: Optional[str] = None
+
+
+class NdjsonWriter:
+    """Write listings as JSON lines, one listing per line"""
+
+    def __init__(self, output: TextIO) -> None:
+        self.output = output
+        self.written = 0
+
+    def write(self, source_url: str, page: int, listings: List[ImmoData]):
+        for listing in listings:
+            record = listing.to_dict()
+            record["source_url"] = source_url
+            record["page"] = page
+            self.output.write(json.dumps(record, ensure_ascii=False))
+            self.output.write("\n")
+        # Readers of a pipe get every page right away
+        self.output.flush()
+        self.written += len(listings)
+
+
+class BatchManager(ImmoManager):
+    """Manager that writes every scraped page instead of posting new listings"""
+
+    def __init__(self, *args, writer: NdjsonWriter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writer = writer
+        self.stats = UrlStats(self.immo_website_url)
+        self._start = 0.0
+
+    async def _scrape_page(self, page: int) -> Optional[List[ImmoData]]:
+        listings = await super()._scrape_page(page)
+        if listings:
+            self.writer.write(self.immo_website_url, page, listings)
+            self.stats.pages += 1
+            self.stats.listings += len(listings)
+            if self.stats.first_listing is None:
+                self.stats.first_listing = time.perf_counter() - self._start
+        return listings
+
+    async def scrape_all(self) -> UrlStats:
+        """Scrape the URL once, following its result pages up to max_pages
+
+        Note:
+            Nothing is marked as seen, so pagination only stops at max_pages
+            or at the first empty page.
+        """
+        self._start = time.perf_counter()
+        try:
+            await self._scrape_listings()
+        except (ScraperNetworkError, ImmoParserError, KeyError) as e:
+            self.stats.error = repr(e)
+            self.logger.warning(f"Scrape failed: {e!r}")
+        self.stats.duration = time.perf_counter() - self._start
+        if self.archive:
+            self.archive.flush()
+        return self.stats
+
+
+def scrape_urls(config: Config) -> List[str]:
+    """The scrape URLs of the config, every URL once"""
+    urls = [*config.scrape_urls, *(subscription.url for subscription in config.subscriptions)]
+    return list(dict.fromkeys(urls))
+
+
+async def run_batch(
+    config: Config, urls: List[str], output: TextIO, concurrency: int
+) -> List[UrlStats]:
+    """Scrape every URL once and write the listings to output
+
+    Note:
+        Scrapes of the same host still obey HOST_CONCURRENCY and HOST_SPACING.
+
+    Args:
+        urls: immo website URLs
+        output: text stream the NDJSON is written to
+        concurrency: number of URLs scraped at the same time
+
+    Returns:
+        list[UrlStats]: one per URL, in the order of urls
+    """
+    transport = Transport(
+        no_cache=True,
+        limits={SCRAPE: config.scrape_connection_limit},
+        limit_per_host=config.connection_limit_per_host,
+        dns_cache_ttl=config.dns_cache_ttl,
+        http2_hosts=config.http2_hosts,
+    )
+    resilience = Resilience(
+        failure_threshold=config.circuit_breaker_threshold,
+        reset_timeout=config.circuit_breaker_reset,
+    )
+    retry_policy = RetryPolicy(
+        attempts=config.retry_attempts,
+        base_delay=config.retry_base_delay,
+        max_delay=config.retry_max_delay,
+        timeout=config.scrape_timeout,
+        budget=config.scrape_budget,
+    )
+    parser_pool = ParserPool(
+        kind=config.parser_pool,
+        workers=config.parser_workers,
+        max_pending=config.parser_queue_size,
+    )
+    archive = create_archive(config.archive_path)
+    writer = NdjsonWriter(output)
+
+    stats: Dict[str, UrlStats] = {}
+    managers: List[BatchManager] = []
+    for url in urls:
+        try:
+            managers.append(
+                BatchManager(
+                    immo_website_url=url,
+                    session=transport.scrape_session(urlparse(url).hostname),
+                    discord_webhook_url=None,
+                    n_seconds_sleep=0,
+                    google_maps_destination=None,
+                    max_pages=config.scrape_max_pages,
+                    page_concurrency=config.scrape_page_concurrency,
+                    conditional_requests=False,
+                    parser_pool=parser_pool,
+                    resilience=resilience,
+                    retry_policy=retry_policy,
+                    archive=archive,
+                    writer=writer,
+                )
+            )
+        except (ImmoParserError, ValueError) as e:
+            # ValueError: not an immo website
+            log.error("Skipping %s: %s", url, e)
+            stats[url] = UrlStats(url)
+            stats[url].error = repr(e)
+
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    hosts: Dict[str, HostLimiter] = {}
+
+    async def scrape(manager: BatchManager):
+        hostname = manager.immo_website.value
+        if hostname not in hosts:
+            hosts[hostname] = HostLimiter(config.host_concurrency, config.host_spacing)
+        # Waiting for the host doesn't take a slot from the URLs of other hosts
+        async with hosts[hostname], semaphore:
+            stats[manager.immo_website_url] = await manager.scrape_all()
+
+    try:
+        await asyncio.gather(*(scrape(manager) for manager in managers))
+    finally:
+        parser_pool.close()
+        if archive:
+            archive.close()
+        await transport.close()
+    return [stats[url] for url in urls]
+
+
+def _report(stats: List[UrlStats], duration: float):
+    """Log the timings per URL and the overall throughput"""
+    for url_stats in stats:
+        if url_stats.error:
+            log.info(
+                "%s failed after %.2fs: %s", url_stats.url, url_stats.duration, url_stats.error
+            )
+            continue
+        first_listing = url_stats.first_listing
+        log.info(
+            "%s: %d listings on %d pages in %.2fs (first listing after %s)",
+            url_stats.url,
+            url_stats.listings,
+            url_stats.pages,
+            url_stats.duration,
+            "-" if first_listing is None else f"{first_listing:.2f}s",
+        )
+    listings = sum(url_stats.listings for url_stats in stats)
+    failed = sum(1 for url_stats in stats if url_stats.error)
+    log.info(
+        "Scraped %d URLs (%d failed), %d listings in %.2fs (%.1f listings/s)",
+        len(stats),
+        failed,
+        listings,
+        duration,
+        listings / duration if duration else 0.0,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    arg_parser.add_argument("urls", nargs="*", help="URLs to scrape (default: the configured URLs)")
+    arg_parser.add_argument("--output", "-o", help="NDJSON file (default: stdout)")
+    arg_parser.add_argument(
+        "--concurrency", type=int, help="URLs scraped at the same time (default: BATCH_CONCURRENCY)"
+    )
+    args = arg_parser.parse_args(argv)
+
+    config = Config()
+    urls = args.urls or scrape_urls(config)
+    if not urls:
+        log.info("No URLs for scraping provided. Exiting...")
+        return 0
+
+    concurrency = args.concurrency or config.batch_concurrency
+    start = time.perf_counter()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            stats = asyncio.run(run_batch(config, urls, output, concurrency))
+    else:
+        # stdout carries the listings
+        set_log_stream(sys.stderr)
+        stats = asyncio.run(run_batch(config, urls, sys.stdout, concurrency))
+    _report(stats, time.perf_counter() - start)
+    return 1 if any(url_stats.error for url_stats in stats) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Detect changes of already seen listings
+
+The seen index keeps a fingerprint (content hash and price) of every listing,
+comparing a scraped listing with it is a single lookup. Price drops above
+the thresholds and, if enabled, any other change are reported as events.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from app.immo.model import ImmoData
+from app.seen import Fingerprint
+
+
+PRICE_DROPPED = "price_dropped"
+UPDATED = "updated"
+
+
+def fingerprint(listing: ImmoData) -> Fingerprint:
+    return Fingerprint(listing.content_hash(), listing.price_value)
+
+
+def _format_price(price: float, currency: str) -> str:
+    return f"{price:.0f} {currency}" if price.is_integer() else f"{price:.2f} {currency}"
+
+
+@dataclass
+class ListingChange:
+    """Change of an already seen listing since it was last seen"""
+
+    listing: ImmoData
+    kind: str
+    old_price: Optional[float]
+
+    def describe(self) -> str:
+        """Note shown with the listing in the Discord message"""
+        listing = self.listing
+        if self.kind == PRICE_DROPPED:
+            percent = (listing.price_value - self.old_price) / self.old_price * 100
+            return (
+                f"📉 Price dropped from {_format_price(self.old_price, listing.currency)} "
+                f"to {_format_price(listing.price_value, listing.currency)} ({percent:.1f}%)"
+            )
+        if self.old_price is not None and self.old_price != listing.price_value:
+            old_price = _format_price(self.old_price, listing.currency)
+            return f"✏️ Listing updated, price was {old_price}"
+        return "✏️ Listing updated"
+
+
+class ChangeDetector:
+    """Decide which changes of a seen listing are worth a notification"""
+
+    def __init__(
+        self,
+        price_drops: bool = True,
+        updates: bool = False,
+        price_drop_min_percent: float = 3.0,
+        price_drop_min_amount: float = 0.0,
+    ) -> None:
+        """
+        Args:
+            price_drops: report price drops
+            updates: report any other change (e.g. photos, title, a price increase)
+            price_drop_min_percent: smaller drops (relative to the old price) are
+                reported as updates
+            price_drop_min_amount: smaller drops (in the listing's currency) are
+                reported as updates
+        """
+        self.price_drops = price_drops
+        self.updates = updates
+        self.price_drop_min_percent = price_drop_min_percent
+        self.price_drop_min_amount = price_drop_min_amount
+
+    @property
+    def enabled(self) -> bool:
+        return self.price_drops or self.updates
+
+    def _is_price_drop(self, old_price: Optional[float], new_price: Optional[float]) -> bool:
+        if old_price is None or new_price is None or not 0 < new_price < old_price:
+            return False
+        drop = old_price - new_price
+        return (
+            drop >= self.price_drop_min_amount
+            and drop / old_price * 100 >= self.price_drop_min_percent
+        )
+
+    def detect(
+        self, listing: ImmoData, current: Fingerprint, previous: Optional[Fingerprint]
+    ) -> Optional[ListingChange]:
+        """Compare a listing with its previous fingerprint
+
+        Args:
+            listing: the scraped listing
+            current: fingerprint of the scraped listing
+            previous: fingerprint of when it was last seen, None if unknown
+
+        Returns:
+            ListingChange: the change to report or None
+        """
+        if previous is None or current.content_hash == previous.content_hash:
+            return None
+        if self.price_drops and self._is_price_drop(previous.price, current.price):
+            return ListingChange(listing, PRICE_DROPPED, previous.price)
+        if self.updates:
+            return ListingChange(listing, UPDATED, previous.price)
+        return None
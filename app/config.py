@@ -1,24 +1,191 @@
 from typing import List, Optional
 
-from pydantic import AnyHttpUrl, BaseSettings
+from pydantic import AnyHttpUrl, BaseModel, BaseSettings, validator
+
+from app.filters import compile_filter
+
+
+class Subscription(BaseModel):
+    # Immo URL that is scraped
+    url: AnyHttpUrl
+    # Discord Webhook URL the new listings of the URL are sent to
+    webhook: AnyHttpUrl
+    # Filter expression, only matching listings are sent (see app/filters.py)
+    filter: Optional[str]
+
+    @validator("filter")
+    def _validate_filter(cls, expression: Optional[str]) -> Optional[str]:
+        # Fail on startup instead of on the first listing
+        compile_filter(expression)
+        return expression
 
 
 class Config(BaseSettings):
-    # Discord Webhook URL
-    discord_webhook: AnyHttpUrl
+    # Discord Webhook URL that the listings of `scrape_urls` are sent to
+    discord_webhook: Optional[AnyHttpUrl]
 
     # Google Maps API key
     google_maps_api_key: Optional[str]
     # Used to compute the distance from the
     # apartment to the destination address
     google_maps_destination: Optional[str]
+    # Time in seconds for which computed distances are cached
+    google_maps_cache_ttl: int = 30 * 24 * 3600
 
     # Sentry DSN for monitoring potential exceptions
     sentry_dsn: Optional[AnyHttpUrl]
 
+    # Fraction of transactions that are traced by Sentry
+    sentry_traces_sample_rate: float = 0.0
+
+    # Port of the Prometheus metrics endpoint (/metrics), disabled if not set
+    metrics_port: Optional[int]
+    metrics_host: str = "0.0.0.0"
+
     # List of Immo URLs that will be scraped.
     # You can use multiple URLs per one Immo website.
-    scrape_urls: List[AnyHttpUrl]
+    scrape_urls: List[AnyHttpUrl] = []
+
+    # Filter expression for the listings of `scrape_urls` (see app/filters.py)
+    scrape_filter: Optional[str]
+
+    # Further (URL, webhook, filter) subscriptions, every URL is scraped once
+    # no matter how many webhooks subscribe to it
+    subscriptions: List[Subscription] = []
 
     # Time delta between individual scrapes in seconds
     scraping_interval: int = 120
+
+    # The interval of every URL adapts to how often it yields new listings
+    # within these bounds (default: half and four times the scraping interval)
+    scraping_interval_min: Optional[int]
+    scraping_interval_max: Optional[int]
+
+    # Relative random deviation of every interval (0.1 = ±10%)
+    scraping_jitter: float = 0.1
+
+    # Number of concurrent scrapes per hostname and the minimum time
+    # in seconds between two scrapes of the same hostname
+    host_concurrency: int = 1
+    host_spacing: float = 5.0
+
+    # Revalidate result pages with ETag / Last-Modified instead of
+    # sending no-cache requests
+    conditional_requests: bool = True
+
+    # Maximum number of already seen listing IDs remembered per URL
+    seen_listings_max: int = 5000
+
+    # Time in seconds after which a listing ID that wasn't seen again is forgotten
+    seen_listings_ttl: Optional[int] = 30 * 24 * 3600
+
+    # Path of the SQLite database that persists seen listings between restarts.
+    # Nothing is persisted if not set.
+    state_path: Optional[str]
+
+    # Path of the SQLite archive that every parsed listing is recorded in with
+    # its first/last seen time and price changes (see app.archive), disabled if not set
+    archive_path: Optional[str]
+
+    # Maximum number of result pages fetched per scrape. Further pages are only
+    # fetched while they contain listings that weren't seen before.
+    scrape_max_pages: int = 1
+
+    # Number of result pages that are fetched concurrently
+    scrape_page_concurrency: int = 2
+
+    # Time in seconds during which the same listing (same address, rooms,
+    # living space and price) on another website is posted as a duplicate note
+    duplicate_listings_ttl: int = 7 * 24 * 3600
+
+    # Where result pages are parsed: "process" pool, "thread" pool or "inline"
+    # on the event loop, the number of workers (default: number of CPUs) and
+    # the maximum number of pages waiting to be parsed
+    parser_pool: str = "process"
+    parser_workers: Optional[int]
+    parser_queue_size: int = 8
+
+    # Path of the SQLite lease database shared by all replicas. If set, the
+    # replicas split the scrape URLs between them (see app.sharding), the
+    # state store at `state_path` has to be shared as well.
+    lease_store_path: Optional[str]
+
+    # Unique ID of this replica (default: host name and process ID) and the
+    # seconds after which the URLs of a crashed replica are taken over
+    replica_id: Optional[str]
+    lease_ttl: float = 30.0
+
+    # Number of URLs whose new listings are sent to Discord at the same time
+    delivery_workers: int = 4
+
+    # Maximum number of queued messages per URL and webhook, scraping the URL
+    # waits while its queue is full (e.g. a rate limited webhook)
+    delivery_queue_size: int = 100
+
+    # Notify about price drops of already seen listings. Smaller drops than
+    # the minimum percentage or amount (in the listing's currency) are
+    # treated like any other change.
+    notify_price_drops: bool = True
+    price_drop_min_percent: float = 3.0
+    price_drop_min_amount: float = 0.0
+
+    # Notify about any other change of an already seen listing
+    # (e.g. photos, title, a price increase)
+    notify_updates: bool = False
+
+    # Number of URLs that the one-shot mode (app.batch) scrapes at the same time
+    batch_concurrency: int = 4
+
+    # Attempts per request and the backoff before a retry, it starts at the
+    # base delay and doubles with every retry up to the max delay (jittered)
+    retry_attempts: int = 3
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 10.0
+
+    # Seconds a single result page download may take and all its attempts together
+    scrape_timeout: float = 20.0
+    scrape_budget: float = 60.0
+
+    # Seconds a single Google Maps request or image download may take
+    enrichment_timeout: float = 10.0
+
+    # Failed requests in a row after which a host isn't requested for
+    # `circuit_breaker_reset` seconds
+    circuit_breaker_threshold: int = 5
+    circuit_breaker_reset: float = 60.0
+
+    # Maximum number of connections of the scrape, image download and API
+    # (Google Maps and Discord, each) pools and per host within a pool (0 = no limit)
+    scrape_connection_limit: int = 20
+    image_connection_limit: int = 20
+    api_connection_limit: int = 10
+    connection_limit_per_host: int = 0
+
+    # Time in seconds for which resolved host names are cached
+    dns_cache_ttl: int = 300
+
+    # Hosts that are scraped over HTTP/2, requires `httpx[http2]`
+    http2_hosts: List[str] = []
+
+    # Directory where downloaded listing images are cached,
+    # images are only cached in memory if not set
+    image_cache_dir: Optional[str]
+
+    # Size of the in-memory and on-disk image caches in megabytes
+    image_cache_memory_mb: int = 32
+    image_cache_disk_mb: int = 256
+
+    @validator("scrape_filter")
+    def _validate_scrape_filter(cls, expression: Optional[str]) -> Optional[str]:
+        compile_filter(expression)
+        return expression
+
+    def all_subscriptions(self) -> List[Subscription]:
+        """The subscriptions together with the `scrape_urls` of `discord_webhook`"""
+        subscriptions = list(self.subscriptions)
+        if self.discord_webhook:
+            subscriptions.extend(
+                Subscription(url=url, webhook=self.discord_webhook, filter=self.scrape_filter)
+                for url in self.scrape_urls
+            )
+        return subscriptions
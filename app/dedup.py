@@ -0,0 +1,112 @@
+"""Detection of the same listing posted on several websites"""
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.immo.model import ImmoData
+
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def _normalize_number(value) -> str:
+    """Return the first number of a display value (e.g. "1'850 CHF" -> "1850")"""
+    if value is None:
+        return ""
+    match = _NUMBER.search(str(value).replace("'", "").replace("’", ""))
+    if match is None:
+        return ""
+    return str(float(match.group().replace(",", ".")))
+
+
+def _normalize_address(address: str) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", address.lower()).split())
+
+
+def listing_fingerprint(listing: ImmoData) -> Optional[str]:
+    """Fingerprint of a listing built from its address, rooms, living space and price
+
+    Returns:
+        str: fingerprint or None if the listing has no address to compare
+    """
+    if not listing.address or listing.address == "No address":
+        return None
+
+    parts = (
+        _normalize_address(listing.address),
+        _normalize_number(listing.rooms),
+        _normalize_number(listing.living_space),
+        _normalize_number(listing.price),
+    )
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=16).hexdigest()
+
+
+class DuplicateEntry:
+    """The first occurrence of a listing and the URLs of its duplicates"""
+
+    def __init__(self, hostname: str, url: str) -> None:
+        self.hostname = hostname
+        self.url = url
+        self.timestamp = time.time()
+        # URLs of the duplicates on other websites
+        self.duplicate_urls: List[str] = []
+        # Whether the message of the first occurrence was already rendered
+        self.rendered = False
+
+
+class DuplicateIndex:
+    """Index of recently posted listings by their fingerprint
+
+    Only listings of different websites are considered duplicates, units
+    with the same characteristics in the same building are usually posted
+    on a single website. Listings are only collapsed within the same scope
+    (the webhooks they are delivered to), a subscriber never misses a listing
+    because it was posted to someone else.
+    """
+
+    def __init__(self, ttl: float = 7 * 24 * 3600, max_size: int = 10000) -> None:
+        """
+        Args:
+            ttl: seconds for which a posted listing is remembered
+            max_size: maximum number of remembered listings
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[str, DuplicateEntry] = OrderedDict()
+
+    def claim(self, listing: ImmoData, hostname: str, scope: str = "") -> Optional[DuplicateEntry]:
+        """Register a listing that is about to be posted
+
+        Returns:
+            DuplicateEntry: the entry of the first occurrence if the listing is a
+                            duplicate from another website (the listing's URL is
+                            added to it), otherwise None
+        """
+        if (fingerprint := listing_fingerprint(listing)) is None:
+            return None
+        fingerprint = f"{scope}|{fingerprint}"
+
+        entry = self._entries.get(fingerprint)
+        if entry is not None and time.time() - entry.timestamp <= self.ttl:
+            if entry.hostname == hostname:
+                return None
+            if listing.url not in entry.duplicate_urls:
+                entry.duplicate_urls.append(listing.url)
+            return entry
+
+        self._entries[fingerprint] = DuplicateEntry(hostname, listing.url)
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return None
+
+    def lookup(self, listing: ImmoData, scope: str = "") -> Optional[DuplicateEntry]:
+        """Return the entry of a listing that was claimed as the first occurrence"""
+        if (fingerprint := listing_fingerprint(listing)) is None:
+            return None
+        entry = self._entries.get(f"{scope}|{fingerprint}")
+        if entry is not None and entry.url == listing.url:
+            return entry
+        return None
@@ -0,0 +1,205 @@
+"""Asynchronous delivery of Discord webhook messages"""
+from __future__ import annotations
+
+import asyncio
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from app import setup_custom_logger
+from app.metrics import ERRORS
+from app.utils.discord import DiscordMessage
+
+if TYPE_CHECKING:
+    from discord import Webhook
+
+
+logger = setup_custom_logger(__name__)
+
+# Same pattern as discord.Webhook.from_url
+_WEBHOOK_URL = re.compile(
+    r"discord(?:app)?.com/api/webhooks/(?P<id>[0-9]{17,20})/(?P<token>[A-Za-z0-9\.\-\_]{60,68})"
+)
+
+
+class LazyWebhook:
+    """Discord webhook that is only created when the first message is sent
+
+    Most scrapes find nothing new, so a (re)started replica can scrape
+    without waiting for discord.py to be imported.
+    """
+
+    def __init__(self, url: str, session: aiohttp.ClientSession) -> None:
+        """
+        Raises:
+            ValueError: if the URL isn't a Discord webhook URL
+        """
+        if (match := _WEBHOOK_URL.search(url)) is None:
+            raise ValueError(f"Invalid Discord webhook URL: {url}")
+        self.url = url
+        self.id = int(match["id"])
+        self.session = session
+        self._webhook: Optional[Webhook] = None
+
+    def resolve(self) -> Webhook:
+        """Return the discord.Webhook, created on the first call"""
+        if self._webhook is None:
+            from discord import Webhook
+
+            from app.utils.webhook import RateLimitedWebhookAdapter
+
+            self._webhook = Webhook.from_url(
+                self.url, adapter=RateLimitedWebhookAdapter(self.session)
+            )
+        return self._webhook
+
+
+@dataclass
+class _Delivery:
+    """Queued message for a webhook, rendered lazily by the delivery worker"""
+
+    webhook: LazyWebhook
+    render: Callable[[], Awaitable[DiscordMessage]]
+    # Called once the message was sent
+    on_delivered: Optional[Callable[[], None]] = None
+
+
+class DeliveryPipeline:
+    """Deliver Discord messages in the background
+
+    Messages are queued in lanes (usually one per scrape URL). Every lane
+    delivers its messages in order while at most `n_workers` lanes render and
+    send at the same time. Messages that queued up in a lane are rendered
+    concurrently and coalesced into as few webhook messages as Discord allows.
+    A full lane makes `submit` wait, e.g. while its webhook is rate limited.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        n_workers: int = 4,
+        max_batch: int = 10,
+        max_queued: int = 100,
+    ) -> None:
+        """
+        Args:
+            session: shared aiohttp.ClientSession
+            n_workers: number of lanes that are delivering at the same time
+            max_batch: maximum number of queued messages a lane handles at once
+            max_queued: maximum number of queued messages per lane
+        """
+        self.session = session
+        self.max_batch = max_batch
+        self.max_queued = max(max_queued, 1)
+        self._workers = asyncio.Semaphore(n_workers)
+        self._lanes: Dict[str, asyncio.Queue] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._webhooks: Dict[str, LazyWebhook] = {}
+
+    def webhook(self, url: str) -> LazyWebhook:
+        """Return the (shared) webhook for the given webhook URL
+
+        Raises:
+            ValueError: if the URL isn't a Discord webhook URL
+        """
+        if (webhook := self._webhooks.get(url)) is None:
+            webhook = self._webhooks[url] = LazyWebhook(url, self.session)
+        return webhook
+
+    async def submit(
+        self,
+        lane: str,
+        webhook: LazyWebhook,
+        render: Callable[[], Awaitable[DiscordMessage]],
+        on_delivered: Optional[Callable[[], None]] = None,
+    ):
+        """Queue a message for delivery, only waits while the lane is full
+
+        Args:
+            lane: messages of the same lane are delivered in order
+            webhook: webhook the message is sent to
+            render: coroutine function that creates the message
+            on_delivered: called once the message was sent, not if it failed
+        """
+        if (queue := self._lanes.get(lane)) is None:
+            queue = self._lanes[lane] = asyncio.Queue(self.max_queued)
+            self._tasks[lane] = asyncio.create_task(self._run_lane(lane, queue))
+        await queue.put(_Delivery(webhook, render, on_delivered))
+
+    async def _render(self, delivery: _Delivery) -> Optional[DiscordMessage]:
+        try:
+            return await delivery.render()
+        except Exception as e:
+            logger.exception("Failed to render message: %r", e)
+            return None
+
+    async def _deliver(self, lane: str, batch: List[_Delivery]):
+        """Render a batch of messages and send them in as few webhook messages as possible"""
+        messages = await asyncio.gather(*(self._render(delivery) for delivery in batch))
+
+        # (webhook, message, callbacks of the merged deliveries)
+        packed: List[tuple] = []
+        for delivery, message in zip(batch, messages):
+            if message is None:
+                continue
+            if packed and packed[-1][0] is delivery.webhook and packed[-1][1].can_merge(message):
+                packed[-1][1].merge(message)
+            else:
+                packed.append((delivery.webhook, message, []))
+            if delivery.on_delivered is not None:
+                packed[-1][2].append(delivery.on_delivered)
+
+        from discord.errors import HTTPException
+
+        for webhook, message, callbacks in packed:
+            try:
+                await message.send(webhook.resolve())
+            except HTTPException as e:
+                ERRORS.inc(type=type(e).__name__)
+                logger.error("Failed to deliver message of %s: %r", lane, e)
+            except Exception as e:
+                # e.g. aiohttp.ClientError or asyncio.TimeoutError, the next message may succeed
+                ERRORS.inc(type=type(e).__name__)
+                logger.exception("Failed to deliver message of %s: %r", lane, e)
+            else:
+                for on_delivered in callbacks:
+                    try:
+                        on_delivered()
+                    except Exception as e:
+                        logger.exception("Delivery callback of %s failed: %r", lane, e)
+
+        if len(batch) > len(packed):
+            logger.debug("%s: coalesced %d messages into %d", lane, len(batch), len(packed))
+
+    async def _run_lane(self, lane: str, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                async with self._workers:
+                    await self._deliver(lane, batch)
+            except Exception as e:
+                # The lane has to keep running, or its later messages are never sent
+                ERRORS.inc(type=type(e).__name__)
+                logger.exception("Failed to deliver %d messages of %s: %r", len(batch), lane, e)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def join(self):
+        """Wait until every queued message was delivered"""
+        await asyncio.gather(*(queue.join() for queue in self._lanes.values()))
+
+    async def close(self, timeout: Optional[float] = 30):
+        """Deliver the remaining messages (up to timeout seconds) and stop the lanes"""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping undelivered messages on close")
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
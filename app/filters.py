@@ -0,0 +1,134 @@
+"""Filter expressions over parsed listings
+
+A filter is a Python-like boolean expression over the typed fields of a
+listing, e.g. `rooms >= 3 and price_per_m2 < 30 and postal_code in ["8000", "8001"]`.
+Expressions are validated against a whitelist of syntax and compiled once.
+"""
+import ast
+import operator
+from typing import Callable, Dict, Optional
+
+from app.immo.model import ImmoData
+
+
+class FilterError(ValueError):
+    """Invalid filter expression"""
+
+    pass
+
+
+# Variables that can be used in arithmetic
+NUMERIC_VARIABLES = {"price", "rooms", "living_space", "price_per_m2"}
+
+# Variables available in filter expressions
+VARIABLES: Dict[str, Callable[[ImmoData], object]] = {
+    "price": operator.attrgetter("price_value"),
+    "rooms": operator.attrgetter("rooms_value"),
+    "living_space": operator.attrgetter("living_space_value"),
+    "price_per_m2": operator.attrgetter("price_per_m2"),
+    "postal_code": operator.attrgetter("postal_code"),
+    "address": operator.attrgetter("address"),
+    "title": operator.attrgetter("title"),
+    "currency": operator.attrgetter("currency"),
+    "price_kind": lambda listing: listing.price_kind.value,
+}
+
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.BoolOp, ast.And, ast.Or,
+    ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.Name, ast.Load,
+    ast.Constant,
+    ast.List, ast.Tuple, ast.Set,
+)
+
+
+def _is_numeric(node: ast.AST) -> bool:
+    """Whether the node is arithmetic over numbers (no string repetition)"""
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float)) and not isinstance(node.value, bool)
+    if isinstance(node, ast.Name):
+        return node.id in NUMERIC_VARIABLES
+    if isinstance(node, ast.UnaryOp):
+        return _is_numeric(node.operand)
+    if isinstance(node, ast.BinOp):
+        return _is_numeric(node.left) and _is_numeric(node.right)
+    return False
+
+
+class ListingFilter:
+    """Compiled filter expression"""
+
+    def __init__(self, expression: str) -> None:
+        """
+        Raises:
+            FilterError: if the expression is invalid or uses unknown variables
+        """
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode="eval")
+        except SyntaxError as e:
+            raise FilterError(f"Invalid filter {expression!r}: {e.msg}") from e
+
+        names = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise FilterError(
+                    f"Invalid filter {expression!r}: {type(node).__name__} is not allowed"
+                )
+            if isinstance(node, ast.BinOp) and not _is_numeric(node):
+                raise FilterError(
+                    f"Invalid filter {expression!r}: arithmetic is only allowed on numbers"
+                )
+            if isinstance(node, ast.Name):
+                if node.id not in VARIABLES:
+                    raise FilterError(
+                        f"Invalid filter {expression!r}: unknown variable {node.id!r}, "
+                        f"expected one of {', '.join(VARIABLES)}"
+                    )
+                names.add(node.id)
+            if isinstance(node, ast.Constant) and not isinstance(
+                node.value, (int, float, str, type(None))
+            ):
+                raise FilterError(
+                    f"Invalid filter {expression!r}: unsupported constant {node.value!r}"
+                )
+
+        self._code = compile(tree, "<filter>", "eval")
+        # Only the variables used by the expression are computed per listing
+        self._getters = {name: VARIABLES[name] for name in names}
+
+    def __call__(self, listing: ImmoData) -> bool:
+        """Whether the listing matches
+
+        Note:
+            Comparisons with unknown values (e.g. a price "On request") don't match.
+        """
+        variables = {name: getter(listing) for name, getter in self._getters.items()}
+        try:
+            return bool(eval(self._code, {"__builtins__": {}}, variables))
+        except (TypeError, ZeroDivisionError):
+            return False
+
+    def __repr__(self) -> str:
+        return f"ListingFilter({self.expression!r})"
+
+
+def compile_filter(expression: Optional[str]) -> Optional[ListingFilter]:
+    """Compile a filter expression, None or an empty expression matches every listing"""
+    if expression is None or not expression.strip():
+        return None
+    return ListingFilter(expression)
+
+
+def any_filter(*filters: Optional[ListingFilter]) -> Optional[ListingFilter]:
+    """Filter that matches the listings matching any of the filters
+
+    Returns:
+        ListingFilter: the combined filter, None (every listing) if any filter is None
+    """
+    if any(listing_filter is None for listing_filter in filters):
+        return None
+    return ListingFilter(" or ".join(f"({listing_filter.expression})" for listing_filter in filters))
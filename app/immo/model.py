@@ -1,8 +1,48 @@
-from dataclasses import dataclass, fields, _MISSING_TYPE
+import hashlib
+import re
 from enum import Enum
 from typing import List, Optional
 
 
+_NUMBER = re.compile(r"\d[\d'’.,]*")
+_POSTAL_CODE = re.compile(r"\b\d{4,5}\b")
+
+
+def parse_number(value) -> Optional[float]:
+    """Parse the first number of a raw or display value
+
+    Handles thousands separators and decimal commas,
+    e.g. "1'850 CHF" -> 1850.0, "€ 350.000" -> 350000.0, "3,5" -> 3.5
+
+    Returns:
+        float: the number or None if the value contains none
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER.search(str(value))
+    if match is None:
+        return None
+
+    number = match.group().replace("'", "").replace("’", "").rstrip(".,")
+    if "." in number and "," in number:
+        # The last separator is the decimal one
+        thousands = "." if number.rfind(",") > number.rfind(".") else ","
+        number = number.replace(thousands, "").replace(",", ".")
+    elif "," in number or "." in number:
+        separator = "," if "," in number else "."
+        head, _, tail = number.rpartition(separator)
+        if number.count(separator) > 1 or len(tail) == 3:
+            number = number.replace(separator, "")
+        else:
+            number = f"{head}.{tail}"
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
 class ImmoPriceKind(Enum):
     """Enumeration for the different price kinds for an Immo object"""
 
@@ -10,42 +50,247 @@ class ImmoPriceKind(Enum):
     PRICE = "Price"
 
 
-@dataclass
+# Marks typed values that weren't computed yet
+_UNSET = object()
+
+
+def _add_suffix(x, suffix) -> str:
+    """Add unit as a suffix to a given variable"""
+    if not isinstance(x, str):
+        x = str(x)
+
+    if x.isdigit():
+        x += suffix
+
+    return x
+
+
 class ImmoData:
-    title: str
-    url: str
-    images: List[str]
-    address: str = "No address"
-    price: str = "On request"
-    price_kind: ImmoPriceKind = ImmoPriceKind.RENT
-    rooms: str = "-"
-    living_space: str = "-"
-    currency: str = "CHF"
-    lister_logo_url: Optional[str] = None
-
-    def __post_init__(self):
-        # Set default values properly for None input arguments
-        # https://stackoverflow.com/a/69944614/4249857
-        for field in fields(self):
-            # Set a default value if the value of the field is None
-            if (
-                not isinstance(field.default, _MISSING_TYPE)
-                and getattr(self, field.name) is None
-            ):
-                setattr(self, field.name, field.default)
-
-        self.price = self._add_suffix(self.price, f" {self.currency}")
-        self.living_space = self._add_suffix(self.living_space, " m²")
-
-        if isinstance(self.rooms, int):
-            self.rooms = str(self.rooms)
-
-    def _add_suffix(self, x, suffix) -> str:
-        """Add unit as a suffix to a given variable"""
-        if not isinstance(x, str):
-            x = str(x)
-
-        if x.isdigit():
-            x += suffix
-
-        return x
+    """Listing parsed from a result page
+
+    The raw values of the website are kept as given, display strings
+    (e.g. "1850 CHF") and typed values (e.g. 1850.0) are derived from
+    them on first access. Most listings of a result page were already seen
+    and are discarded without ever being formatted.
+
+    A listing is immutable, its fields are read-only properties so that the
+    cached typed values can't go stale.
+    """
+
+    __slots__ = (
+        "_title",
+        "_url",
+        "_images",
+        "_price_kind",
+        "_currency",
+        "_lister_logo_url",
+        "_id",
+        "_address",
+        "_price",
+        "_rooms",
+        "_living_space",
+        "_price_value",
+        "_rooms_value",
+        "_living_space_value",
+        "_postal_code",
+    )
+
+    def __init__(
+        self,
+        title: str,
+        url: str,
+        images: List[str],
+        address: Optional[str] = None,
+        price=None,
+        price_kind: Optional[ImmoPriceKind] = None,
+        rooms=None,
+        living_space=None,
+        currency: Optional[str] = None,
+        lister_logo_url: Optional[str] = None,
+        id: Optional[str] = None,
+        price_value: Optional[float] = None,
+        rooms_value: Optional[float] = None,
+        living_space_value: Optional[float] = None,
+        postal_code: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            id: listing ID assigned by the website, the url if not given
+            price, rooms, living_space: raw values of the website (numbers or strings)
+            price_value, rooms_value, living_space_value, postal_code: typed values
+                for filtering, parsed from the raw values and the address if not given
+        """
+        self._title = title
+        self._url = url
+        self._images = images
+        self._price_kind = price_kind or ImmoPriceKind.RENT
+        self._currency = currency or "CHF"
+        self._lister_logo_url = lister_logo_url
+        self._id = url if id is None else id
+        self._address = address
+        self._price = price
+        self._rooms = rooms
+        self._living_space = living_space
+        self._price_value = _UNSET if price_value is None else price_value
+        self._rooms_value = _UNSET if rooms_value is None else rooms_value
+        self._living_space_value = _UNSET if living_space_value is None else living_space_value
+        self._postal_code = _UNSET if postal_code is None else postal_code
+
+    # Fields
+
+    @property
+    def title(self) -> str:
+        return self._title
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def images(self) -> List[str]:
+        return self._images
+
+    @property
+    def price_kind(self) -> ImmoPriceKind:
+        return self._price_kind
+
+    @property
+    def currency(self) -> str:
+        return self._currency
+
+    @property
+    def lister_logo_url(self) -> Optional[str]:
+        return self._lister_logo_url
+
+    @property
+    def id(self) -> str:
+        """Listing ID assigned by the website, defaults to the url"""
+        return self._id
+
+    # Display values
+
+    @property
+    def address(self) -> str:
+        return self._address or "No address"
+
+    @property
+    def price(self) -> str:
+        if self._price is None:
+            return "On request"
+        return _add_suffix(self._price, f" {self.currency}")
+
+    @property
+    def rooms(self) -> str:
+        if self._rooms is None:
+            return "-"
+        return str(self._rooms)
+
+    @property
+    def living_space(self) -> str:
+        if self._living_space is None:
+            return "-"
+        return _add_suffix(self._living_space, " m²")
+
+    # Typed values
+
+    @property
+    def price_value(self) -> Optional[float]:
+        if self._price_value is _UNSET:
+            self._price_value = parse_number(self._price)
+        return self._price_value
+
+    @property
+    def rooms_value(self) -> Optional[float]:
+        if self._rooms_value is _UNSET:
+            self._rooms_value = parse_number(self._rooms)
+        return self._rooms_value
+
+    @property
+    def living_space_value(self) -> Optional[float]:
+        if self._living_space_value is _UNSET:
+            self._living_space_value = parse_number(self._living_space)
+        return self._living_space_value
+
+    @property
+    def postal_code(self) -> Optional[str]:
+        if self._postal_code is _UNSET:
+            match = _POSTAL_CODE.search(self._address) if self._address else None
+            self._postal_code = match.group() if match else None
+        return self._postal_code
+
+    @property
+    def price_per_m2(self) -> Optional[float]:
+        """Price per square meter of living space"""
+        if self.price_value is None or not self.living_space_value:
+            return None
+        return self.price_value / self.living_space_value
+
+    def content_hash(self) -> str:
+        """Digest of the shown values, it changes when the listing is edited
+
+        Image URLs can carry rotating CDN tokens, only the number of images counts.
+        """
+        content = "\x1f".join(
+            str(value)
+            for value in (
+                self.title,
+                self._address,
+                self._price,
+                self._rooms,
+                self._living_space,
+                len(self.images),
+            )
+        )
+        return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+    def to_dict(self) -> dict:
+        """JSON serializable record with the raw and the typed values"""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "url": self.url,
+            "address": self._address,
+            "postal_code": self.postal_code,
+            "price": self._price,
+            "price_value": self.price_value,
+            "price_kind": self.price_kind.value,
+            "currency": self.currency,
+            "rooms": self._rooms,
+            "rooms_value": self.rooms_value,
+            "living_space": self._living_space,
+            "living_space_value": self.living_space_value,
+            "images": self.images,
+            "lister_logo_url": self.lister_logo_url,
+        }
+
+    def _raw(self) -> tuple:
+        return (
+            self.title,
+            self.url,
+            self.images,
+            self._address,
+            self._price,
+            self.price_kind,
+            self._rooms,
+            self._living_space,
+            self.currency,
+            self.lister_logo_url,
+            self.id,
+        )
+
+    def __reduce__(self):
+        # Typed values that weren't computed yet are left to the receiver
+        typed = (self._price_value, self._rooms_value, self._living_space_value, self._postal_code)
+        return self.__class__, self._raw() + tuple(None if v is _UNSET else v for v in typed)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ImmoData):
+            return NotImplemented
+        return self._raw() == other._raw()
+
+    def __repr__(self) -> str:
+        return (
+            f"ImmoData(title={self.title!r}, url={self.url!r}, address={self.address!r}, "
+            f"price={self.price!r}, rooms={self.rooms!r}, living_space={self.living_space!r}, "
+            f"id={self.id!r})"
+        )
@@ -1,390 +1,149 @@
 """Parsing for immobilien websites"""
-import json
-import re
-from typing import List
-
-from bs4 import BeautifulSoup
+import operator
+from functools import reduce
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
 
 from app import setup_custom_logger
+from app.immo import sites  # noqa: F401 (registers the parser specs)
 from app.immo.error import ImmoParserError
-from app.immo.model import ImmoData, ImmoPriceKind
+from app.immo.model import ImmoData
+from app.immo.registry import SiteParser, get_parser
+from app.immo.stream import array_span, iter_array
 from app.immo.website import ImmoWebsite
-from app.utils.image import scaled_image_size
+
+if TYPE_CHECKING:
+    # bs4 is only imported by the fallback, see ImmoParser.parse
+    from bs4 import BeautifulSoup
 
 
 logger = setup_custom_logger(__name__)
 
 
 class ImmoParser:
-    """Parse different HTML Immo website listings"""
+    """Parse different HTML Immo website listings
 
-    @staticmethod
-    def _parse_immoscout24(html: BeautifulSoup) -> List[ImmoData]:
-        """Parse immoscout24.ch listings
+    The website specific parts are declared in app.immo.sites.
+    """
 
-        Returns:
-            list[ImmoData]: ImmoData of listings on the immo website
-        """
-        # try to get the json that is inside of a specific script tag
-        json_raw_data = html.find(
-            lambda tag: tag.name == "script" and \
-            tag.string and \
-            tag.string.startswith("window.__INITIAL_STATE__=")
-        ).text.lstrip("window.__INITIAL_STATE__=")
+    @staticmethod
+    def _parse_listings(parser: SiteParser, listings) -> Iterator[ImmoData]:
+        parse_listing = parser.parse_listing
+        for listing in listings:
+            if (immo_data := parse_listing(listing)) is not None:
+                yield immo_data
 
-        # cleaning up not needed so just load the json
-        listings_json = json.loads(json_raw_data)
+    @staticmethod
+    def _load_json(website: ImmoWebsite, script_text: str) -> dict:
+        """Clean up the website specific quirks of the script body and decode it"""
+        return get_parser(website).load_json(script_text)
 
+    @classmethod
+    def _parse_listings_json(cls, website: ImmoWebsite, listings_json: dict) -> List[ImmoData]:
+        """Parse the listings of the fully decoded listings json"""
+        parser = get_parser(website)
         try:
-            listings = listings_json["resultList"]["search"]["fullSearch"]["result"]["listings"]
-
-        except KeyError:
+            listings = reduce(operator.getitem, parser.spec.listings_path, listings_json)
+        except (KeyError, TypeError):
             raise ImmoParserError("Listings json path changed.")
 
-        immo_data_list = []
-        for listing in listings:
-            if lister_logo_url := listing.get("listerBranding"):
-                lister_logo_url = lister_logo_url.get("logoUrl")
-
-            # unwrap the listing
-            listing = listing["listing"]
-            primary_localization = listing["localization"]["primary"]
-            try:
-                title = listing["localization"][primary_localization]["text"]["title"]
-                loc = listing["address"]["locality"]
-                plz = listing["address"]["postalCode"]
-                street = listing["address"]["street"]
-                address = f"{street}, {plz} {loc}"
-            except KeyError:
-                address = None
-                title = "Wohnung"
-            url = f"/rent/{listing.get('id')}"
-            rent = listing.get("prices").get("rent").get("gross") # gross
-            rooms = listing.get("characteristics").get("numberOfRooms")
-            living_space = listing.get("characteristics").get("livingSpace")
+        return list(cls._parse_listings(parser, listings))
 
-            attachments = listing["localization"][primary_localization].get("attachments") or []
-            images = [
-                attachment["url"].encode().decode("unicode-escape")
-                for attachment in attachments
-                if attachment["type"] == "IMAGE"
-            ]
-
-            immo_data_list.append(
-                ImmoData(
-                    title=title,
-                    address=address,
-                    url=url,
-                    price=rent,
-                    rooms=rooms,
-                    living_space=living_space,
-                    images=images,
-                    lister_logo_url=lister_logo_url
-                )
-            )
-
-        return immo_data_list
+    @classmethod
+    def iter_listings(
+        cls, website: ImmoWebsite, script_text: str, start: Optional[int] = None
+    ) -> Iterator[ImmoData]:
+        """Decode only the listings of the script body and yield them one by one
 
-    @staticmethod
-    def _parse_immoscout24_old(html: BeautifulSoup) -> List[ImmoData]:
-        """DEPRECATED, worked for older version of immoscout24.ch
+        Note:
+            The rest of the page state is skipped without being decoded.
 
-        Parse immoscout24.ch listings
+        Args:
+            website: website the script belongs to
+            script_text: body of the listings <script>
+            start: position of the listings array, see `listings_span`
 
-        Returns:
-            list[ImmoData]: ImmoData of listings on the immo website
+        Raises:
+            ImmoParserError: if there is no parser for the website or the
+                             listings can't be found in the JSON
+            ValueError: if the JSON is malformed
         """
-        json_data_raw = html.find("script", {"id": "state"}).text.lstrip(
-            "__INITIAL_STATE__="
-        )
-        # This data contains obfuscated js code, need to clean it up first
-        json_data_clean = re.sub(
-            pattern='("insertion":{.*)("maxPriceCalculator")',
-            repl="\\2",
-            string=json_data_raw,
-        )
-        json_data_clean = re.sub(
-            pattern=":undefined", repl=":null", string=json_data_clean
+        parser = get_parser(website)
+        yield from cls._parse_listings(
+            parser, iter_array(script_text, parser.spec.listings_path, start)
         )
-        listings_json = json.loads(json_data_clean)
-        try:
-            listings = listings_json["pages"]["searchResult"]["resultData"]["listData"]
-        except KeyError:
-            raise ImmoParserError("Listings json path changed.")
 
-        immo_data_list = []
-        for listing in listings:
-            title = listing.get("title", "Wohnung")
-            try:
-                loc = listing["cityName"]
-                plz = listing["zip"]
-                street = listing["street"]
-                state = listing["stateShort"]
-                address = f"{street}, {plz} {loc}, {state}"
-            except KeyError:
-                address = None
-            url = listing.get("propertyUrl")
-            rent = listing.get("price")
-            rooms = listing.get("numberOfRooms")
-            living_space = listing.get("surfaceLiving")
-
-            images = []
-            for img in listing.get("images", []):
-                # Need to set a valid size for the image to load (less than 1280x720)
-                width, height = scaled_image_size(
-                    img.get("originalWidth", 0), img.get("originalHeight", 0), 1280, 720
-                )
-                if img.get("url"):
-                    images.append(
-                        img["url"]
-                        .replace("{width}", str(width), 1)
-                        .replace("{height}", str(height), 1)
-                        .replace("{resizemode}", "3", 1)
-                        .replace("{quality}", "90", 1)
-                    )
+    @classmethod
+    def listings_span(cls, website: ImmoWebsite, script_text: str) -> Tuple[int, int]:
+        """Find the listings array of the script body without decoding anything
 
-            immo_data_list.append(
-                ImmoData(
-                    title=title,
-                    address=address,
-                    url=url,
-                    price=rent,
-                    rooms=rooms,
-                    living_space=living_space,
-                    images=images,
-                )
-            )
+        Returns:
+            tuple: start and end of the listings JSON, e.g. to digest the listings
+                   without the volatile rest of the page state
 
-        return immo_data_list
+        Raises:
+            ImmoParserError: if there is no parser for the website or the
+                             listings can't be found in the JSON
+            ValueError: if the JSON is malformed
+        """
+        return array_span(script_text, get_parser(website).spec.listings_path)
 
-    @staticmethod
-    def _parse_homegate(html: BeautifulSoup) -> List[ImmoData]:
-        """Parse homegate.ch listings
+    @classmethod
+    def parse_html(cls, website: ImmoWebsite, html: "BeautifulSoup") -> list[ImmoData]:
+        """Select the correct parser and parse the given html
 
         Returns:
-            list[ImmoData]: ImmoData of listings on the immo website
+            list[immo_data]: list of data about each listing
         """
-        script_tags = html.find_all("script")
-        text_to_lstrip = "window.__INITIAL_STATE__="
-        listings_json = None
-        for script_tag in script_tags:
-            if script_tag.text.startswith(text_to_lstrip):
-                listings_json = json.loads(script_tag.text.lstrip(text_to_lstrip))
-
-        if listings_json is None:
+        script_text = get_parser(website).extract_script_soup(html)
+        if script_text is None:
             raise ImmoParserError(
-                "Can't find homegate.ch <script> with JSON data in HTML"
+                f"Can't find {website.value} <script> with JSON data in HTML"
             )
 
-        try:
-            listings = listings_json["resultList"]["search"]["fullSearch"]["result"][
-                "listings"
-            ]
-        except KeyError:
-            raise ImmoParserError("Listings json path changed.")
-        except TypeError as e:
-            raise ImmoParserError(str(e))
+        return cls._parse_listings_json(website, cls._load_json(website, script_text))
 
-        immo_data_list = []
-        for listing in listings:
-            try:
-                listing = listing["listing"]
-                localization = listing["localization"]
-                primary_key = localization["primary"]
-                title = localization[primary_key]["text"]["title"]
-                attachments = localization[primary_key].get("attachments") or []
-                images = [
-                    attachment["url"].encode().decode("unicode-escape")
-                    for attachment in attachments
-                    if attachment["type"] == "IMAGE"
-                ]
-                address = None
-                try:
-                    loc = listing["address"]["locality"]
-                    plz = listing["address"]["postalCode"]
-                    street = listing["address"]["street"]
-                    address = f"{street}, {plz} {loc}"
-                except KeyError:
-                    pass
-                url = f"/rent/{listing['id']}"
-                rent = listing["prices"]["rent"].get("gross")
-                rooms, living_space = None, None
-                if characteristics := listing.get("characteristics"):
-                    rooms = str(characteristics.get("numberOfRooms"))
-                    living_space = characteristics.get("livingSpace")
-
-                immo_data_list.append(
-                    ImmoData(
-                        title=title,
-                        address=address,
-                        url=url,
-                        price=rent,
-                        rooms=rooms,
-                        living_space=living_space,
-                        images=images,
-                    )
-                )
-            except KeyError:
-                logger.error("homegate.ch key error: %s", listing)
-                continue
-
-        return immo_data_list
-
-    @staticmethod
-    def _parse_immobilienscout24at(html: BeautifulSoup) -> List[ImmoData]:
-        """Parse immobilienscout24.at listings
-
-        Note:
-            Similar to immoscout24.ch
-
-        Returns:
-            list[ImmoData]: ImmoData of listings on the immo website
-        """
-        json_data_raw = html.find("script").text.lstrip("window.__INITIAL_STATE__=")
-        json_data_clean = re.sub(
-            pattern=":undefined", repl=":null", string=json_data_raw
-        )
-        # Remove script commands
-        json_data_clean = re.sub(
-            pattern="window\.[^\n]+", repl="", string=json_data_clean
-        )
-        listings_json = json.loads(json_data_clean)
-        try:
-            listings = listings_json["reduxAsyncConnect"]["pageData"]["results"]["hits"]
-        except KeyError:
-            raise ImmoParserError("Listings json path changed.")
-
-        immo_data_list = []
-        for listing in listings:
-            title = listing.get("headline", "Object")
-            address = listing.get("addressString")
-            url = "/"
-            if links := listing.get("links"):
-                url = links.get("targetURL")
-            # Price
-            price = None
-            if price_key_facts := listing.get("priceKeyFacts"):
-                price = price_key_facts[0].get("value")
-
-            rooms, living_space = None, None
-            if main_key_facts := listing.get("mainKeyFacts"):
-                for fact in main_key_facts:
-                    if label := fact.get("label"):
-                        if label == "Zimmer":
-                            rooms = fact.get("value")
-                        elif label == "Fläche":
-                            living_space = fact.get("value")
-
-            images = []
-            if image_props := listing.get("primaryPictureImageProps"):
-                for source in image_props.get("sources", []):
-                    if type := source.get("type"):
-                        if type == "image/jpeg":
-                            if media := source.get("media"):
-                                if media == "(max-width: 1023px)":
-                                    if src := source.get("srcSet"):
-                                        src = src.split()[0]
-                                        images.append(src)
-                                        break
-                # Use "src" if the max-width image is not available
-                if not images:
-                    if src_image_url := image_props.get("src"):
-                        images.append(src_image_url)
-
-            immo_data_list.append(
-                ImmoData(
-                    title=title,
-                    address=address,
-                    url=url,
-                    price=price,
-                    price_kind=ImmoPriceKind.PRICE,
-                    currency="€",
-                    rooms=rooms,
-                    living_space=living_space,
-                    images=images,
-                )
-            )
-
-        return immo_data_list
+    @classmethod
+    def extract_script(cls, website: ImmoWebsite, content: bytes) -> Optional[str]:
+        """Return the body of the <script> with the listings JSON without parsing the HTML
 
-    @staticmethod
-    def _parse_immoweltat(html: BeautifulSoup) -> List[ImmoData]:
-        """Parse immowelt.at listings
+        Raises:
+            ImmoParserError: if there is no parser for the website
 
         Returns:
-            list[ImmoData]: ImmoData of listings on the immo website
+            str: contents of the script tag or None if it can't be found in the raw bytes
         """
-        json_data = (
-            html.find("script", {"type": "application/json"})
-            .text.lstrip("<!--")
-            .rstrip("-->")
-        )
-        listings_json = json.loads(json_data)
-        try:
-            listings = listings_json["initialState"]["estateSearch"]["data"]["estates"]
-        except KeyError:
-            raise ImmoParserError("Listings json path changed.")
-
-        immo_data_list = []
-        for listing in listings:
-            title = listing.get("title", "Object")
-            address = None
-            if place := listing.get("place"):
-                address = place.get("city")
-            url = "/"
-            if online_id := listing.get("onlineId"):
-                url = f"/expose/{online_id}"
-            price = None
-            if primary_price := listing.get("primaryPrice"):
-                price = primary_price.get("amountMin") or primary_price.get("amountMax")
-
-            rooms = listing.get("roomsMin") or listing.get("roomsMax")
-            living_space = None
-            if primary_area := listing.get("primaryArea"):
-                living_space = primary_area.get("sizeMin") or primary_area.get(
-                    "sizeMax"
-                )
-
-            images = []
-            if pictures := listing.get("pictures"):
-                for picture in pictures:
-                    if image_url := picture.get("imageUri"):
-                        images.append(image_url)
+        return get_parser(website).extract_script(content)
 
-            immo_data_list.append(
-                ImmoData(
-                    title=title,
-                    address=address,
-                    url=url,
-                    price=price,
-                    price_kind=ImmoPriceKind.PRICE,
-                    currency="€",
-                    rooms=rooms,
-                    living_space=living_space,
-                    images=images,
-                )
-            )
+    @classmethod
+    def parse(
+        cls, website: ImmoWebsite, content: bytes, script_text: Optional[str] = None
+    ) -> list[ImmoData]:
+        """Parse the raw HTML response of a website
 
-        return immo_data_list
+        Note:
+            The listings <script> is sliced out of the bytes directly which avoids
+            building the whole HTML tree, and only its listings are decoded.
+            BeautifulSoup is only used as a fallback when the fast path can't
+            find or decode the script.
 
-    @classmethod
-    def parse_html(cls, website: ImmoWebsite, html: BeautifulSoup) -> list[ImmoData]:
-        """Select the correct parser and parse the given html
+        Args:
+            website: website the content was downloaded from
+            content: raw HTML
+            script_text: result of `extract_script` if it was already called
 
         Returns:
             list[immo_data]: list of data about each listing
         """
-        match website:
-            case ImmoWebsite.IMMOSCOUT24:
-                results = cls._parse_immoscout24(html)
-            case ImmoWebsite.HOMEGATE:
-                results = cls._parse_homegate(html)
-            case ImmoWebsite.IMMOBILIENSCOUT24AT:
-                results = cls._parse_immobilienscout24at(html)
-            case ImmoWebsite.IMMOWELTAT:
-                results = cls._parse_immoweltat(html)
+        if script_text is None:
+            script_text = cls.extract_script(website, content)
+        if script_text is not None:
+            try:
+                return list(cls.iter_listings(website, script_text))
+            except ValueError:
+                logger.debug("%s fast path JSON decode failed", website.value)
 
-        for immo_data in results:
-            immo_data.url = f"https://{website.value}{immo_data.url}"
+        logger.debug("%s falling back to BeautifulSoup", website.value)
+        from bs4 import BeautifulSoup
 
-        return results
+        html = BeautifulSoup(content.decode("utf-8"), "html.parser")
+        return cls.parse_html(website, html)
@@ -0,0 +1,134 @@
+"""Parsing of result pages off the event loop"""
+import asyncio
+import hashlib
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from app import setup_custom_logger
+from app.immo.model import ImmoData
+from app.immo.parser import ImmoParser
+from app.immo.website import ImmoWebsite
+from app.metrics import ERRORS
+
+
+logger = setup_custom_logger(__name__)
+
+
+# Characters of the listings JSON that are encoded and digested at a time
+_DIGEST_CHUNK = 64 * 1024
+
+
+def _digest_text(text: str, start: int, end: int) -> str:
+    """Digest of text[start:end], encoded in chunks instead of copying the whole span"""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk_start in range(start, end, _DIGEST_CHUNK):
+        digest.update(text[chunk_start:min(chunk_start + _DIGEST_CHUNK, end)].encode())
+    return digest.hexdigest()
+
+
+def parse_page(
+    website: ImmoWebsite, content: bytes, previous_digest: Optional[str] = None
+) -> Tuple[str, Optional[List[ImmoData]]]:
+    """Digest and parse a result page
+
+    Note:
+        Runs in a worker, only the digest and the listings are sent back.
+        Only the listings JSON is digested, the rest of the page state
+        changes with every request (tracking, timestamps, request IDs).
+
+    Args:
+        website: website the page belongs to
+        content: raw HTML of the page
+        previous_digest: digest of the page's listings JSON at the last scrape
+
+    Returns:
+        tuple: digest of the listings JSON and the listings,
+               or None instead of the listings if the digest didn't change
+    """
+    script_text = ImmoParser.extract_script(website, content)
+    if script_text is not None:
+        try:
+            start, end = ImmoParser.listings_span(website, script_text)
+            digest = _digest_text(script_text, start, end)
+            if digest == previous_digest:
+                return digest, None
+            return digest, list(ImmoParser.iter_listings(website, script_text, start))
+        except ValueError:
+            # Malformed JSON, parsed by the BeautifulSoup fallback below
+            pass
+
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    if digest == previous_digest:
+        return digest, None
+    return digest, ImmoParser.parse(website, content, script_text=script_text)
+
+
+class ParserPool:
+    """Run `parse_page` on a process or thread pool
+
+    At most `max_pending` pages are handed to the pool at a time, further
+    pages wait for a free slot so that downloaded pages don't pile up in
+    memory when parsing falls behind. A process pool whose worker died
+    (e.g. killed for running out of memory) is replaced by a fresh one.
+    """
+
+    kinds = ("process", "thread", "inline")
+
+    def __init__(self, kind: str = "process", workers: Optional[int] = None, max_pending: int = 8) -> None:
+        """
+        Args:
+            kind: "process", "thread" or "inline" (parse on the event loop)
+            workers: number of workers (default: decided by the executor)
+            max_pending: maximum number of pages queued or being parsed
+        """
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown parser pool {kind!r}, expected one of {self.kinds}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max(max_pending, 1)
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="parser"
+                )
+        return self._executor
+
+    async def parse(
+        self, website: ImmoWebsite, content: bytes, previous_digest: Optional[str] = None
+    ) -> Tuple[str, Optional[List[ImmoData]]]:
+        """Parse a result page in the pool, see `parse_page`"""
+        if self.kind == "inline":
+            return parse_page(website, content, previous_digest)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(
+                    executor, parse_page, website, content, previous_digest
+                )
+            except BrokenProcessPool as e:
+                ERRORS.inc(type=type(e).__name__)
+                logger.error("Parser pool broke (%r), retrying on a new pool", e)
+                # Pages parsed at the same time fail as well, only the first replaces it
+                if self._executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+                return await loop.run_in_executor(
+                    self._get_executor(), parse_page, website, content, previous_digest
+                )
+
+    def close(self):
+        """Shut the workers down"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,517 @@
+"""Declarative per-website parser specs
+
+Every website declares once where its listings JSON is (script marker and
+key path) and where each listing field is inside a listing. `register`
+compiles the field declarations of a spec into a listing parser made of
+getter closures. The getters are specialized for the common shapes (a key
+of the listing, a key of a nested object, alternative keys of the same
+object) and a url formatted from the ID's key reuses the ID lookup, so a
+field costs about as much as a hand-written lookup plus one call. Adding a
+website is one `SiteSpec`.
+"""
+import json
+import re
+from operator import itemgetter, methodcaller
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from app import setup_custom_logger
+from app.immo.error import ImmoParserError
+from app.immo.model import ImmoData, ImmoPriceKind
+from app.immo.website import ImmoWebsite
+
+
+logger = setup_custom_logger(__name__)
+
+# Script marker of the websites that assign their state to a global variable
+INITIAL_STATE_MARKER = b"window.__INITIAL_STATE__="
+
+# Errors of a lookup that doesn't match the listing (missing key, short list, null on the way)
+_LOOKUP_ERRORS = (KeyError, IndexError, TypeError)
+
+# Keyword arguments of ImmoData that can be declared as fields
+FIELDS = (
+    "title",
+    "url",
+    "images",
+    "address",
+    "price",
+    "rooms",
+    "living_space",
+    "lister_logo_url",
+    "id",
+)
+
+
+class Ref:
+    """Key of a path that is looked up in the listing, e.g. the primary language"""
+
+    def __init__(self, *path: Union[str, int]) -> None:
+        self.path = path
+
+
+KeyPath = Tuple[Union[str, int, Ref], ...]
+
+
+class Field:
+    """Where a listing field is in the listing JSON"""
+
+    def __init__(
+        self,
+        *paths: KeyPath,
+        default: Any = None,
+        template: Optional[str] = None,
+        convert: Optional[Callable[[Any], Any]] = None,
+        required: bool = False,
+    ) -> None:
+        """
+        Args:
+            paths: key paths into the listing, the first truthy value of them is used
+            default: value if none of the paths is in the listing
+            template: str.format template that all path values are formatted into,
+                the default is used if any of them is missing
+            convert: applied to the found value (not to the default)
+            required: listings without the field are skipped
+        """
+        self.paths = paths
+        self.default = default
+        self.template = template
+        self.convert = convert
+        self.required = required
+
+
+class SiteSpec:
+    """Declaration of a website's result page"""
+
+    def __init__(
+        self,
+        website: ImmoWebsite,
+        listings_path: List[str],
+        fields: Dict[str, Union[Field, Callable[[dict], Any]]],
+        state_marker: bytes = INITIAL_STATE_MARKER,
+        json_script: bool = False,
+        last_script: bool = False,
+        cleanup: Optional[Callable[[str], str]] = None,
+        price_kind: ImmoPriceKind = ImmoPriceKind.RENT,
+        currency: str = "CHF",
+    ) -> None:
+        """
+        Args:
+            website: the website
+            listings_path: keys from the root of the page state to the listings array
+            fields: ImmoData field -> Field or function of the listing (which
+                has to handle missing keys itself)
+            state_marker: start of the <script> body that holds the page state
+            json_script: the page state is the body of a <script type="application/json">
+                instead of a script that starts with `state_marker`
+            last_script: use the last matching script if there are several
+            cleanup: makes the script body valid JSON for a full decode
+            price_kind: kind of the prices
+            currency: currency of the prices
+        """
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"{website.value}: unknown fields {', '.join(sorted(unknown))}")
+        if "title" not in fields or "url" not in fields:
+            raise ValueError(f"{website.value}: title and url have to be declared")
+        self.website = website
+        self.listings_path = listings_path
+        self.fields = fields
+        self.state_marker = state_marker
+        self.json_script = json_script
+        self.last_script = last_script
+        self.cleanup = cleanup
+        self.price_kind = price_kind
+        self.currency = currency
+
+
+class _MissingField(Exception):
+    """A required field isn't in the listing"""
+
+
+# Parent of a key path that isn't in the listing
+_EMPTY: dict = {}
+
+
+def _getter(path: KeyPath) -> Callable[[Any], Any]:
+    """Function that indexes along the path into the listing
+
+    Raises:
+        KeyError, IndexError, TypeError: if the listing doesn't have the path
+    """
+    if not any(isinstance(key, Ref) for key in path):
+        if len(path) == 1:
+            return itemgetter(path[0])
+        keys = tuple(path)
+
+        def get(listing):
+            for key in keys:
+                listing = listing[key]
+            return listing
+
+        return get
+
+    # A Ref key is looked up from the root of the listing first
+    steps = tuple(
+        (_getter(key.path), None) if isinstance(key, Ref) else (None, key) for key in path
+    )
+
+    def get_with_refs(listing):
+        value = listing
+        for ref, key in steps:
+            value = value[ref(listing) if ref is not None else key]
+        return value
+
+    return get_with_refs
+
+
+def _optional_getter(path: KeyPath) -> Callable[[Any], Any]:
+    """Function that returns the value at the path or None if the listing doesn't have it
+
+    Paths of object keys are walked with `.get()`, a missing key doesn't raise.
+
+    Raises:
+        AttributeError: if a value on the way isn't an object
+    """
+    if not all(isinstance(key, str) for key in path):
+        getter = _getter(path)
+
+        def get_or_none(listing):
+            try:
+                return getter(listing)
+            except _LOOKUP_ERRORS:
+                return None
+
+        return get_or_none
+
+    if not path:
+        return lambda listing: listing
+    if len(path) == 1:
+        return methodcaller("get", path[0])
+    first, *rest = path
+    if len(rest) == 1:
+        last = rest[0]
+        return lambda listing: (listing.get(first) or _EMPTY).get(last)
+
+    def get(listing):
+        value = listing.get(first)
+        for key in rest:
+            value = (value or _EMPTY).get(key)
+        return value
+
+    return get
+
+
+def _missing_getter(name: str, field: Field) -> Callable[[dict], Any]:
+    """Function of the listing that handles a field that isn't in it
+
+    Raises:
+        _MissingField: if the field is required
+    """
+    default = field.default
+    if field.required:
+
+        def missing(listing):
+            raise _MissingField(name)
+
+        return missing
+    return lambda listing: default
+
+
+def _formatter(template: str) -> Callable[..., str]:
+    """str.format of the template, a single placeholder is formatted by concatenation"""
+    prefix, *rest = template.split("{}")
+    if len(rest) != 1 or "{" in prefix + rest[0] or "}" in prefix + rest[0]:
+        return template.format
+    suffix = rest[0]
+    return lambda value: f"{prefix}{value}{suffix}"
+
+
+def _field_getter(name: str, field: Field) -> Callable[[dict], Any]:
+    """Function of the listing that returns the field's value
+
+    Returns the default if the field isn't in the listing.
+
+    Raises:
+        _MissingField: if a required field isn't in the listing
+    """
+    convert = field.convert
+    missing = _missing_getter(name, field)
+
+    if field.template is not None:
+        getters = [_getter(path) for path in field.paths]
+        template = _formatter(field.template)
+
+        def get_template(listing):
+            try:
+                values = []
+                for getter in getters:
+                    values.append(getter(listing))
+                value = template(*values)
+            except _LOOKUP_ERRORS:
+                return missing(listing)
+            return value if convert is None else convert(value)
+
+        return get_template
+
+    if len(field.paths) == 1:
+        path = field.paths[0]
+        if len(path) == 1 and isinstance(path[0], str):
+            key = path[0]
+
+            def get_key(listing):
+                # A null value counts as missing
+                if (value := listing.get(key)) is None:
+                    return missing(listing)
+                return value if convert is None else convert(value)
+
+            return get_key
+
+        if len(path) == 2 and all(isinstance(key, str) for key in path):
+            parent_key, key = path
+
+            def get_child_key(listing):
+                try:
+                    value = (listing.get(parent_key) or _EMPTY).get(key)
+                except AttributeError:
+                    value = None
+                if value is None:
+                    return missing(listing)
+                return value if convert is None else convert(value)
+
+            return get_child_key
+
+        getter = _optional_getter(path)
+
+        def get(listing):
+            try:
+                value = getter(listing)
+            except AttributeError:
+                value = None
+            if value is None:
+                return missing(listing)
+            return value if convert is None else convert(value)
+
+        return get
+
+    parents = {path[:-1] for path in field.paths}
+    if len(parents) == 1 and all(isinstance(path[-1], str) for path in field.paths):
+        # Alternative keys of the same object, e.g. a minimum and a maximum
+        parent_path = parents.pop()
+        get_parent = _optional_getter(parent_path)
+        keys = [path[-1] for path in field.paths]
+
+        def get_first_key(listing):
+            # First truthy value of the keys
+            try:
+                if parent := get_parent(listing):
+                    for key in keys:
+                        if value := parent.get(key):
+                            return value if convert is None else convert(value)
+            except AttributeError:
+                pass
+            return missing(listing)
+
+        return get_first_key
+
+    getters = [_optional_getter(path) for path in field.paths]
+
+    def get_first(listing):
+        # First truthy value of the paths
+        for getter in getters:
+            try:
+                value = getter(listing)
+            except AttributeError:
+                continue
+            if value:
+                return value if convert is None else convert(value)
+        return missing(listing)
+
+    return get_first
+
+
+def _none(listing: dict) -> None:
+    """Getter of an undeclared field"""
+    return None
+
+
+def _url_id_getter(spec: SiteSpec) -> Callable[[dict], Tuple[Any, Any]]:
+    """Function of the listing that returns its url and ID
+
+    A url that is a template of the ID's key path (e.g. "/rent/{}") is
+    formatted from the same lookup instead of walking the path twice.
+    """
+    url, listing_id = spec.fields["url"], spec.fields.get("id")
+    if not (
+        isinstance(url, Field)
+        and isinstance(listing_id, Field)
+        and url.template is not None
+        and len(url.paths) == 1
+        and listing_id.template is None
+        and listing_id.paths == url.paths
+    ):
+        get_url = _field_getter("url", url) if isinstance(url, Field) else url
+        if listing_id is None:
+            get_id = _none
+        else:
+            get_id = _field_getter("id", listing_id) if isinstance(listing_id, Field) else listing_id
+        return lambda listing: (get_url(listing), get_id(listing))
+
+    getter = _getter(url.paths[0])
+    template, url_convert, id_convert = _formatter(url.template), url.convert, listing_id.convert
+    get_missing_url = _missing_getter("url", url)
+    get_missing_id = _missing_getter("id", listing_id)
+
+    def get_url_id(listing):
+        try:
+            value = getter(listing)
+        except _LOOKUP_ERRORS:
+            return get_missing_url(listing), get_missing_id(listing)
+        url = template(value)
+        if url_convert is not None:
+            url = url_convert(url)
+        # A null ID counts as missing
+        if value is None:
+            return url, get_missing_id(listing)
+        return url, value if id_convert is None else id_convert(value)
+
+    return get_url_id
+
+
+def compile_listing_parser(spec: SiteSpec) -> Callable[[dict], Optional[ImmoData]]:
+    """Compile the field declarations of a spec into a listing parser
+
+    Returns:
+        function: listing JSON -> ImmoData with the absolute url, or None if a
+                  required field is missing
+    """
+
+    def getter(name: str) -> Callable[[dict], Any]:
+        # A function field is its own getter
+        if (field := spec.fields.get(name)) is None:
+            return _none
+        return _field_getter(name, field) if isinstance(field, Field) else field
+
+    get_url_id = _url_id_getter(spec)
+    get_title = getter("title")
+    get_images = getter("images")
+    get_address = getter("address")
+    get_price = getter("price")
+    get_rooms = getter("rooms")
+    get_living_space = getter("living_space")
+    get_lister_logo_url = getter("lister_logo_url")
+    price_kind = spec.price_kind
+    currency = spec.currency
+    website = spec.website.value
+    base_url = f"https://{website}"
+
+    def parse_listing(listing: dict) -> Optional[ImmoData]:
+        try:
+            url, listing_id = get_url_id(listing)
+            return ImmoData(
+                get_title(listing),
+                base_url + url,
+                get_images(listing),
+                get_address(listing),
+                get_price(listing),
+                price_kind,
+                get_rooms(listing),
+                get_living_space(listing),
+                currency,
+                get_lister_logo_url(listing),
+                # None if the website has no listing ID, the url identifies the listing then
+                listing_id,
+            )
+        except _MissingField as e:
+            logger.error("%s listing without %s: %s", website, e, listing)
+            return None
+
+    parse_listing.__doc__ = f"Parse a single {website} listing"
+    return parse_listing
+
+
+class SiteParser:
+    """A registered spec together with its compiled listing parser"""
+
+    def __init__(self, spec: SiteSpec) -> None:
+        self.spec = spec
+        self.parse_listing = compile_listing_parser(spec)
+        self._script_tag = re.compile(rb'<script[^>]*type="application/json"[^>]*>')
+
+    def extract_script(self, content: bytes) -> Optional[str]:
+        """Slice the listings <script> body straight out of the raw response bytes
+
+        Returns:
+            str: contents of the script tag or None if the marker wasn't found
+        """
+        spec = self.spec
+        if spec.json_script:
+            matches = list(self._script_tag.finditer(content)) if spec.last_script else [
+                self._script_tag.search(content)
+            ]
+            if not matches or matches[-1] is None:
+                return None
+            start = matches[-1].end()
+        else:
+            find = content.rfind if spec.last_script else content.find
+            start = find(spec.state_marker)
+            if start == -1:
+                return None
+            start += len(spec.state_marker)
+
+        end = content.find(b"</script>", start)
+        if end == -1:
+            return None
+        return content[start:end].decode("utf-8")
+
+    def extract_script_soup(self, html) -> Optional[str]:
+        """Find the listings <script> body in a parsed HTML tree
+
+        Returns:
+            str: contents of the script tag or None if it wasn't found
+        """
+        if self.spec.json_script:
+            script_tags = html.find_all("script", {"type": "application/json"})
+            return script_tags[-1 if self.spec.last_script else 0].text if script_tags else None
+
+        marker = self.spec.state_marker.decode()
+        script_texts = [
+            script_tag.text[len(marker):]
+            for script_tag in html.find_all("script")
+            if script_tag.text.startswith(marker)
+        ]
+        if not script_texts:
+            return None
+        return script_texts[-1 if self.spec.last_script else 0]
+
+    def load_json(self, script_text: str) -> dict:
+        """Clean up the website specific quirks of the script body and decode it"""
+        if self.spec.cleanup is not None:
+            script_text = self.spec.cleanup(script_text)
+        return json.loads(script_text)
+
+
+_REGISTRY: Dict[ImmoWebsite, SiteParser] = {}
+
+
+def register(spec: SiteSpec) -> SiteParser:
+    """Compile and register the spec of a website, it replaces an earlier one"""
+    parser = _REGISTRY[spec.website] = SiteParser(spec)
+    return parser
+
+
+def get_parser(website: ImmoWebsite) -> SiteParser:
+    """
+    Raises:
+        ImmoParserError: if no spec is registered for the website
+    """
+    try:
+        return _REGISTRY[website]
+    except KeyError:
+        supported = ", ".join(website.value for website in _REGISTRY)
+        raise ImmoParserError(
+            f"No parser available for {website.value}, supported websites: {supported}"
+        ) from None
+
+
+def registered_websites() -> Iterable[ImmoWebsite]:
+    return tuple(_REGISTRY)
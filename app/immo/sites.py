@@ -0,0 +1,161 @@
+"""Parser specs of the supported immo websites
+
+Importing this module registers the specs, see app.immo.registry.
+"""
+import re
+from typing import List, Optional
+
+from app.immo.model import ImmoPriceKind
+from app.immo.registry import Field, Ref, SiteSpec, register
+from app.immo.website import ImmoWebsite
+
+
+# homegate.ch and immoscout24.ch
+
+
+def _smg_images(listing: dict) -> List[str]:
+    try:
+        localization = listing["listing"]["localization"]
+        attachments = localization[localization["primary"]].get("attachments") or []
+    except (KeyError, TypeError):
+        return []
+    return [
+        # Most URLs have nothing to unescape
+        url.encode().decode("unicode-escape") if "\\" in (url := attachment["url"]) else url
+        for attachment in attachments
+        if attachment["type"] == "IMAGE"
+    ]
+
+
+_SMG_PRIMARY = Ref("listing", "localization", "primary")
+
+_SMG_FIELDS = dict(
+    title=Field(("listing", "localization", _SMG_PRIMARY, "text", "title"), default="Wohnung"),
+    address=Field(
+        ("listing", "address", "street"),
+        ("listing", "address", "postalCode"),
+        ("listing", "address", "locality"),
+        template="{}, {} {}",
+    ),
+    url=Field(("listing", "id"), template="/rent/{}", required=True),
+    price=Field(("listing", "prices", "rent", "gross")),
+    rooms=Field(("listing", "characteristics", "numberOfRooms")),
+    living_space=Field(("listing", "characteristics", "livingSpace")),
+    images=_smg_images,
+    id=Field(("listing", "id"), convert=str, required=True),
+)
+
+register(
+    SiteSpec(
+        ImmoWebsite.IMMOSCOUT24,
+        listings_path=["resultList", "search", "fullSearch", "result", "listings"],
+        fields=dict(
+            _SMG_FIELDS,
+            lister_logo_url=Field(("listerBranding", "logoUrl")),
+        ),
+    )
+)
+
+register(
+    SiteSpec(
+        ImmoWebsite.HOMEGATE,
+        listings_path=["resultList", "search", "fullSearch", "result", "listings"],
+        fields=dict(
+            _SMG_FIELDS,
+            rooms=Field(("listing", "characteristics", "numberOfRooms"), convert=str),
+        ),
+        # homegate.ch can contain the state more than once, the last one wins
+        last_script=True,
+    )
+)
+
+
+# immobilienscout24.at
+
+
+def _key_fact(label: str):
+    """Value of the main key fact with the given label"""
+
+    def key_fact(listing: dict) -> Optional[str]:
+        for fact in listing.get("mainKeyFacts") or []:
+            if fact.get("label") == label:
+                return fact.get("value")
+        return None
+
+    return key_fact
+
+
+def _immobilienscout24at_images(listing: dict) -> List[str]:
+    if not (image_props := listing.get("primaryPictureImageProps")):
+        return []
+    for source in image_props.get("sources", []):
+        if (
+            source.get("type") == "image/jpeg"
+            and source.get("media") == "(max-width: 1023px)"
+            and (src := source.get("srcSet"))
+        ):
+            return [src.split()[0]]
+    # Use "src" if the max-width image is not available
+    if src_image_url := image_props.get("src"):
+        return [src_image_url]
+    return []
+
+
+def _immobilienscout24at_cleanup(script_text: str) -> str:
+    script_text = re.sub(pattern=":undefined", repl=":null", string=script_text)
+    # Remove script commands
+    return re.sub(pattern="window\\.[^\n]+", repl="", string=script_text)
+
+
+register(
+    SiteSpec(
+        ImmoWebsite.IMMOBILIENSCOUT24AT,
+        listings_path=["reduxAsyncConnect", "pageData", "results", "hits"],
+        fields=dict(
+            title=Field(("headline",), default="Object"),
+            address=Field(("addressString",)),
+            url=Field(("links", "targetURL"), default="/"),
+            price=Field(("priceKeyFacts", 0, "value")),
+            rooms=_key_fact("Zimmer"),
+            living_space=_key_fact("Fläche"),
+            images=_immobilienscout24at_images,
+        ),
+        cleanup=_immobilienscout24at_cleanup,
+        price_kind=ImmoPriceKind.PRICE,
+        currency="€",
+    )
+)
+
+
+# immowelt.at
+
+
+def _immoweltat_images(listing: dict) -> List[str]:
+    # A loop instead of a comprehension, which is a function call of its own
+    images = []
+    for picture in listing.get("pictures") or ():
+        if image_url := picture.get("imageUri"):
+            images.append(image_url)
+    return images
+
+
+register(
+    SiteSpec(
+        ImmoWebsite.IMMOWELTAT,
+        listings_path=["initialState", "estateSearch", "data", "estates"],
+        fields=dict(
+            title=Field(("title",), default="Object"),
+            address=Field(("place", "city")),
+            url=Field(("onlineId",), template="/expose/{}", default="/"),
+            price=Field(("primaryPrice", "amountMin"), ("primaryPrice", "amountMax")),
+            rooms=Field(("roomsMin",), ("roomsMax",)),
+            living_space=Field(("primaryArea", "sizeMin"), ("primaryArea", "sizeMax")),
+            images=_immoweltat_images,
+            id=Field(("onlineId",), convert=str),
+        ),
+        json_script=True,
+        cleanup=lambda script_text: script_text.strip().removeprefix("<!--").removesuffix("-->"),
+        price_kind=ImmoPriceKind.PRICE,
+        currency="€",
+    )
+)
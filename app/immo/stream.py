@@ -0,0 +1,220 @@
+"""Incremental decoding of a single array inside a large JSON document
+
+The page state of the immo websites contains far more than the listings.
+Instead of decoding the whole document, only the members on the way to the
+listings array are walked. Values before the listings are skipped by a
+scanner that only looks at brackets and strings and builds no objects, the
+elements of the array are decoded one by one and nothing after the array is
+looked at. The JavaScript `undefined` literal is decoded as null.
+"""
+import json
+import re
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+from app.immo.error import ImmoParserError
+
+
+# Tokens that matter while scanning a value: strings (so that brackets inside
+# them are ignored), brackets and the JavaScript `undefined` literal
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]|\bundefined\b')
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+_WHITESPACE = re.compile(r"\s*")
+_LITERAL = re.compile(r"[^\s,\]}]+")
+# Text up to the next bracket, strings (with the brackets inside them) are skipped whole.
+# The regex engine keeps state per repetition, a bounded number of strings per match
+# keeps its memory small, the scanner just matches again.
+_NO_BRACKETS = re.compile(r'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*){0,64}')
+
+_decoder = json.JSONDecoder()
+
+
+def _skip_ws(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _scan_value(text: str, pos: int, undefined: List[int]) -> int:
+    """Return the end of the value at pos, positions of `undefined` literals are collected"""
+    char = text[pos:pos + 1]
+    if char == '"':
+        match = _STRING.match(text, pos)
+        if match is None:
+            raise json.JSONDecodeError("Unterminated string", text, pos)
+        return match.end()
+
+    if char in ("{", "["):
+        depth = 0
+        for match in _TOKEN.finditer(text, pos):
+            token = text[match.start()]
+            if token in "{[":
+                depth += 1
+            elif token in "}]":
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+            elif token == "u":
+                undefined.append(match.start())
+        raise json.JSONDecodeError("Unterminated value", text, pos)
+
+    match = _LITERAL.match(text, pos)
+    if match is None:
+        raise json.JSONDecodeError("Expecting value", text, pos)
+    if match.group() == "undefined":
+        undefined.append(pos)
+    return match.end()
+
+
+def _skip_value(text: str, pos: int) -> int:
+    """Return the end of the value at pos without decoding it
+
+    Note:
+        A regular expression jumps from bracket to bracket, only the brackets
+        are counted in Python. It's slower than decoding the value with the C
+        decoder, but nothing is allocated for the skipped subtrees. The
+        skipped value isn't validated beyond its brackets and strings.
+    """
+    if text[pos:pos + 1] not in ("{", "["):
+        return _scan_value(text, pos, [])
+
+    skip = _NO_BRACKETS.match
+    depth = 0
+    while char := text[pos:pos + 1]:
+        if char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        elif (end := skip(text, pos).end()) > pos:
+            # More strings than a single match skips
+            pos = end
+            continue
+        else:
+            # The opening quote of an unterminated string
+            break
+        pos = skip(text, pos + 1).end()
+    raise json.JSONDecodeError("Unterminated value", text, pos)
+
+
+def _decode_value(text: str, pos: int) -> tuple:
+    """Decode the value at pos, `undefined` is decoded as None
+
+    Returns:
+        tuple: (value, end position)
+    """
+    try:
+        return _decoder.raw_decode(text, pos)
+    except json.JSONDecodeError:
+        undefined: List[int] = []
+        end = _scan_value(text, pos, undefined)
+        if not undefined:
+            raise
+        parts, start = [], pos
+        for undefined_pos in undefined:
+            parts.append(text[start:undefined_pos])
+            parts.append("null")
+            start = undefined_pos + len("undefined")
+        parts.append(text[start:end])
+        return json.loads("".join(parts)), end
+
+
+def _expect(text: str, pos: int, char: str) -> int:
+    pos = _skip_ws(text, pos)
+    if text[pos:pos + 1] != char:
+        raise json.JSONDecodeError(f"Expecting {char!r}", text, pos)
+    return pos + 1
+
+
+def _find_member(text: str, pos: int, key: str) -> int:
+    """Return the position of the value of `key` in the object that starts at pos
+
+    Raises:
+        ImmoParserError: if the object has no such member
+    """
+    pos = _expect(text, pos, "{")
+    while True:
+        pos = _skip_ws(text, pos)
+        if text[pos:pos + 1] == "}":
+            break
+
+        match = _STRING.match(text, pos)
+        if match is None:
+            raise json.JSONDecodeError("Expecting property name", text, pos)
+        raw_key = match.group()
+        member = raw_key[1:-1] if "\\" not in raw_key else json.loads(raw_key)
+        pos = _skip_ws(text, _expect(text, match.end(), ":"))
+        if member == key:
+            return pos
+
+        pos = _skip_ws(text, _skip_value(text, pos))
+        if text[pos:pos + 1] == ",":
+            pos += 1
+        elif text[pos:pos + 1] != "}":
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+
+    raise ImmoParserError("Listings json path changed.")
+
+
+def find_array(text: str, path: Sequence[str]) -> int:
+    """Return the position of the "[" of the array at the given key path
+
+    Note:
+        Text before the first "{" (e.g. "<!--") and after the document
+        (e.g. further JavaScript statements) is ignored.
+
+    Args:
+        text: JSON document, possibly with JavaScript `undefined` literals
+        path: keys from the root object to the array, e.g. ["data", "items"]
+
+    Raises:
+        ImmoParserError: if the path doesn't exist or doesn't lead to an array
+        json.JSONDecodeError: if the document is malformed on the way
+    """
+    pos = text.find("{")
+    if pos == -1:
+        raise json.JSONDecodeError("Expecting '{'", text, 0)
+
+    for i, key in enumerate(path):
+        pos = _find_member(text, pos, key)
+        if i < len(path) - 1 and text[pos:pos + 1] != "{":
+            raise ImmoParserError("Listings json path changed.")
+
+    if text[pos:pos + 1] != "[":
+        raise ImmoParserError(f"Listings json path doesn't lead to an array: {'.'.join(path)}")
+    return pos
+
+
+def array_span(text: str, path: Sequence[str]) -> Tuple[int, int]:
+    """Return the start and end of the array at the given key path, see `find_array`
+
+    Note:
+        The array is only scanned, e.g. to digest its text before deciding
+        whether to decode it.
+    """
+    start = find_array(text, path)
+    return start, _skip_value(text, start)
+
+
+def iter_array(text: str, path: Sequence[str], start: Optional[int] = None) -> Iterator[Any]:
+    """Yield the decoded elements of the array at the given key path one by one
+
+    Args:
+        text: JSON document, see `find_array`
+        path: keys from the root object to the array
+        start: position of the array if it was already found (e.g. by `array_span`)
+
+    Raises:
+        ImmoParserError: if the path doesn't exist or doesn't lead to an array
+        json.JSONDecodeError: if the document is malformed on the way
+    """
+    if start is None:
+        start = find_array(text, path)
+    pos = _skip_ws(text, start + 1)
+    if text[pos:pos + 1] == "]":
+        return
+    while True:
+        value, pos = _decode_value(text, pos)
+        yield value
+        pos = _skip_ws(text, pos)
+        if text[pos:pos + 1] == "]":
+            return
+        pos = _skip_ws(text, _expect(text, pos, ","))
@@ -1,5 +1,7 @@
 """Swiss Immobilien websites enumeration"""
 from enum import Enum
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 
 class ImmoWebsite(Enum):
@@ -25,3 +27,32 @@ class ImmoWebsite(Enum):
                 return "https://www.immodirekt.at/assets/images/favicon.ico"
             case ImmoWebsite.IMMOWELTAT:
                 return "https://cdnglobal.immowelt.org/residential-search-ui/6.14.2/favicon.ico"
+
+    @property
+    def page_query_param(self) -> Optional[str]:
+        """Return the query parameter that selects the result page (None if unsupported)"""
+        match self:
+            case ImmoWebsite.IMMOSCOUT24:
+                return "pn"
+            case ImmoWebsite.HOMEGATE:
+                return "ep"
+            case ImmoWebsite.IMMOWELTAT:
+                return "sp"
+            case _:
+                return None
+
+    def page_url(self, url: str, page: int) -> Optional[str]:
+        """Return the URL of the given result page of a search URL
+
+        Returns:
+            str: URL of the result page or None if the website can't be paginated
+        """
+        if page == 1:
+            return url
+        if (param := self.page_query_param) is None:
+            return None
+
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        query_params = [(key, value) for key, value in parse_qsl(query) if key != param]
+        query_params.append((param, str(page)))
+        return urlunsplit((scheme, netloc, path, urlencode(query_params), fragment))
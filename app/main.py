@@ -1,12 +1,27 @@
 """Main module"""
 import asyncio
-from typing import Type
+import signal
+from typing import Dict, Type
+from urllib.parse import urlparse
 
-import sentry_sdk
-
-from app import init_client_session, setup_custom_logger
+from app import setup_custom_logger
 from app.manager import ImmoManager
+from app.archive import create_archive
+from app.changes import ChangeDetector
 from app.config import Config
+from app.dedup import DuplicateIndex
+from app.filters import compile_filter
+from app.immo.error import ImmoParserError
+from app.immo.pool import ParserPool
+from app.delivery import DeliveryPipeline
+from app.metrics import monitor_event_loop_lag, start_metrics_server
+from app.resilience import Resilience, RetryPolicy
+from app.scheduler import Scheduler
+from app.sharding import ShardCoordinator, create_lease_store
+from app.state import create_state_store
+from app.transport import DISCORD, IMAGES, MAPS, SCRAPE, Transport
+from app.utils.google_maps import DistanceMatrix
+from app.utils.image import ImageCache
 
 
 log = setup_custom_logger(__name__)
@@ -14,31 +29,197 @@ log = setup_custom_logger(__name__)
 
 async def main(config: Config, manager_class: Type[ImmoManager] = ImmoManager):
     """Create an ImmoManager for each immo website and start scraping"""
-    session = init_client_session()
+    transport = Transport(
+        no_cache=not config.conditional_requests,
+        limits={
+            SCRAPE: config.scrape_connection_limit,
+            IMAGES: config.image_connection_limit,
+            MAPS: config.api_connection_limit,
+            DISCORD: config.api_connection_limit,
+        },
+        limit_per_host=config.connection_limit_per_host,
+        dns_cache_ttl=config.dns_cache_ttl,
+        http2_hosts=config.http2_hosts,
+    )
+    state = create_state_store(
+        config.state_path,
+        seen_ttl=config.seen_listings_ttl,
+        seen_max=config.seen_listings_max,
+        cache_ttl=config.google_maps_cache_ttl,
+    )
+    archive = create_archive(config.archive_path)
+    resilience = Resilience(
+        failure_threshold=config.circuit_breaker_threshold,
+        reset_timeout=config.circuit_breaker_reset,
+    )
+
+    def retry_policy(timeout: float, budget: float) -> RetryPolicy:
+        return RetryPolicy(
+            attempts=config.retry_attempts,
+            base_delay=config.retry_base_delay,
+            max_delay=config.retry_max_delay,
+            timeout=timeout,
+            budget=budget,
+        )
 
-    managers, tasks = [], []
+    enrichment_policy = retry_policy(config.enrichment_timeout, config.enrichment_timeout * 2)
+    delivery = DeliveryPipeline(
+        transport.session(DISCORD),
+        n_workers=config.delivery_workers,
+        max_queued=config.delivery_queue_size,
+    )
+    image_cache = ImageCache(
+        directory=config.image_cache_dir,
+        max_memory_bytes=config.image_cache_memory_mb * 1024 * 1024,
+        max_disk_bytes=config.image_cache_disk_mb * 1024 * 1024,
+        resilience=resilience,
+        retry_policy=enrichment_policy,
+    )
+    distance_matrix = None
+    if config.google_maps_api_key:
+        distance_matrix = DistanceMatrix(
+            transport.session(MAPS),
+            config.google_maps_api_key,
+            config.google_maps_destination,
+            state=state,
+            cache_ttl=config.google_maps_cache_ttl,
+            resilience=resilience,
+            retry_policy=enrichment_policy,
+        )
 
-    if not config.scrape_urls:
+    duplicates = DuplicateIndex(ttl=config.duplicate_listings_ttl)
+    change_detector = ChangeDetector(
+        price_drops=config.notify_price_drops,
+        updates=config.notify_updates,
+        price_drop_min_percent=config.price_drop_min_percent,
+        price_drop_min_amount=config.price_drop_min_amount,
+    )
+    parser_pool = ParserPool(
+        kind=config.parser_pool,
+        workers=config.parser_workers,
+        max_pending=config.parser_queue_size,
+    )
+
+    scheduler = Scheduler(
+        min_interval=config.scraping_interval_min or config.scraping_interval // 2,
+        max_interval=config.scraping_interval_max or config.scraping_interval * 4,
+        host_concurrency=config.host_concurrency,
+        host_spacing=config.host_spacing,
+        jitter=config.scraping_jitter,
+    )
+
+    if not (subscriptions := config.all_subscriptions()):
         log.info("No URLs for scraping provided. Exiting...")
         return
 
-    for url in config.scrape_urls:
-        manager = manager_class(
+    def create_manager(url: str) -> ImmoManager:
+        return manager_class(
             immo_website_url=url,
-            session=session,
-            discord_webhook_url=config.discord_webhook,
+            session=transport.scrape_session(urlparse(url).hostname),
+            discord_webhook_url=None,
             n_seconds_sleep=config.scraping_interval,
             google_maps_destination=config.google_maps_destination,
             google_maps_api_key=config.google_maps_api_key,
+            seen_listings_max=config.seen_listings_max,
+            seen_listings_ttl=config.seen_listings_ttl,
+            state=state,
+            max_pages=config.scrape_max_pages,
+            page_concurrency=config.scrape_page_concurrency,
+            delivery=delivery,
+            image_cache=image_cache,
+            distance_matrix=distance_matrix,
+            conditional_requests=config.conditional_requests,
+            duplicates=duplicates,
+            parser_pool=parser_pool,
+            image_session=transport.session(IMAGES),
+            resilience=resilience,
+            retry_policy=retry_policy(config.scrape_timeout, config.scrape_budget),
+            archive=archive,
+            change_detector=change_detector,
         )
-        managers.append(manager)
-
-        tasks.append(asyncio.create_task(manager.start()))
 
-    # Wait for all tasks to finish (ideally never)
-    await asyncio.gather(*tasks)
+    # Every URL is scraped by a single manager that delivers to all its subscribers
+    managers: Dict[str, ImmoManager] = {}
+    for subscription in subscriptions:
+        if (manager := managers.get(subscription.url)) is None:
+            try:
+                manager = create_manager(subscription.url)
+            except ImmoParserError as e:
+                log.error("Skipping %s: %s", subscription.url, e)
+                continue
+            managers[subscription.url] = manager
+        manager.add_subscriber(subscription.webhook, compile_filter(subscription.filter))
+
+    if not managers:
+        log.info("No supported URLs for scraping provided. Exiting...")
+        return
 
-    await session.close()
+    coordinator = None
+    if config.lease_store_path:
+        # The replicas split the URLs between them, see app.sharding
+        if not config.state_path:
+            log.warning("STATE_PATH isn't set, replicas can't share the seen listings")
+        coordinator = ShardCoordinator(
+            create_lease_store(config.lease_store_path),
+            scheduler,
+            managers,
+            replica_id=config.replica_id,
+            lease_ttl=config.lease_ttl,
+        )
+    else:
+        for manager in managers.values():
+            scheduler.add(manager)
+
+    metrics_runner = None
+    if config.metrics_port:
+        metrics_runner = await start_metrics_server(config.metrics_host, config.metrics_port)
+    loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+
+    # Shut down cleanly on SIGTERM/SIGINT: send the queued messages, release the leases, close the stores
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    stop_signals = []
+    stopping = False
+
+    def stop(sig: signal.Signals):
+        nonlocal stopping
+        log.info("Received %s, shutting down...", sig.name)
+        stopping = True
+        main_task.cancel()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop, sig)
+        except NotImplementedError:
+            # Not supported on Windows, Ctrl+C still raises KeyboardInterrupt there
+            break
+        stop_signals.append(sig)
+
+    try:
+        # Run the scrape jobs (forever)
+        if coordinator:
+            await asyncio.gather(scheduler.run(), coordinator.run())
+        else:
+            await scheduler.run()
+    except asyncio.CancelledError:
+        if not stopping:
+            raise
+    finally:
+        # A second signal interrupts the shutdown
+        for sig in stop_signals:
+            loop.remove_signal_handler(sig)
+        loop_lag_task.cancel()
+        if coordinator:
+            await coordinator.close()
+            coordinator.store.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await delivery.close()
+        parser_pool.close()
+        state.close()
+        if archive:
+            archive.close()
+        await transport.close()
 
 
 if __name__ == "__main__":
@@ -47,8 +228,11 @@ if __name__ == "__main__":
 
     # Setup Sentry if needed
     if dsn := config.sentry_dsn:
+        # Only imported when configured, it's slow to import
+        import sentry_sdk
+
         sentry_sdk.init(
-            dsn=dsn, traces_sample_rate=1.0, ignore_errors=[KeyboardInterrupt]
+            dsn=dsn, traces_sample_rate=config.sentry_traces_sample_rate, ignore_errors=[KeyboardInterrupt]
         )
 
     asyncio.run(main(config))
@@ -1,19 +1,50 @@
 from __future__ import annotations
 
 import asyncio
-from typing import List, Optional
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
 from urllib.parse import urlparse
 
 from aiohttp import ClientSession
-from discord import Webhook, AsyncWebhookAdapter
 
 from app import setup_custom_logger
+from app.dedup import DuplicateIndex
+from app.filters import ListingFilter, any_filter
+from app.archive import ListingArchive
+from app.changes import ChangeDetector, ListingChange, fingerprint
+from app.delivery import DeliveryPipeline, LazyWebhook
 from app.immo.model import ImmoData
-from app.immo.parser import ImmoParser, ImmoParserError
+from app.immo.parser import ImmoParserError
+from app.immo.pool import ParserPool
+from app.immo.registry import get_parser
 from app.immo.website import ImmoWebsite
+from app.metrics import (
+    CHANGED_LISTINGS,
+    ERRORS,
+    LISTINGS_PARSED,
+    NEW_LISTINGS,
+    PARSE_DURATION,
+    SCRAPE_BYTES,
+    SCRAPE_DURATION,
+    UNCHANGED_PAGES,
+)
+from app.resilience import Resilience, RetryPolicy
 from app.scraper import Scraper, ScraperNetworkError
-from app.utils.discord import send_discord_listing_embed
-from app.utils.google_maps import compute_distance
+from app.seen import Fingerprint, SeenIndex
+from app.state import StateStore
+from app.utils.discord import DiscordMessage, create_discord_listing_message
+from app.utils.google_maps import DistanceMatrix
+from app.utils.image import ImageCache
+
+
+@dataclass
+class Subscriber:
+    """Webhook that new listings of a scrape URL are sent to"""
+
+    webhook: LazyWebhook
+    # Only matching listings are sent, all if None
+    listing_filter: Optional[ListingFilter] = None
 
 
 class ImmoManager:
@@ -23,127 +54,557 @@ class ImmoManager:
         self,
         immo_website_url: str,
         session: ClientSession,
-        discord_webhook_url: str,
+        discord_webhook_url: Optional[str],
         n_seconds_sleep: int,
         google_maps_destination: Optional[str],
         google_maps_api_key: Optional[str] = None,
+        seen_listings_max: int = 5000,
+        seen_listings_ttl: Optional[int] = None,
+        state: Optional[StateStore] = None,
+        max_pages: int = 1,
+        page_concurrency: int = 2,
+        delivery: Optional[DeliveryPipeline] = None,
+        image_cache: Optional[ImageCache] = None,
+        distance_matrix: Optional[DistanceMatrix] = None,
+        conditional_requests: bool = True,
+        duplicates: Optional[DuplicateIndex] = None,
+        parser_pool: Optional[ParserPool] = None,
+        image_session: Optional[ClientSession] = None,
+        resilience: Optional[Resilience] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        archive: Optional[ListingArchive] = None,
+        change_detector: Optional[ChangeDetector] = None,
     ):
         """
         Args:
             immo_website_url: the URL this manager will scrape
             session: shared aiohttp.ClientSession
-            discord_webhook_url: URL string of a discord webhook
+            discord_webhook_url: URL string of a discord webhook, further webhooks
+                are added with `add_subscriber`
             google_maps_destination: human readable destination string (e.g. "Raemistrasse, Zurich")
             google_maps_api_key: Google Maps API Key
+            seen_listings_max: maximum number of remembered listing IDs
+            seen_listings_ttl: seconds after which an unseen listing ID is forgotten
+            state: store that persists seen listings between restarts
+            max_pages: maximum number of result pages fetched per round
+            page_concurrency: number of result pages fetched at the same time
+            delivery: pipeline that sends the Discord messages in the background
+            image_cache: cache of downloaded listing images
+            distance_matrix: shared Distance Matrix client (created from the
+                google_maps_* arguments if not given)
+            conditional_requests: revalidate result pages with ETag / Last-Modified
+            duplicates: index of posted listings shared by all managers, used to
+                collapse the same listing posted on several websites
+            parser_pool: pool the result pages are parsed in (parsed on the
+                event loop if not given)
+            image_session: session the listing images are downloaded with
+                (`session` if not given)
+            resilience: circuit breakers of the hosts, shared by all managers
+            retry_policy: retries and timeouts of a result page download
+            archive: archive that every parsed listing is recorded in
+            change_detector: reports changes of already seen listings, e.g. price
+                drops (only new listings are reported if not given)
+
+        Raises:
+            ImmoParserError: if there is no parser for the website
         """
         self.immo_website_url = immo_website_url
         self.session = session
+        self.image_session = image_session or session
         self.google_maps_api_key = google_maps_api_key
         self.google_maps_destination_address = google_maps_destination
         self.n_seconds_sleep = n_seconds_sleep
+        self.max_pages = max_pages
+        self.page_concurrency = max(page_concurrency, 1)
 
         # Model
         parsed_url = urlparse(immo_website_url)
         hostname = parsed_url.hostname
         self.immo_website = ImmoWebsite(hostname)
-        self.listings = None
+        # Fail right away for websites without a parser
+        get_parser(self.immo_website)
+        self.seen = SeenIndex(max_size=seen_listings_max, ttl=seen_listings_ttl)
+        self.state = state or StateStore(seen_ttl=seen_listings_ttl, seen_max=seen_listings_max)
+        self.scrape_meta = None
+        # Page -> metadata of the scraped result pages whose listings weren't processed yet.
+        # It's only saved together with the listings, otherwise they'd be skipped next time.
+        self._pending_pages: Dict[str, dict] = {}
+        # Listing ID -> whether it's new, of the queued messages that weren't sent yet.
+        # They are only persisted as seen once sent, a restart sends them again.
+        self._undelivered: Dict[str, bool] = {}
 
         # Instances
         self.logger = setup_custom_logger(".".join([__name__, hostname]))
-        self.scraper = Scraper(url=immo_website_url, session=session)
-        self.discord = Webhook.from_url(
-            discord_webhook_url, adapter=AsyncWebhookAdapter(session)
+        self.scraper = Scraper(
+            url=immo_website_url,
+            session=session,
+            conditional=conditional_requests,
+            resilience=resilience,
+            retry_policy=retry_policy,
         )
+        self.delivery = delivery or DeliveryPipeline(session)
+        # Webhook URL -> every subscriber of the scrape URL
+        self.subscribers: Dict[str, Subscriber] = {}
+        if discord_webhook_url:
+            self.add_subscriber(discord_webhook_url)
+        self.image_cache = image_cache or ImageCache()
+        if distance_matrix is None and google_maps_api_key:
+            distance_matrix = DistanceMatrix(
+                session,
+                google_maps_api_key,
+                google_maps_destination,
+                state=self.state,
+                resilience=resilience,
+            )
+        self.distance_matrix = distance_matrix
+        self.duplicates = duplicates or DuplicateIndex()
+        self.parser_pool = parser_pool or ParserPool(kind="inline")
+        self.archive = archive
+        if change_detector is not None and not change_detector.enabled:
+            change_detector = None
+        self.change_detector = change_detector
 
         self.logger.info(f"Initialized for scraping: {immo_website_url}")
 
-    async def _send_discord_message(self, listing):
-        """Send discord message via a webhook for the given listing data"""
-        if self.google_maps_api_key:
+    def add_subscriber(
+        self, discord_webhook_url: str, listing_filter: Optional[ListingFilter] = None
+    ):
+        """Send the new listings to another webhook as well
+
+        Note:
+            A webhook that is added again gets the listings matching any of its
+            filters, every listing is only sent once.
+
+        Args:
+            discord_webhook_url: URL string of a discord webhook
+            listing_filter: only listings matching the filter are sent to the webhook
+        """
+        if (subscriber := self.subscribers.get(discord_webhook_url)) is not None:
+            listing_filter = any_filter(subscriber.listing_filter, listing_filter)
+        self.subscribers[discord_webhook_url] = Subscriber(
+            self.delivery.webhook(discord_webhook_url), listing_filter
+        )
+
+    @property
+    def _duplicate_scope(self) -> str:
+        # Duplicates are only collapsed between managers with the same subscribers
+        return "|".join(sorted(self.subscribers))
+
+    async def _render_discord_message(
+        self, listing: ImmoData, note: Optional[str] = None
+    ) -> DiscordMessage:
+        """Enrich the listing and render it into a Discord message
+
+        Args:
+            note: shown above the listing details, e.g. what changed
+        """
+        duplicate_urls = None
+        # A changed listing (with a note) was posted before, its duplicates were handled then
+        if note is None and (duplicate := self.duplicates.lookup(listing, self._duplicate_scope)):
+            # Duplicates claimed from now on are sent as a separate note
+            duplicate.rendered = True
+            duplicate_urls = list(duplicate.duplicate_urls)
+
+        if self.distance_matrix:
             # Compute the distance from apartment address to the destination address
             # in this case, default destination address = 'Rämistrasse, Zürich, Switzerland'
-            distance_results = await compute_distance(
-                self.scraper.session,
-                self.google_maps_api_key,
-                origin_address=listing.address,
-                destination_address=self.google_maps_destination_address,
-            )
+            distance_results = await self.distance_matrix.distance(listing.address)
         else:
             distance_results = None
 
-        await send_discord_listing_embed(
-            self.discord,
-            session=self.session,
+        message = await create_discord_listing_message(
+            session=self.image_session,
             immo_data=listing,
             hostname=self.immo_website.value,
             host_url=self.immo_website_url,
             host_icon_url=self.immo_website.author_icon_url,
             immo_distances=distance_results,
+            image_cache=self.image_cache,
+            duplicate_urls=duplicate_urls,
+            note=note,
         )
-        self.logger.debug("sent %s", listing.url)
+        self.logger.debug("rendered %s", listing.url)
+        return message
 
-    def _find_first_mutual_listing_idx(self, fresh_listings: ImmoData) -> Optional[int]:
-        """Find the first index that is in both (old + fresh) listings"""
-        for old_listing in self.listings:
-            for i, fresh_listing in enumerate(fresh_listings):
-                if old_listing.url == fresh_listing.url:
-                    return i
+    async def _send_discord_message(
+        self, listing: ImmoData, change: Optional[ListingChange] = None
+    ):
+        """Queue a discord message for the given listing data, it is sent in the background
 
-    async def _process_fresh_listings(self, fresh_listings: List[ImmoData]):
-        """Search through latest fresh_listings, tagging any new (previously unseen) listings
-        and then posting them to Discord.
+        Args:
+            change: the change of an already seen listing, None for a new listing
+        """
+        # Filter before rendering, rejected listings cost no Maps or image requests
+        subscribers = [
+            subscriber
+            for subscriber in self.subscribers.values()
+            if subscriber.listing_filter is None or subscriber.listing_filter(listing)
+        ]
+        if not subscribers:
+            self.logger.debug("%s matches no subscriber filter", listing.url)
+            return
+
+        note = change.describe() if change else None
+        if change is None and (
+            original := self.duplicates.claim(
+                listing, self.immo_website.value, self._duplicate_scope
+            )
+        ):
+            self.logger.debug("%s is a duplicate of %s", listing.url, original.url)
+            # The original message links to this listing if it isn't rendered yet
+            if original.rendered:
+                await self._send_discord_text(
+                    f"Also listed on {listing.url} (same as {original.url})", subscribers
+                )
+            return
+
+        rendered: Optional[asyncio.Future] = None
+
+        async def render() -> DiscordMessage:
+            nonlocal rendered
+            if rendered is None:
+                rendered = asyncio.ensure_future(self._render_discord_message(listing, note))
+            # The message is rendered once, every subscriber gets a copy of it
+            return (await asyncio.shield(rendered)).copy()
+
+        # A change of a listing that is still queued as new is new as well
+        self._undelivered[listing.id] = change is None or self._undelivered.get(listing.id, False)
+        await self._submit(render, subscribers, lambda: self._delivered(listing.id))
+
+    async def _send_discord_text(
+        self, content: str, subscribers: Optional[List[Subscriber]] = None
+    ):
+        """Queue a plain discord text message"""
+
+        async def render():
+            return DiscordMessage(content=content)
+
+        await self._submit(render, subscribers)
+
+    async def _submit(
+        self,
+        render: Callable[[], Awaitable[DiscordMessage]],
+        subscribers: Optional[List[Subscriber]] = None,
+        on_delivered: Optional[Callable[[], None]] = None,
+    ):
+        """Queue a message for the given subscribers (default: all)
+
+        Args:
+            on_delivered: called once the message was sent to every subscriber
+        """
+        if subscribers is None:
+            subscribers = list(self.subscribers.values())
+
+        callback = None
+        if on_delivered is not None:
+            remaining = len(subscribers)
+
+            def callback():
+                nonlocal remaining
+                remaining -= 1
+                if remaining == 0:
+                    on_delivered()
+
+        for subscriber in subscribers:
+            webhook = subscriber.webhook
+            # One lane per subscriber keeps its messages in order and coalescable
+            await self.delivery.submit(
+                f"{self.immo_website_url}#{webhook.id}", webhook, render, callback
+            )
+
+    def _delivered(self, listing_id: str):
+        """Persist a listing as seen (and its fingerprint) once its message was sent"""
+        if (is_new := self._undelivered.pop(listing_id, None)) is None:
+            return
+        if is_new:
+            self.state.record_seen(self.immo_website_url, [listing_id], time.time())
+        if fingerprint := self.seen.fingerprint(listing_id):
+            self.state.record_fingerprints(self.immo_website_url, {listing_id: fingerprint})
+        self.state.flush()
+
+    def _load_state(self):
+        """Load the seen listings and scrape metadata of this URL from the state store"""
+        since = time.time() - self.seen.ttl if self.seen.ttl else None
+        self.seen.load(
+            self.state.load_seen(
+                self.immo_website_url, since=since, limit=self.seen.max_size
+            )
+        )
+        if self.change_detector:
+            self.seen.set_fingerprints(self.state.load_fingerprints(self.immo_website_url))
+        self.scrape_meta = self.state.load_meta(self.immo_website_url)
+        self._pending_pages = {}
+        for page_meta in self.scrape_meta.get("pages", {}).values():
+            if "url" in page_meta:
+                self._set_validators(page_meta["url"], page_meta)
+        self.logger.debug("loaded %d seen listings from state", len(self.seen))
+
+    def unload_state(self):
+        """Reload the state before the next scrape, e.g. after another replica scraped the URL"""
+        self.state.flush()
+        self.scrape_meta = None
+
+    def _save_state(
+        self, listing_ids: List[str], fingerprints: Optional[Dict[str, Fingerprint]] = None
+    ):
+        """Mark the listing IDs as seen and persist them together with the scrape metadata
+
+        Note:
+            Listings whose message wasn't sent yet are only persisted once it
+            was sent (see `_delivered`), changed ones keep their old fingerprint.
+
+        Args:
+            listing_ids: IDs of the scraped listings
+            fingerprints: listing ID -> fingerprint of the scraped listings
         """
-        if self.listings:
-            # If there are existing old listings
-            # First, we need to find a listing that is present in both lists (fresh + old)
-            first_mutual_listing_idx = self._find_first_mutual_listing_idx(
-                fresh_listings
+        now = time.time()
+        self.seen.update(listing_ids, now)
+        undelivered = self._undelivered
+        self.state.record_seen(
+            self.immo_website_url,
+            [listing_id for listing_id in listing_ids if not undelivered.get(listing_id)],
+            now,
+        )
+        if fingerprints:
+            self.seen.set_fingerprints(fingerprints)
+            self.state.record_fingerprints(
+                self.immo_website_url,
+                {
+                    listing_id: fingerprint
+                    for listing_id, fingerprint in fingerprints.items()
+                    if listing_id not in undelivered
+                },
             )
+        # The listings of the scraped pages are processed, skip the pages next time if unchanged
+        pages = self.scrape_meta.setdefault("pages", {})
+        for page, page_meta in self._pending_pages.items():
+            pages[page] = page_meta
+            self._set_validators(page_meta["url"], page_meta)
+        self._pending_pages = {}
+        self.scrape_meta["last_scrape"] = now
+        self.state.save_meta(self.immo_website_url, self._persisted_meta())
+        self.state.flush()
+        if self.archive:
+            self.archive.flush()
+
+    def _persisted_meta(self) -> dict:
+        """Scrape metadata without the digests and validators of the pages with
+        unsent listings, so that they are parsed again after a restart"""
+        if not self._undelivered:
+            return self.scrape_meta
+        pages = {}
+        for page, page_meta in self.scrape_meta.get("pages", {}).items():
+            if any(listing_id in self._undelivered for listing_id in page_meta.get("ids", ())):
+                page_meta = {
+                    key: value
+                    for key, value in page_meta.items()
+                    if key not in ("digest", "etag", "last_modified")
+                }
+            pages[page] = page_meta
+        return dict(self.scrape_meta, pages=pages)
 
-            # If there are no mutual elements, all listings are new
-            if first_mutual_listing_idx is None:
-                first_mutual_listing_idx = len(fresh_listings)
-                if self.listings:
-                    self.logger.warning("All fresh listings are *NEW*")
-                    # We need to warn the user that there might have been more listings added than
-                    # we see in our LIMIT 20 request
-                    await self.discord.send(
-                        f"Next {first_mutual_listing_idx} listings from {self.immo_website.value} "
-                        "are all new, please check manually if there might be more."
-                    )
+    def _set_validators(self, url: str, page_meta: dict):
+        """Make the scraper send the validators of the page's metadata with the next request"""
+        if page_meta.get("etag") or page_meta.get("last_modified"):
+            self.scraper.validators[url] = (page_meta.get("etag"), page_meta.get("last_modified"))
+        else:
+            self.scraper.validators.pop(url, None)
+
+    def _touch_page(self, page_meta: dict):
+        """Refresh the listings of an unchanged result page in the seen index"""
+        if listing_ids := page_meta.get("ids"):
+            now = time.time()
+            self.seen.update(listing_ids, now)
+            self.state.record_seen(self.immo_website_url, listing_ids, now)
+            if self.archive:
+                self.archive.touch(self.immo_website.value, listing_ids, now)
+
+    async def _scrape_page(self, page: int) -> Optional[List[ImmoData]]:
+        """Scrape and parse a single result page
+
+        Note:
+            Parsing is skipped if the server reports the page as not modified or
+            the digest of its listings JSON didn't change since the last scrape.
+            The new digest and validators are pending until `_save_state`.
+
+        Returns:
+            list[ImmoData]: listings on the page or None if the page is unchanged
+        """
+        url = self.immo_website.page_url(self.immo_website_url, page)
+        page_meta = self.scrape_meta.get("pages", {}).get(str(page), {})
+
+        with SCRAPE_DURATION.time(url=self.immo_website_url):
+            content = await self.scraper.scrape(url)
+        # The scraper keeps the validators of the response, they're only used once it's processed
+        etag, last_modified = self.scraper.validators.get(url, (None, None))
+        self._set_validators(url, page_meta)
+        if content is None:
+            UNCHANGED_PAGES.inc(url=self.immo_website_url)
+            self._touch_page(page_meta)
+            return None
+        SCRAPE_BYTES.inc(len(content), url=self.immo_website_url)
+
+        with PARSE_DURATION.time(website=self.immo_website.value):
+            digest, listings = await self.parser_pool.parse(
+                self.immo_website, content, page_meta.get("digest")
+            )
+        if listings is None:
+            UNCHANGED_PAGES.inc(url=self.immo_website_url)
+            self._touch_page(page_meta)
+            return None
+        LISTINGS_PARSED.inc(len(listings), url=self.immo_website_url)
+        if self.archive:
+            self.archive.record(self.immo_website.value, listings, time.time())
+
+        self._pending_pages[str(page)] = dict(
+            url=url,
+            etag=etag,
+            last_modified=last_modified,
+            digest=digest,
+            ids=[listing.id for listing in listings],
+        )
+        return listings
+
+    def _has_unseen(self, listings: List[ImmoData]) -> bool:
+        """Whether any of the listings wasn't seen before"""
+        return any(listing.id not in self.seen for listing in listings)
+
+    async def _scrape_listings(self) -> Optional[List[ImmoData]]:
+        """Scrape the first result page and follow further pages (up to max_pages)
+        until a page contains only already seen listings.
+
+        Returns:
+            list[ImmoData]: fresh listings or None if the first result page is unchanged
+        """
+        if self.scrape_meta is None:
+            self._load_state()
+        # Drop the pages of an earlier scrape that failed
+        self._pending_pages = {}
+
+        fresh_listings = await self._scrape_page(1)
+        if fresh_listings is None or self.immo_website.page_query_param is None:
+            return fresh_listings
+
+        page, has_more = 1, self._has_unseen(fresh_listings)
+        while has_more and page < self.max_pages:
+            pages = range(page + 1, min(page + self.page_concurrency, self.max_pages) + 1)
+            results = await asyncio.gather(
+                *(self._scrape_page(p) for p in pages), return_exceptions=True
+            )
+            for listings in results:
+                page += 1
+                if isinstance(listings, (ScraperNetworkError, ImmoParserError)):
+                    self.logger.warning(f"Stopping pagination at page {page}: {listings!r}")
+                    has_more = False
+                elif isinstance(listings, BaseException):
+                    raise listings
+                elif listings is None:
+                    has_more = False
+                else:
+                    fresh_listings.extend(listings)
+                    has_more = self._has_unseen(listings)
+                if not has_more:
+                    # The listings of the pages after it aren't processed
+                    for p in pages:
+                        if p > page:
+                            self._pending_pages.pop(str(p), None)
+                    break
+
+        self.logger.debug("scraped %d result page(s)", page)
+        return fresh_listings
+
+    async def _process_fresh_listings(self, fresh_listings: List[ImmoData]) -> int:
+        """Search through latest fresh_listings, tagging any new (previously unseen) listings
+        and then posting them to Discord. Changes of already seen listings are
+        posted as well if a change detector is set.
+
+        Returns:
+            int: number of new listings that were posted
+        """
+        if self.scrape_meta is None:
+            self._load_state()
+
+        new_listings: List[ImmoData] = []
+        changes: List[ListingChange] = []
+        fingerprints: Dict[str, Fingerprint] = {}
+        handled = set()
+        for listing in fresh_listings:
+            # The same listing can be on several result pages
+            if listing.id in handled:
+                continue
+            handled.add(listing.id)
+            if self.change_detector:
+                fingerprints[listing.id] = current = fingerprint(listing)
+            if listing.id not in self.seen:
+                new_listings.append(listing)
+            elif self.change_detector and (
+                change := self.change_detector.detect(
+                    listing, current, self.seen.fingerprint(listing.id)
+                )
+            ):
+                changes.append(change)
+
+        n_posted = 0
+        if "last_scrape" not in self.scrape_meta:
+            # first scrape pass of this URL ever, there are no older listings yet
+            self.logger.debug("skipping first batch of listings")
+        elif new_listings:
+            # If there are no already seen listings, all listings are new
+            if len(new_listings) == len(fresh_listings):
+                self.logger.warning("All fresh listings are *NEW*")
+                # We need to warn the user that there might have been more listings added than
+                # we see on the fetched result pages (LIMIT 20 per page)
+                await self._send_discord_text(
+                    f"Next {len(new_listings)} listings from {self.immo_website.value} "
+                    "are all new, please check manually if there might be more."
+                )
             # Send every new listing to discord starting from oldest to newest
-            new_listings = fresh_listings[:first_mutual_listing_idx]
             for new_listing in reversed(new_listings):
                 await self._send_discord_message(new_listing)
-        elif self.listings is None:
-            # first scrape pass, there are no older listings yet
-            self.logger.debug("skipping first batch of listings")
+            n_posted = len(new_listings)
 
-        # Save latest fresh listings for the next iteration
-        self.listings = fresh_listings
+        for change in reversed(changes):
+            self.logger.debug("%s: %s", change.kind, change.listing.url)
+            CHANGED_LISTINGS.inc(url=self.immo_website_url, kind=change.kind)
+            await self._send_discord_message(change.listing, change)
+
+        # Remember (or refresh) every listing for the next iteration
+        self._save_state([listing.id for listing in fresh_listings], fingerprints)
+        return n_posted
+
+    async def scrape_once(self) -> int:
+        """Scrape the latest listings once and send the new ones
+
+        Returns:
+            int: number of new listings
+        """
+        try:
+            # Scrape and parse HTML of the result pages into fresh listings
+            fresh_listings = await self._scrape_listings()
+        except ScraperNetworkError as e:
+            ERRORS.inc(type=type(e).__name__)
+            self.logger.warning(
+                f"Caught ScraperNetworkError, skipping this round of scraping: {e}"
+            )
+            return 0
+        except (KeyError, ImmoParserError) as e:
+            ERRORS.inc(type=type(e).__name__)
+            self.logger.warning(f"Caught parsing error, html likely changed: {e}")
+            return 0
+
+        if fresh_listings is None:
+            self.logger.debug("result page unchanged, skipping this round")
+            self._save_state([])
+            return 0
+
+        n_posted = await self._process_fresh_listings(fresh_listings) or 0
+        NEW_LISTINGS.inc(n_posted, url=self.immo_website_url)
+        return n_posted
 
     async def start(self):
         """Scrape, send and save information about latest listings"""
         while True:
-            try:
-                # Scrape
-                fresh_listings_html = await self.scraper.scrape()
-                # Parse HTML into fresh listings
-                fresh_listings = ImmoParser.parse_html(
-                    self.immo_website, fresh_listings_html
-                )
-            except ScraperNetworkError as e:
-                self.logger.warning(
-                    f"Caught ScraperNetworkError, skipping this round of scraping: {e}"
-                )
-                await asyncio.sleep(self.n_seconds_sleep)
-                continue
-            except (KeyError, ImmoParserError) as e:
-                self.logger.warning(f"Caught parsing error, html likely changed: {e}")
-                await asyncio.sleep(self.n_seconds_sleep)
-                continue
-
-            await self._process_fresh_listings(fresh_listings)
+            await self.scrape_once()
 
             # wait
             await asyncio.sleep(self.n_seconds_sleep)
@@ -0,0 +1,236 @@
+"""Low overhead Prometheus-style metrics"""
+import asyncio
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app import setup_custom_logger
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+logger = setup_custom_logger(__name__)
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {value}"
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        if (counts := self._counts.get(key)) is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterator[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                labels = _format_labels(self.label_names, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {self._sums[key]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self) -> None:
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+SCRAPE_DURATION = REGISTRY.register(
+    Histogram("immo_scrape_duration_seconds", "Duration of result page downloads", ["url"])
+)
+SCRAPE_BYTES = REGISTRY.register(
+    Counter("immo_scrape_bytes_total", "Bytes of downloaded result pages", ["url"])
+)
+UNCHANGED_PAGES = REGISTRY.register(
+    Counter("immo_unchanged_pages_total", "Result pages that didn't change since the last scrape", ["url"])
+)
+PARSE_DURATION = REGISTRY.register(
+    Histogram("immo_parse_duration_seconds", "Duration of result page parsing", ["website"])
+)
+LISTINGS_PARSED = REGISTRY.register(
+    Counter("immo_listings_parsed_total", "Parsed listings", ["url"])
+)
+NEW_LISTINGS = REGISTRY.register(
+    Counter("immo_new_listings_total", "New listings sent to Discord", ["url"])
+)
+CHANGED_LISTINGS = REGISTRY.register(
+    Counter("immo_changed_listings_total", "Changes of seen listings sent to Discord", ["url", "kind"])
+)
+REQUEST_DURATION = REGISTRY.register(
+    Histogram("immo_request_duration_seconds", "Duration of enrichment and delivery requests", ["target"])
+)
+ERRORS = REGISTRY.register(
+    Counter("immo_errors_total", "Caught errors by exception type", ["type"])
+)
+HTTP_REQUESTS = REGISTRY.register(
+    Counter("immo_http_requests_total", "HTTP requests by connection pool and protocol", ["pool", "protocol"])
+)
+HTTP_CONNECTIONS = REGISTRY.register(
+    Counter(
+        "immo_http_connections_total",
+        "HTTP/1.1 connections taken from a pool, reused keep-alive connections or new ones",
+        ["pool", "reused"],
+    )
+)
+HTTP_CONNECTION_WAIT = REGISTRY.register(
+    Histogram(
+        "immo_http_connection_wait_seconds",
+        "Time requests waited for a free connection of a full pool",
+        ["pool"],
+    )
+)
+RETRIES = REGISTRY.register(
+    Counter("immo_retries_total", "Retried requests after transient failures", ["target"])
+)
+CIRCUIT_STATE = REGISTRY.register(
+    Gauge("immo_circuit_breaker_state", "Circuit breaker state per host (0 closed, 1 half open, 2 open)", ["host"])
+)
+EVENT_LOOP_LAG = REGISTRY.register(
+    Gauge("immo_event_loop_lag_seconds", "Latest delay of the event loop in running a timer")
+)
+EVENT_LOOP_LAG_HISTOGRAM = REGISTRY.register(
+    Histogram(
+        "immo_event_loop_lag_distribution_seconds",
+        "Delays of the event loop in running a timer",
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    )
+)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Measure how late the event loop wakes up from sleep, forever"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+async def start_metrics_server(
+    host: str, port: int, registry: Optional[Registry] = None
+) -> "web.AppRunner":
+    """Serve the metrics in the Prometheus text format on http://host:port/metrics"""
+    from aiohttp import web
+
+    registry = registry or REGISTRY
+
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,245 @@
+"""Retries, timeouts and circuit breakers for outgoing requests
+
+Transient failures (connection resets, timeouts, 429 and 5xx responses) are
+retried after a jittered exponential backoff, within a time budget per call.
+Every host has a circuit breaker: after `failure_threshold` failed calls in a
+row it opens and calls fail right away without taking a connection, after
+`reset_timeout` seconds a single trial call decides whether it closes again.
+A Retry-After of the host delays the retry of that call, it only keeps an
+opened breaker open for longer. Retry-Afters are capped at `MAX_RETRY_AFTER`.
+"""
+import asyncio
+import random
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import aiohttp
+
+from app import setup_custom_logger
+from app.metrics import CIRCUIT_STATE, RETRIES
+
+
+logger = setup_custom_logger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Longest Retry-After in seconds that is honoured, e.g. a host that blocks
+# us with `Retry-After: 86400` is still tried again after this time
+MAX_RETRY_AFTER = 600.0
+
+
+class RetryableError(Exception):
+    """Failed call that is worth retrying, e.g. a 429 or 5xx response"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        # Seconds the server asked to wait before the next request
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker of the host is open, no request was made"""
+
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds of a Retry-After header, None for a missing value or an HTTP date"""
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether the error is transient"""
+    return isinstance(error, (RetryableError, aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+class RetryPolicy:
+    """How often and how fast a call is retried"""
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 10.0,
+        timeout: Optional[float] = 20.0,
+        budget: Optional[float] = 60.0,
+    ) -> None:
+        """
+        Args:
+            attempts: maximum number of attempts (1 = no retries)
+            base_delay: backoff before the first retry in seconds, doubled with every retry
+            max_delay: longest backoff in seconds
+            timeout: seconds a single attempt may take
+            budget: seconds all attempts and backoffs together may take
+        """
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.budget = budget
+
+    def backoff(self, attempt: int) -> float:
+        """Jittered backoff before the retry after the given (0-based) attempt"""
+        # "Full jitter" spreads the retries of many clients evenly
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """Failure state of a single host"""
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 60.0) -> None:
+        """
+        Args:
+            host: host name, used for logging and metrics
+            failure_threshold: failed calls in a row after which the breaker opens
+            reset_timeout: seconds after which an open breaker lets a trial call through
+        """
+        self.host = host
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        # Event loop time at which an open breaker becomes half open
+        self.open_until = 0.0
+        self._trial_running = False
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], host=host)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.info("Circuit breaker of %s: %s -> %s", self.host, self.state, state)
+            self.state = state
+            CIRCUIT_STATE.set(_STATE_VALUES[state], host=self.host)
+
+    def before_call(self):
+        """
+        Raises:
+            CircuitOpenError: if no call should be made right now
+        """
+        if self.state == OPEN:
+            if asyncio.get_running_loop().time() < self.open_until:
+                raise CircuitOpenError(f"{self.host} is unavailable, circuit breaker open")
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._trial_running:
+                raise CircuitOpenError(f"{self.host} is unavailable, trial call running")
+            self._trial_running = True
+
+    def record_cancelled(self):
+        """The call was cancelled before it had an outcome"""
+        self._trial_running = False
+
+    def record_success(self):
+        self._trial_running = False
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self, open_for: Optional[float] = None):
+        """Count a failed call, the breaker opens after too many or on a failed trial call
+
+        Args:
+            open_for: seconds to stay open at least once the breaker opens, e.g. a
+                Retry-After of the host (capped at MAX_RETRY_AFTER)
+        """
+        self._trial_running = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip(max(self.reset_timeout, min(open_for or 0, MAX_RETRY_AFTER)))
+
+    def trip(self, seconds: float):
+        """Open the breaker for the given amount of seconds"""
+        loop = asyncio.get_running_loop()
+        self.open_until = max(self.open_until, loop.time() + seconds)
+        self._set_state(OPEN)
+
+
+class Resilience:
+    """Circuit breakers of all hosts, shared by every client"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0) -> None:
+        """
+        Args:
+            failure_threshold: failed calls in a row after which a host's breaker opens
+            reset_timeout: seconds after which an open breaker lets a trial call through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        if (breaker := self._breakers.get(host)) is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                host, self.failure_threshold, self.reset_timeout
+            )
+        return breaker
+
+    async def call(
+        self,
+        host: str,
+        fn: Callable[[], Awaitable[T]],
+        policy: RetryPolicy,
+        target: str = "",
+    ) -> T:
+        """Call fn with retries, timeouts and the circuit breaker of the host
+
+        Note:
+            Only transient errors (see `is_retryable`) are retried and count
+            as failures of the host, any other error is raised right away.
+            A Retry-After is the delay before the retry of this call, the call
+            fails if it doesn't fit into the budget.
+
+        Args:
+            host: host the call goes to
+            fn: makes a single attempt, called again for every retry
+            policy: retries and timeouts of the call
+            target: label of the retry metric (default: the host)
+
+        Raises:
+            CircuitOpenError: if the breaker of the host is open
+        """
+        breaker = self.breaker(host)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.budget if policy.budget is not None else None
+
+        for attempt in range(policy.attempts):
+            breaker.before_call()
+            timeout = policy.timeout
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            try:
+                result = await asyncio.wait_for(fn(), timeout)
+            except asyncio.CancelledError:
+                breaker.record_cancelled()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # The host answered, the error is up to the caller
+                    breaker.record_success()
+                    raise
+                retry_after = getattr(e, "retry_after", None)
+                breaker.record_failure(open_for=retry_after)
+                if retry_after is None:
+                    delay = policy.backoff(attempt)
+                else:
+                    delay = min(retry_after, MAX_RETRY_AFTER)
+                if breaker.state == OPEN:
+                    delay = max(delay, breaker.open_until - loop.time())
+                if attempt == policy.attempts - 1 or (
+                    deadline is not None and loop.time() + delay >= deadline
+                ):
+                    raise
+                RETRIES.inc(target=target or host)
+                logger.debug("%s failed (%r), retry %d in %.2fs", host, e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
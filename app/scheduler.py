@@ -0,0 +1,165 @@
+"""Central scheduling of scrape jobs"""
+import asyncio
+import heapq
+import itertools
+import random
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app import setup_custom_logger
+from app.manager import ImmoManager
+from app.metrics import ERRORS
+
+
+logger = setup_custom_logger(__name__)
+
+
+class ScrapeJob:
+    """A manager together with its adaptive scraping interval"""
+
+    def __init__(self, manager: ImmoManager, interval: float) -> None:
+        self.manager = manager
+        self.interval = interval
+        self.hostname = urlparse(manager.immo_website_url).hostname
+        # Removed jobs are dropped from the queue when they come up
+        self.removed = False
+
+
+class HostLimiter:
+    """Limit the number of concurrent scrapes of a host and the spacing between their starts"""
+
+    def __init__(self, concurrency: int, spacing: float) -> None:
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.spacing = spacing
+        self.lock = asyncio.Lock()
+        self.last_start = float("-inf")
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            if (delay := self.last_start + self.spacing - loop.time()) > 0:
+                await asyncio.sleep(delay)
+            self.last_start = loop.time()
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+
+class Scheduler:
+    """Run the scrape jobs of all managers
+
+    Every job has its own interval that shrinks (halves) after a scrape that
+    found new listings and grows (by 25%) after a scrape that didn't, within
+    [min_interval, max_interval]. Scrapes of the same host are limited to
+    `host_concurrency` at a time and started at least `host_spacing` seconds
+    apart. Every interval is jittered so that jobs don't fire in lockstep.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        host_concurrency: int = 1,
+        host_spacing: float = 5.0,
+        jitter: float = 0.1,
+    ) -> None:
+        """
+        Args:
+            min_interval: shortest interval between scrapes of a job in seconds
+            max_interval: longest interval between scrapes of a job in seconds
+            host_concurrency: number of concurrent scrapes per host
+            host_spacing: minimum number of seconds between scrape starts of a host
+            jitter: relative random deviation of every interval (0.1 = ±10%)
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.host_concurrency = host_concurrency
+        self.host_spacing = host_spacing
+        self.jitter = jitter
+        self.jobs: List[ScrapeJob] = []
+        self._hosts: Dict[str, HostLimiter] = {}
+        # (next run, tie breaker, job)
+        self._queue: List[Tuple[float, int, ScrapeJob]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: Dict[ScrapeJob, asyncio.Task] = {}
+
+    def add(self, manager: ImmoManager, interval: Optional[float] = None) -> ScrapeJob:
+        """Schedule the scrapes of a manager, starting with the given interval"""
+        interval = interval or manager.n_seconds_sleep
+        job = ScrapeJob(manager, min(max(interval, self.min_interval), self.max_interval))
+        self.jobs.append(job)
+        if job.hostname not in self._hosts:
+            self._hosts[job.hostname] = HostLimiter(self.host_concurrency, self.host_spacing)
+        # The first scrape of every job happens right away (the host limiter spreads them)
+        self._push(job, 0.0)
+        return job
+
+    async def remove(self, manager: ImmoManager):
+        """Stop scheduling the scrapes of a manager, waits for a running scrape to finish"""
+        for job in [job for job in self.jobs if job.manager is manager]:
+            job.removed = True
+            self.jobs.remove(job)
+            if task := self._running.get(job):
+                await asyncio.wait([task])
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _push(self, job: ScrapeJob, delay: float):
+        next_run = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self._queue, (next_run, next(self._counter), job))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _adapt(self, job: ScrapeJob, n_new: int):
+        """Adapt the interval of a job to how often it yields new listings"""
+        if n_new > 0:
+            job.interval = max(self.min_interval, job.interval / 2)
+        else:
+            job.interval = min(self.max_interval, job.interval * 1.25)
+
+    async def _run_job(self, job: ScrapeJob):
+        try:
+            async with self._hosts[job.hostname]:
+                n_new = await job.manager.scrape_once()
+            self._adapt(job, n_new or 0)
+        except Exception as e:
+            ERRORS.inc(type=type(e).__name__)
+            logger.exception("Scrape of %s failed: %r", job.manager.immo_website_url, e)
+        finally:
+            del self._running[job]
+            logger.debug(
+                "next scrape of %s in ~%.0fs", job.manager.immo_website_url, job.interval
+            )
+            if not job.removed:
+                self._push(job, self._jittered(job.interval))
+
+    async def run(self):
+        """Run the jobs forever"""
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                self._wakeup.clear()
+                if not self._queue:
+                    await self._wakeup.wait()
+                    continue
+
+                next_run, _, job = self._queue[0]
+                if (delay := next_run - loop.time()) > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                heapq.heappop(self._queue)
+                if job.removed:
+                    continue
+                self._running[job] = asyncio.create_task(self._run_job(job))
+        finally:
+            for task in self._running.values():
+                task.cancel()
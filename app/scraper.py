@@ -1,3 +1,7 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
 from aiohttp import (
     ClientConnectionError,
     ClientConnectorError,
@@ -5,7 +9,14 @@ from aiohttp import (
     ClientSession,
     ServerDisconnectedError,
 )
-from bs4 import BeautifulSoup
+
+from app.resilience import (
+    CircuitOpenError,
+    Resilience,
+    RetryableError,
+    RetryPolicy,
+    parse_retry_after,
+)
 
 
 class ScraperNetworkError(Exception):
@@ -17,23 +28,91 @@ class ScraperNetworkError(Exception):
 class Scraper:
     """Fetch the given url and return scraped data"""
 
-    def __init__(self, url: str, session: ClientSession) -> None:
+    # Seconds the host is left alone after it answered with 403 Forbidden,
+    # which usually means the scraper got blocked
+    forbidden_backoff = 300.0
+
+    def __init__(
+        self,
+        url: str,
+        session: ClientSession,
+        conditional: bool = True,
+        resilience: Optional[Resilience] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        """
+        Args:
+            url: URL of the page
+            session: shared aiohttp.ClientSession
+            conditional: send conditional requests (If-None-Match / If-Modified-Since)
+            resilience: circuit breakers shared with other clients
+            retry_policy: retries and timeouts of a single page download
+        """
         self.url = url
         self.session = session
+        self.conditional = conditional
+        self.resilience = resilience or Resilience()
+        self.retry_policy = retry_policy or RetryPolicy()
+        # URL -> (ETag, Last-Modified) of the last response
+        self.validators: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+    async def _fetch(self, url: str, headers: Dict[str, str]) -> Optional[bytes]:
+        """Make a single request for the page"""
+        resp = await self.session.get(url, headers=headers)
+        if resp.status == 304 and headers:
+            resp.release()
+            return None
+        elif resp.status == 200:
+            etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                self.validators[url] = (etag, last_modified)
+            return await resp.read()
+
+        resp.release()
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        if resp.status == 429 or resp.status >= 500:
+            raise RetryableError(f"status={resp.status}", resp.status, retry_after)
+        elif resp.status == 403:
+            raise RetryableError(
+                f"status={resp.status}", resp.status, retry_after or self.forbidden_backoff
+            )
+        raise ScraperNetworkError(f"status={resp.status}")
+
+    async def scrape(self, url: Optional[str] = None) -> Optional[bytes]:
+        """Download the raw HTML of the page
+
+        Note:
+            Transient errors are retried, see app.resilience.
+
+        Args:
+            url: URL to fetch instead of the scraper's url (e.g. a further result page)
+
+        Returns:
+            bytes: raw HTML or None if the page wasn't modified since the last scrape
+        """
+        url = url or self.url
+        headers = {}
+        if self.conditional and url in self.validators:
+            etag, last_modified = self.validators[url]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
 
-    async def scrape(self) -> BeautifulSoup:
-        """Download the HTML and load it into a soup"""
         try:
-            resp = await self.session.get(self.url)
-            if resp.status == 200:
-                html = await resp.read()
-                return BeautifulSoup(html.decode("utf-8"), "html.parser")
-            else:
-                raise ScraperNetworkError(f"status={resp.status}")
+            return await self.resilience.call(
+                urlparse(url).hostname,
+                lambda: self._fetch(url, headers),
+                self.retry_policy,
+                target="scrape",
+            )
         except (
             ClientConnectorError,
             ClientOSError,
             ClientConnectionError,
             ServerDisconnectedError,
+            asyncio.TimeoutError,
+            RetryableError,
+            CircuitOpenError,
         ) as err:
-            raise ScraperNetworkError from err
+            raise ScraperNetworkError(str(err) or repr(err)) from err
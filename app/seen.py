@@ -0,0 +1,84 @@
+"""Index of already seen listings"""
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+
+class Fingerprint(NamedTuple):
+    """What a listing looked like when it was last seen"""
+
+    content_hash: str
+    price: Optional[float]
+
+
+class SeenIndex:
+    """Bounded set of listing IDs that were already seen
+
+    Lookups are O(1). The index is bounded by `max_size` (least recently seen
+    IDs are evicted first) and optionally by `ttl`, after which an ID that
+    wasn't seen again is forgotten. Every ID can have the fingerprint of the
+    listing, so that a changed listing is noticed without looking at its history.
+    """
+
+    def __init__(self, max_size: int = 5000, ttl: Optional[float] = None) -> None:
+        """
+        Args:
+            max_size: maximum number of IDs kept in the index
+            ttl: number of seconds an ID is remembered since it was last seen
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # listing ID -> timestamp of when it was last seen, oldest first
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        # listing ID -> fingerprint, only for IDs in _entries
+        self._fingerprints: Dict[str, Fingerprint] = {}
+
+    def __contains__(self, listing_id: str) -> bool:
+        last_seen = self._entries.get(listing_id)
+        if last_seen is None:
+            return False
+        if self.ttl is not None and time.time() - last_seen > self.ttl:
+            del self._entries[listing_id]
+            self._fingerprints.pop(listing_id, None)
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self, entries: Dict[str, float]):
+        """Load listing IDs with their last seen timestamps (oldest first)"""
+        for listing_id, timestamp in entries.items():
+            self._entries[listing_id] = timestamp
+            self._entries.move_to_end(listing_id)
+        self._evict()
+
+    def add(self, listing_id: str, timestamp: Optional[float] = None):
+        """Mark the listing ID as seen (refreshes its LRU position and TTL)"""
+        self._entries[listing_id] = timestamp or time.time()
+        self._entries.move_to_end(listing_id)
+        self._evict()
+
+    def update(self, listing_ids: Iterable[str], timestamp: Optional[float] = None):
+        """Mark all given listing IDs as seen"""
+        timestamp = timestamp or time.time()
+        for listing_id in listing_ids:
+            self._entries[listing_id] = timestamp
+            self._entries.move_to_end(listing_id)
+        self._evict()
+
+    def fingerprint(self, listing_id: str) -> Optional[Fingerprint]:
+        """Fingerprint of the listing when it was last seen, None if unknown"""
+        return self._fingerprints.get(listing_id)
+
+    def set_fingerprints(self, fingerprints: Dict[str, Fingerprint]):
+        """Remember the fingerprints of seen listings, unknown IDs are ignored"""
+        for listing_id, fingerprint in fingerprints.items():
+            if listing_id in self._entries:
+                self._fingerprints[listing_id] = Fingerprint(*fingerprint)
+
+    def _evict(self):
+        """Drop the least recently seen IDs until the index fits max_size"""
+        while len(self._entries) > self.max_size:
+            listing_id, _ = self._entries.popitem(last=False)
+            self._fingerprints.pop(listing_id, None)
@@ -0,0 +1,263 @@
+"""Split the scrape URLs between several replicas
+
+Every replica heartbeats into a shared lease store. The live replicas form a
+consistent hash ring and every URL belongs to the replica it hashes to, so a
+joining or leaving replica only moves the URLs of its neighbours. A replica
+only scrapes a URL while it holds the URL's lease: leases of a crashed
+replica expire after `lease_ttl` seconds and are then taken over, leases of
+a replica that shuts down are released right away. The seen listings have
+to be in a state store that all replicas share (e.g. the same SQLite file),
+the new owner of a URL loads them before its first scrape.
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import sqlite3
+import time
+from bisect import bisect
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app import setup_custom_logger
+from app.manager import ImmoManager
+from app.scheduler import Scheduler
+
+
+logger = setup_custom_logger(__name__)
+
+
+def default_replica_id() -> str:
+    """Host name and process ID, the host name is the pod name on Kubernetes"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring of replicas with virtual nodes"""
+
+    def __init__(self, replicas: Iterable[str], vnodes: int = 64) -> None:
+        """
+        Args:
+            replicas: replica IDs
+            vnodes: points per replica on the ring, more points spread the keys more evenly
+        """
+        points = sorted(
+            (_hash(f"{replica}#{i}"), replica) for replica in set(replicas) for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._replicas = [replica for _, replica in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        """Return the replica the key belongs to, None if the ring is empty"""
+        if not self._hashes:
+            return None
+        return self._replicas[bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+class LeaseStore:
+    """In-memory lease store, only coordinates within a single process (e.g. tests)
+
+    Replicas announce themselves with `heartbeat`, a lease gives a single
+    replica the right to scrape a URL until it expires. All timestamps are
+    wall clock seconds since they are compared between hosts.
+    """
+
+    def __init__(self) -> None:
+        # replica ID -> expiry
+        self._replicas: Dict[str, float] = {}
+        # lease name -> (owner, expiry)
+        self._leases: Dict[str, Tuple[str, float]] = {}
+
+    def heartbeat(self, replica_id: str, ttl: float):
+        """Announce the replica as alive for the next ttl seconds"""
+        self._replicas[replica_id] = time.time() + ttl
+
+    def live_replicas(self) -> List[str]:
+        now = time.time()
+        return [replica for replica, expiry in self._replicas.items() if expiry > now]
+
+    def acquire(self, name: str, replica_id: str, ttl: float) -> bool:
+        """Acquire or renew a lease, fails while another replica holds it
+
+        Returns:
+            bool: whether the replica holds the lease for the next ttl seconds
+        """
+        now = time.time()
+        owner, expiry = self._leases.get(name, (replica_id, 0.0))
+        if owner != replica_id and expiry > now:
+            return False
+        self._leases[name] = (replica_id, now + ttl)
+        return True
+
+    def release(self, name: str, replica_id: str):
+        """Release a lease if the replica holds it"""
+        if self._leases.get(name, ("", 0.0))[0] == replica_id:
+            del self._leases[name]
+
+    def leave(self, replica_id: str):
+        """Release all leases of the replica and remove it from the live replicas"""
+        for name in [name for name, (owner, _) in self._leases.items() if owner == replica_id]:
+            del self._leases[name]
+        self._replicas.pop(replica_id, None)
+
+    def close(self):
+        pass
+
+
+class SqliteLeaseStore(LeaseStore):
+    """Lease store in a SQLite database file that all replicas can open
+
+    Note:
+        SQLite's locking needs a file system with working POSIX locks, e.g. a
+        local disk or a volume that is attached to a single node.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        # isolation_level=None: transactions are started explicitly
+        self.connection = sqlite3.connect(path, timeout=10.0, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS replicas (replica_id TEXT PRIMARY KEY, expiry REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expiry REAL NOT NULL)"
+        )
+        logger.info("Opened lease store %s", path)
+
+    def heartbeat(self, replica_id: str, ttl: float):
+        now = time.time()
+        self.connection.execute(
+            "INSERT INTO replicas (replica_id, expiry) VALUES (?, ?) "
+            "ON CONFLICT (replica_id) DO UPDATE SET expiry = excluded.expiry",
+            (replica_id, now + ttl),
+        )
+        self.connection.execute("DELETE FROM replicas WHERE expiry <= ?", (now,))
+
+    def live_replicas(self) -> List[str]:
+        rows = self.connection.execute(
+            "SELECT replica_id FROM replicas WHERE expiry > ?", (time.time(),)
+        )
+        return [replica_id for replica_id, in rows]
+
+    def acquire(self, name: str, replica_id: str, ttl: float) -> bool:
+        now = time.time()
+        # The upsert only takes over a lease that is expired or already ours
+        cursor = self.connection.execute(
+            "INSERT INTO leases (name, owner, expiry) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expiry = excluded.expiry "
+            "WHERE leases.owner = excluded.owner OR leases.expiry <= ?",
+            (name, replica_id, now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    def release(self, name: str, replica_id: str):
+        self.connection.execute(
+            "DELETE FROM leases WHERE name = ? AND owner = ?", (name, replica_id)
+        )
+
+    def leave(self, replica_id: str):
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute("DELETE FROM leases WHERE owner = ?", (replica_id,))
+        self.connection.execute("DELETE FROM replicas WHERE replica_id = ?", (replica_id,))
+        self.connection.execute("COMMIT")
+
+    def close(self):
+        self.connection.close()
+
+
+def create_lease_store(path: Optional[str]) -> LeaseStore:
+    """Return a SQLite lease store for the given path or an in-memory store if it's empty"""
+    if path:
+        return SqliteLeaseStore(path)
+    return LeaseStore()
+
+
+class ShardCoordinator:
+    """Schedule the managers whose URLs belong to this replica"""
+
+    def __init__(
+        self,
+        store: LeaseStore,
+        scheduler: Scheduler,
+        managers: Dict[str, ImmoManager],
+        replica_id: Optional[str] = None,
+        lease_ttl: float = 30.0,
+        vnodes: int = 64,
+    ) -> None:
+        """
+        Args:
+            store: lease store shared by all replicas
+            scheduler: scheduler the owned managers are added to
+            managers: scrape URL -> manager, for every URL of every replica
+            replica_id: unique ID of this replica (default: host name and process ID)
+            lease_ttl: seconds after which the leases of a crashed replica are taken over
+            vnodes: points per replica on the hash ring
+        """
+        self.store = store
+        self.scheduler = scheduler
+        self.managers = managers
+        self.replica_id = replica_id or default_replica_id()
+        self.lease_ttl = lease_ttl
+        self.vnodes = vnodes
+        # URLs this replica holds the lease of and scrapes
+        self.owned: Set[str] = set()
+        # URLs that are handed over once their running scrape finished
+        self._dropping: Dict[str, asyncio.Task] = {}
+
+    async def _drop(self, url: str):
+        """Stop scraping a URL, the running scrape finishes and saves its state first"""
+        manager = self.managers[url]
+        try:
+            await self.scheduler.remove(manager)
+            manager.unload_state()
+            self.store.release(url, self.replica_id)
+            self.owned.discard(url)
+            logger.info("Released %s", url)
+        except Exception as e:
+            logger.exception("Failed to release %s: %r", url, e)
+        finally:
+            del self._dropping[url]
+
+    def _start_drop(self, url: str):
+        """Drop a URL in the background, a running scrape can take up to the scrape budget"""
+        if url not in self._dropping:
+            self._dropping[url] = asyncio.create_task(self._drop(url))
+
+    async def rebalance(self):
+        """Renew the heartbeat and the leases, take over and hand over URLs"""
+        self.store.heartbeat(self.replica_id, self.lease_ttl)
+        ring = HashRing(self.store.live_replicas() + [self.replica_id], self.vnodes)
+        for url, manager in self.managers.items():
+            if url in self._dropping:
+                # Still scraping it, no other replica may take it over before it's released
+                self.store.acquire(url, self.replica_id, self.lease_ttl)
+            elif ring.owner(url) == self.replica_id and self.store.acquire(
+                url, self.replica_id, self.lease_ttl
+            ):
+                if url not in self.owned:
+                    self.owned.add(url)
+                    self.scheduler.add(manager)
+                    logger.info("Acquired %s", url)
+            elif url in self.owned:
+                self._start_drop(url)
+
+    async def run(self):
+        """Rebalance forever, several times per lease TTL so that leases don't expire"""
+        logger.info("Replica %s joined", self.replica_id)
+        while True:
+            await self.rebalance()
+            await asyncio.sleep(self.lease_ttl / 3)
+
+    async def close(self):
+        """Stop scraping and release all leases, other replicas take over right away"""
+        for url in list(self.owned):
+            self._start_drop(url)
+        await asyncio.gather(*self._dropping.values())
+        self.store.leave(self.replica_id)
+        logger.info("Replica %s left", self.replica_id)
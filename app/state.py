@@ -0,0 +1,370 @@
+"""Persistent scraping state (seen listings and scrape metadata)"""
+import json
+import sqlite3
+import time
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app import setup_custom_logger
+
+
+logger = setup_custom_logger(__name__)
+
+
+class StateStore:
+    """In-memory state store, nothing survives a restart
+
+    Every scope (usually a scrape URL) holds the IDs of already seen listings
+    (optionally with their fingerprint, a content hash and the price) and a
+    small metadata dict about the last scrape. Writes are buffered
+    until `flush` is called so that backends can persist them in batches.
+    Every flush also forgets the seen listings and cached values that expired
+    or exceed the capacity, so the store stays bounded like the SeenIndex.
+    """
+
+    def __init__(
+        self,
+        seen_ttl: Optional[float] = None,
+        seen_max: Optional[int] = None,
+        cache_ttl: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            seen_ttl: seconds after which a listing that wasn't seen again is forgotten
+            seen_max: maximum number of seen listings per scope, the oldest are forgotten
+            cache_ttl: seconds after which a cached value is forgotten
+        """
+        self.seen_ttl = seen_ttl
+        self.seen_max = seen_max
+        self.cache_ttl = cache_ttl
+        self._seen: Dict[str, Dict[str, float]] = {}
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        # Buffered writes: (scope, listing_id, last_seen) and scope -> meta
+        self._pending_seen: List[Tuple[str, str, float]] = []
+        self._pending_meta: Dict[str, Dict[str, Any]] = {}
+        # scope -> listing ID -> (content hash, price) and the buffered writes
+        self._fingerprints: Dict[str, Dict[str, Tuple[str, Optional[float]]]] = {}
+        self._pending_fingerprints: List[Tuple[str, str, str, Optional[float]]] = []
+        # Cached values: (namespace, key) -> (value, timestamp)
+        self._cache: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._pending_cache: List[Tuple[str, str, Any, float]] = []
+
+    def load_seen(
+        self, scope: str, since: Optional[float] = None, limit: Optional[int] = None
+    ) -> Dict[str, float]:
+        """Load the seen listing IDs of a scope
+
+        Args:
+            scope: scope identifier (e.g. scrape URL)
+            since: only return IDs that were last seen after this timestamp
+            limit: only return this many of the most recently seen IDs
+
+        Returns:
+            dict: listing ID -> timestamp of when it was last seen, oldest first
+        """
+        entries = sorted(self._seen.get(scope, {}).items(), key=lambda e: e[1])
+        if since is not None:
+            entries = [entry for entry in entries if entry[1] > since]
+        if limit is not None:
+            entries = entries[-limit:]
+        return dict(entries)
+
+    def record_seen(self, scope: str, listing_ids: Iterable[str], timestamp: float):
+        """Buffer the listing IDs of a scope as seen at the given timestamp"""
+        self._pending_seen.extend(
+            (scope, listing_id, timestamp) for listing_id in listing_ids
+        )
+
+    def load_fingerprints(self, scope: str) -> Dict[str, Tuple[str, Optional[float]]]:
+        """Load the fingerprints of the seen listings of a scope
+
+        Returns:
+            dict: listing ID -> (content hash, price), only for listings that have one
+        """
+        seen = self._seen.get(scope, {})
+        return {
+            listing_id: fingerprint
+            for listing_id, fingerprint in self._fingerprints.get(scope, {}).items()
+            if listing_id in seen
+        }
+
+    def record_fingerprints(
+        self, scope: str, fingerprints: Dict[str, Tuple[str, Optional[float]]]
+    ):
+        """Buffer the fingerprints of seen listings, record_seen them first"""
+        self._pending_fingerprints.extend(
+            (scope, listing_id, content_hash, price)
+            for listing_id, (content_hash, price) in fingerprints.items()
+        )
+
+    def load_meta(self, scope: str) -> Dict[str, Any]:
+        """Load the scrape metadata of a scope"""
+        return dict(self._meta.get(scope, {}))
+
+    def save_meta(self, scope: str, meta: Dict[str, Any]):
+        """Buffer the scrape metadata of a scope"""
+        self._pending_meta[scope] = dict(meta)
+
+    def load_cached(self, namespace: str, key: str, max_age: Optional[float] = None) -> Any:
+        """Load a cached value
+
+        Args:
+            namespace: namespace of the cache (e.g. "distance")
+            key: key of the value in the namespace
+            max_age: ignore values that were cached more than max_age seconds ago
+
+        Returns:
+            the cached value or None
+        """
+        if (entry := self._cache.get((namespace, key))) is None:
+            return None
+        value, timestamp = entry
+        if max_age is not None and time.time() - timestamp > max_age:
+            return None
+        return value
+
+    def save_cached(self, namespace: str, key: str, value: Any):
+        """Cache a JSON serializable value, it is persisted with the next flush"""
+        timestamp = time.time()
+        self._cache[(namespace, key)] = (value, timestamp)
+        self._pending_cache.append((namespace, key, value, timestamp))
+
+    def _prune_seen(self, scope: str, now: float):
+        """Forget the expired and the oldest seen listings of a scope beyond seen_max"""
+        seen = self._seen.get(scope, {})
+        entries = list(seen.items())
+        if self.seen_ttl is not None:
+            entries = [entry for entry in entries if entry[1] > now - self.seen_ttl]
+        if self.seen_max is not None and len(entries) > self.seen_max:
+            entries = sorted(entries, key=itemgetter(1))[-self.seen_max:]
+        if len(entries) == len(seen):
+            return
+        self._seen[scope] = dict(entries)
+        if fingerprints := self._fingerprints.get(scope):
+            self._fingerprints[scope] = {
+                listing_id: fingerprint
+                for listing_id, fingerprint in fingerprints.items()
+                if listing_id in self._seen[scope]
+            }
+
+    def _prune_cache(self, now: float):
+        """Forget the cached values that are older than cache_ttl"""
+        if self.cache_ttl is None:
+            return
+        expired = [
+            key
+            for key, (_, timestamp) in self._cache.items()
+            if timestamp <= now - self.cache_ttl
+        ]
+        for key in expired:
+            del self._cache[key]
+
+    def flush(self):
+        """Write all buffered changes"""
+        for scope, listing_id, timestamp in self._pending_seen:
+            self._seen.setdefault(scope, {})[listing_id] = timestamp
+        for scope, listing_id, content_hash, price in self._pending_fingerprints:
+            self._fingerprints.setdefault(scope, {})[listing_id] = (content_hash, price)
+        self._meta.update(self._pending_meta)
+        now = time.time()
+        for scope in {scope for scope, _, _ in self._pending_seen}:
+            self._prune_seen(scope, now)
+        self._prune_cache(now)
+        self._pending_seen.clear()
+        self._pending_fingerprints.clear()
+        self._pending_meta.clear()
+        self._pending_cache.clear()
+
+    def close(self):
+        """Flush and release the store"""
+        self.flush()
+
+
+class SqliteStateStore(StateStore):
+    """State store persisted in a SQLite database file"""
+
+    def __init__(self, path: str, **kwargs) -> None:
+        """
+        Args:
+            path: path of the database file
+            kwargs: bounds of the stored entries, see StateStore
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Open the database lazily on first use"""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS seen_listings ("
+                    "scope TEXT NOT NULL, listing_id TEXT NOT NULL, last_seen REAL NOT NULL, "
+                    "content_hash TEXT, price REAL, PRIMARY KEY (scope, listing_id))"
+                )
+                columns = {
+                    row[1] for row in self._connection.execute("PRAGMA table_info(seen_listings)")
+                }
+                if "content_hash" not in columns:
+                    # Databases from before change detection
+                    self._connection.execute(
+                        "ALTER TABLE seen_listings ADD COLUMN content_hash TEXT"
+                    )
+                    self._connection.execute("ALTER TABLE seen_listings ADD COLUMN price REAL")
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS scrape_meta ("
+                    "scope TEXT PRIMARY KEY, meta TEXT NOT NULL)"
+                )
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                    "timestamp REAL NOT NULL, PRIMARY KEY (namespace, key))"
+                )
+                # Expired rows are deleted on every flush
+                self._connection.execute(
+                    "CREATE INDEX IF NOT EXISTS seen_listings_last_seen "
+                    "ON seen_listings (scope, last_seen)"
+                )
+                self._connection.execute(
+                    "CREATE INDEX IF NOT EXISTS cache_timestamp ON cache (timestamp)"
+                )
+            logger.info("Opened state store %s", self.path)
+        return self._connection
+
+    def _delete_seen(self, scope: str, since: Optional[float], limit: Optional[int]):
+        """Delete the seen listings of a scope from before since and beyond limit"""
+        if since is not None:
+            self.connection.execute(
+                "DELETE FROM seen_listings WHERE scope = ? AND last_seen <= ?",
+                (scope, since),
+            )
+        if limit is not None:
+            self.connection.execute(
+                "DELETE FROM seen_listings WHERE scope = ? AND listing_id NOT IN ("
+                "SELECT listing_id FROM seen_listings WHERE scope = ? "
+                "ORDER BY last_seen DESC LIMIT ?)",
+                (scope, scope, limit),
+            )
+
+    def load_seen(
+        self, scope: str, since: Optional[float] = None, limit: Optional[int] = None
+    ) -> Dict[str, float]:
+        # Drop entries that can't be used anymore so the database stays bounded
+        with self.connection:
+            self._delete_seen(scope, since, limit)
+        rows = self.connection.execute(
+            "SELECT listing_id, last_seen FROM seen_listings WHERE scope = ? "
+            "ORDER BY last_seen",
+            (scope,),
+        )
+        return dict(rows)
+
+    def load_fingerprints(self, scope: str) -> Dict[str, Tuple[str, Optional[float]]]:
+        rows = self.connection.execute(
+            "SELECT listing_id, content_hash, price FROM seen_listings "
+            "WHERE scope = ? AND content_hash IS NOT NULL",
+            (scope,),
+        )
+        return {listing_id: (content_hash, price) for listing_id, content_hash, price in rows}
+
+    def load_meta(self, scope: str) -> Dict[str, Any]:
+        row = self.connection.execute(
+            "SELECT meta FROM scrape_meta WHERE scope = ?", (scope,)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def load_cached(self, namespace: str, key: str, max_age: Optional[float] = None) -> Any:
+        if (namespace, key) not in self._cache:
+            row = self.connection.execute(
+                "SELECT value, timestamp FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            self._cache[(namespace, key)] = (json.loads(row[0]), row[1])
+        return super().load_cached(namespace, key, max_age)
+
+    def flush(self):
+        if not (
+            self._pending_seen
+            or self._pending_fingerprints
+            or self._pending_meta
+            or self._pending_cache
+        ):
+            return
+
+        start = time.perf_counter()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO seen_listings (scope, listing_id, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, listing_id) DO UPDATE SET last_seen = excluded.last_seen",
+                self._pending_seen,
+            )
+            self.connection.executemany(
+                "UPDATE seen_listings SET content_hash = ?, price = ? "
+                "WHERE scope = ? AND listing_id = ?",
+                [
+                    (content_hash, price, scope, listing_id)
+                    for scope, listing_id, content_hash, price in self._pending_fingerprints
+                ],
+            )
+            self.connection.executemany(
+                "INSERT INTO scrape_meta (scope, meta) VALUES (?, ?) "
+                "ON CONFLICT (scope) DO UPDATE SET meta = excluded.meta",
+                [(scope, json.dumps(meta)) for scope, meta in self._pending_meta.items()],
+            )
+            self.connection.executemany(
+                "INSERT INTO cache (namespace, key, value, timestamp) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET "
+                "value = excluded.value, timestamp = excluded.timestamp",
+                [
+                    (namespace, key, json.dumps(value), timestamp)
+                    for namespace, key, value, timestamp in self._pending_cache
+                ],
+            )
+            now = time.time()
+            for scope in {scope for scope, _, _ in self._pending_seen}:
+                self._delete_seen(
+                    scope,
+                    now - self.seen_ttl if self.seen_ttl is not None else None,
+                    self.seen_max,
+                )
+            if self.cache_ttl is not None:
+                self.connection.execute(
+                    "DELETE FROM cache WHERE timestamp <= ?", (now - self.cache_ttl,)
+                )
+        self._prune_cache(now)
+        logger.debug(
+            "flushed %d seen listings, %d metadata rows and %d cached values in %.1fms",
+            len(self._pending_seen),
+            len(self._pending_meta),
+            len(self._pending_cache),
+            (time.perf_counter() - start) * 1e3,
+        )
+        self._pending_seen.clear()
+        self._pending_fingerprints.clear()
+        self._pending_meta.clear()
+        self._pending_cache.clear()
+
+    def close(self):
+        self.flush()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def create_state_store(
+    path: Optional[str],
+    seen_ttl: Optional[float] = None,
+    seen_max: Optional[int] = None,
+    cache_ttl: Optional[float] = None,
+) -> StateStore:
+    """Return a SQLite store for the given path or an in-memory store if it's empty"""
+    bounds = dict(seen_ttl=seen_ttl, seen_max=seen_max, cache_ttl=cache_ttl)
+    if path:
+        return SqliteStateStore(path, **bounds)
+    return StateStore(**bounds)
@@ -0,0 +1,225 @@
+"""HTTP transport with a separate connection pool per destination class"""
+import asyncio
+import ssl
+import time
+from typing import Dict, Iterable, Optional
+
+import aiohttp
+
+from app import BROWSER_HEADERS, setup_custom_logger
+from app.metrics import HTTP_CONNECTIONS, HTTP_CONNECTION_WAIT, HTTP_REQUESTS
+
+try:
+    import httpx
+except ImportError:  # HTTP/2 is optional
+    httpx = None
+
+
+logger = setup_custom_logger(__name__)
+
+# Destination classes, every class has its own connection pool
+SCRAPE = "scrape"
+IMAGES = "images"
+MAPS = "maps"
+DISCORD = "discord"
+
+
+def _scrape_ssl_context() -> ssl.SSLContext:
+    """TLS settings of the browser-like scrape requests"""
+    ssl_context = ssl.create_default_context()
+    ssl_context.set_ciphers("DEFAULT@SECLEVEL=1")
+    ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
+    ssl_context.maximum_version = ssl.TLSVersion.TLSv1_2
+    return ssl_context
+
+
+def _trace_config(pool: str, no_cache: bool) -> aiohttp.TraceConfig:
+    """Record connection reuse and the time spent waiting for a free connection"""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_queued_start(session, ctx, params):
+        ctx.queued_at = time.perf_counter()
+
+    async def on_queued_end(session, ctx, params):
+        HTTP_CONNECTION_WAIT.observe(time.perf_counter() - ctx.queued_at, pool=pool)
+
+    async def on_reuse(session, ctx, params):
+        HTTP_CONNECTIONS.inc(pool=pool, reused="true")
+
+    async def on_create(session, ctx, params):
+        HTTP_CONNECTIONS.inc(pool=pool, reused="false")
+
+    async def on_request_start(session, ctx, params):
+        HTTP_REQUESTS.inc(pool=pool, protocol="HTTP/1.1")
+
+    async def add_nocache_headers(session, ctx, params):
+        params.headers.update({"X-No-Cache": str(time.time())})
+
+    trace_config.on_connection_queued_start.append(on_queued_start)
+    trace_config.on_connection_queued_end.append(on_queued_end)
+    trace_config.on_connection_reuseconn.append(on_reuse)
+    trace_config.on_connection_create_end.append(on_create)
+    trace_config.on_request_start.append(on_request_start)
+    if no_cache:
+        trace_config.on_request_start.append(add_nocache_headers)
+    return trace_config
+
+
+class _Http2Response:
+    """The part of the aiohttp response interface used by the app"""
+
+    def __init__(self, response: "httpx.Response") -> None:
+        self._response = response
+        self.status = response.status_code
+        self.headers = response.headers
+
+    async def read(self) -> bytes:
+        return await self._response.aread()
+
+    async def text(self, encoding: Optional[str] = None) -> str:
+        content = await self.read()
+        return content.decode(encoding or self._response.encoding or "utf-8")
+
+    async def json(self):
+        await self.read()
+        return self._response.json()
+
+    def release(self):
+        asyncio.ensure_future(self._response.aclose())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._response.aclose()
+
+
+class _Http2RequestContext:
+    """Awaitable and async context manager like aiohttp's request context"""
+
+    def __init__(self, coro) -> None:
+        self._coro = coro
+        self._response: Optional[_Http2Response] = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self) -> _Http2Response:
+        self._response = await self._coro
+        return self._response
+
+    async def __aexit__(self, *exc_info):
+        await self._response.__aexit__(*exc_info)
+
+
+class Http2Session:
+    """GET-only aiohttp.ClientSession lookalike on top of an HTTP/2 httpx client
+
+    Requests multiplex over a single connection per host. Network errors
+    are raised as aiohttp.ClientConnectionError so that callers handle both
+    transports the same way.
+    """
+
+    def __init__(self, headers: Dict[str, str], limit: int, no_cache: bool, pool: str) -> None:
+        self.pool = pool
+        self.no_cache = no_cache
+        self._client = httpx.AsyncClient(
+            http2=True,
+            headers=headers,
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+            verify=_scrape_ssl_context() if pool == SCRAPE else True,
+            timeout=httpx.Timeout(30.0),
+        )
+
+    async def _get(self, url: str, headers: Optional[Dict[str, str]]) -> _Http2Response:
+        headers = dict(headers or {})
+        if self.no_cache:
+            headers["X-No-Cache"] = str(time.time())
+        request = self._client.build_request("GET", str(url), headers=headers)
+        try:
+            response = await self._client.send(request, stream=True)
+        except httpx.TransportError as e:
+            raise aiohttp.ClientConnectionError(str(e)) from e
+        HTTP_REQUESTS.inc(pool=self.pool, protocol=response.http_version)
+        return _Http2Response(response)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> _Http2RequestContext:
+        return _Http2RequestContext(self._get(url, headers))
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class Transport:
+    """Client sessions per destination class
+
+    Scraping, image downloads, Google Maps and Discord each get their own
+    connection pool so that e.g. slow image downloads can't take the
+    connections of the scrape requests. Only scrape requests look like a
+    browser (headers and TLS settings).
+    """
+
+    def __init__(
+        self,
+        no_cache: bool = False,
+        limits: Optional[Dict[str, int]] = None,
+        limit_per_host: int = 0,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+        http2_hosts: Iterable[str] = (),
+    ) -> None:
+        """
+        Args:
+            no_cache: add a unique no-cache header to every scrape request
+            limits: destination class -> maximum number of connections
+            limit_per_host: maximum number of connections per host and pool (0 = no limit)
+            dns_cache_ttl: seconds for which resolved host names are cached
+            keepalive_timeout: seconds for which idle connections are kept open
+            http2_hosts: hosts that are scraped over HTTP/2 (requires httpx[http2])
+        """
+        self.no_cache = no_cache
+        self.limits = {SCRAPE: 20, IMAGES: 20, MAPS: 10, DISCORD: 10, **(limits or {})}
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.http2_hosts = set(http2_hosts)
+        if self.http2_hosts and httpx is None:
+            logger.warning("httpx isn't installed, HTTP/2 is disabled")
+            self.http2_hosts = set()
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._http2_sessions: Dict[str, Http2Session] = {}
+
+    def session(self, destination: str) -> aiohttp.ClientSession:
+        """Return the session of a destination class (SCRAPE, IMAGES, MAPS or DISCORD)"""
+        if (session := self._sessions.get(destination)) is None:
+            connector = aiohttp.TCPConnector(
+                ssl=_scrape_ssl_context() if destination == SCRAPE else None,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                limit=self.limits.get(destination, 10),
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            browser_like = destination in (SCRAPE, IMAGES)
+            session = self._sessions[destination] = aiohttp.ClientSession(
+                headers=BROWSER_HEADERS if browser_like else None,
+                trace_configs=[_trace_config(destination, self.no_cache and destination == SCRAPE)],
+                connector=connector,
+            )
+        return session
+
+    def scrape_session(self, hostname: str):
+        """Return the session for scraping the given host, HTTP/2 if enabled for it"""
+        if hostname not in self.http2_hosts:
+            return self.session(SCRAPE)
+        if (session := self._http2_sessions.get(SCRAPE)) is None:
+            session = self._http2_sessions[SCRAPE] = Http2Session(
+                BROWSER_HEADERS, self.limits[SCRAPE], self.no_cache, SCRAPE
+            )
+        return session
+
+    async def close(self):
+        for session in [*self._sessions.values(), *self._http2_sessions.values()]:
+            await session.close()
+        self._sessions.clear()
+        self._http2_sessions.clear()
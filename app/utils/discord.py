@@ -1,18 +1,77 @@
+from __future__ import annotations
+
+import asyncio
 from ctypes import c_uint64
+from dataclasses import dataclass, field
 from datetime import datetime
 from functools import reduce
 from io import BytesIO
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 import aiohttp
-from discord import Embed, File, Webhook
 
 from app.immo.model import ImmoData
+from app.utils.image import ImageCache
+
+if TYPE_CHECKING:
+    # discord.py is imported when the first message is rendered, it's slow to import
+    from discord import Embed, Webhook
+
+
+# Maximum number of images shown for a listing
+MAX_EMBED_IMAGES = 4
+
+# Discord limits per webhook message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_FILES_PER_MESSAGE = 10
+
+
+@dataclass
+class DiscordMessage:
+    """Rendered webhook message"""
+
+    content: Optional[str] = None
+    embeds: List[Embed] = field(default_factory=list)
+    # (filename, content) of the attached files, discord.File objects are
+    # created per send because they are closed after being sent once
+    attachments: List[Tuple[str, bytes]] = field(default_factory=list)
+
+    def can_merge(self, other: "DiscordMessage") -> bool:
+        """Whether the other message fits into this one without exceeding Discord limits"""
+        return (
+            not (self.content and other.content)
+            and len(self.embeds) + len(other.embeds) <= MAX_EMBEDS_PER_MESSAGE
+            and len(self.attachments) + len(other.attachments) <= MAX_FILES_PER_MESSAGE
+        )
+
+    def merge(self, other: "DiscordMessage"):
+        """Append the content, embeds and files of the other message to this one"""
+        self.content = self.content or other.content
+        self.embeds.extend(other.embeds)
+        filenames = {filename for filename, _ in self.attachments}
+        self.attachments.extend(
+            attachment for attachment in other.attachments if attachment[0] not in filenames
+        )
+
+    def copy(self) -> "DiscordMessage":
+        """Shallow copy that can be merged without changing this message"""
+        return DiscordMessage(self.content, list(self.embeds), list(self.attachments))
+
+    async def send(self, webhook: Webhook):
+        """Send the message via the given webhook"""
+        from discord import File
+
+        files = [
+            File(fp=BytesIO(content), filename=filename) for filename, content in self.attachments
+        ]
+        await webhook.send(content=self.content, embeds=self.embeds, files=files)
 
 
 async def _images_viewable_in_embed(
-    images: List[str], session: aiohttp.ClientSession
-) -> Tuple[List[str], List[File]]:
+    images: List[str],
+    session: aiohttp.ClientSession,
+    image_cache: Optional[ImageCache] = None,
+) -> Tuple[List[str], List[Tuple[str, bytes]]]:
     """Discord Embeds only display image URLs that end with .jpeg
     or response has proper 'Content-Type'. This method downloads an
     image at a URL that doesn't obey these rules and then uploads it
@@ -21,43 +80,59 @@ async def _images_viewable_in_embed(
     https://discordpy.readthedocs.io/en/stable/faq.html#local-image
 
     Args:
-        images: list of images (from ImmoData)
+        images: list of images (from ImmoData), only the first MAX_EMBED_IMAGES are used
         session: shared aiohttp client session
+        image_cache: cache of already downloaded images
 
     Returns:
         list of URLs: which can be local (e.g. attachment://<hash>) or
                         external (e.g. https://...)
-        list of files: empty list for external urls, list of File for local
+        list of files: empty list for external urls, list of (filename, content) for local
     """
+    images = images[:MAX_EMBED_IMAGES]
     # Check if any of the image URLs ends with .jpg
     should_use_local_images = reduce(
         lambda seed, rest: seed or not rest.endswith(".jpg"), images, False
     )
 
     if should_use_local_images:
+        image_cache = image_cache or ImageCache(max_memory_bytes=0)
+        # download every image at the same time
+        contents = await asyncio.gather(
+            *(image_cache.fetch(session, image_url) for image_url in images),
+            return_exceptions=True,
+        )
         local_images, image_files = [], []
-        # do this for every image
-        for image_url in images:
-            resp = await session.get(image_url)
-            image_data = BytesIO(await resp.read())
+        for image_url, content in zip(images, contents):
+            if not isinstance(content, bytes):
+                continue
             local_image_url = f"{c_uint64(hash(image_url)).value:0x}.jpg"
             local_images.append(f"attachment://{local_image_url}")
-            image_files.append(File(fp=image_data, filename=local_image_url))
+            image_files.append((local_image_url, content))
         return local_images, image_files
     else:
         return images, []
 
 
-async def send_discord_listing_embed(
-    webhook: Webhook,
+async def create_discord_listing_message(
     session: aiohttp.ClientSession,
     immo_data: ImmoData,
     hostname: str,
     host_url: str,
     host_icon_url: str,
-    immo_distances: Dict[str, Tuple[str, str]]
-):
-    """Sends an embed message from listing (immo) data"""
+    immo_distances: Dict[str, Tuple[str, str]],
+    image_cache: Optional[ImageCache] = None,
+    duplicate_urls: Optional[List[str]] = None,
+    note: Optional[str] = None,
+) -> DiscordMessage:
+    """Create an embed message from listing (immo) data
+
+    Args:
+        duplicate_urls: URLs of the same listing on other websites
+        note: description above the fields, e.g. what changed since the listing was posted
+    """
+    from discord import Embed
+
     embeds = []
 
     embed = Embed(
@@ -66,6 +141,8 @@ async def send_discord_listing_embed(
         color=5373709,
         timestamp=datetime.utcnow(),
     )
+    if note:
+        embed.description = note
     embed.set_author(name=hostname, url=host_url, icon_url=host_icon_url or "")
     embed.add_field(name=immo_data.price_kind.value, value=immo_data.price, inline=True)
     embed.add_field(name="Rooms", value=immo_data.rooms, inline=True)
@@ -84,10 +161,13 @@ async def send_discord_listing_embed(
                 inline=True,
             )
 
+    if duplicate_urls:
+        embed.add_field(name="Also listed on", value="\n".join(duplicate_urls), inline=False)
+
     embed.set_footer(text=immo_data.address, icon_url=immo_data.lister_logo_url or "")
-    images, files = await _images_viewable_in_embed(immo_data.images, session)
+    images, files = await _images_viewable_in_embed(immo_data.images, session, image_cache)
 
-    n_images = min(len(images), 4)
+    n_images = min(len(images), MAX_EMBED_IMAGES)
     files = files[:n_images]
 
     if n_images > 0:
@@ -102,4 +182,4 @@ async def send_discord_listing_embed(
             img_embed.set_image(url=images[i])
             embeds.append(img_embed)
 
-    await webhook.send(embeds=embeds, files=files)
+    return DiscordMessage(embeds=embeds, attachments=files)
@@ -3,52 +3,230 @@ from urllib.parse import (
     urlunsplit,
     urlencode
 )
-from math import ceil
+from typing import Dict, List, Optional, Tuple
 
 import asyncio
-from aiohttp import ClientSession
+from aiohttp import ClientConnectionError, ClientSession
 
+from app import setup_custom_logger
+from app.metrics import REQUEST_DURATION
+from app.resilience import (
+    CircuitOpenError,
+    Resilience,
+    RetryableError,
+    RetryPolicy,
+    parse_retry_after,
+)
+from app.state import StateStore
 
-async def compute_distance(
-    session: ClientSession, gmaps_api_key: str, origin_address: str,
-    destination_address: str = "Rämistrasse, Zürich, Switzerland"
-) -> tuple[str, str]:
-    """Use Google Maps API to compute the distance (minutes and kms)
-    from a given address to the destination
 
-    Returns:
-        distance (str): distance in km as string with unit 'km' or None
-        minutes (str): distance in minutes as string with unit 'mins' or None
+logger = setup_custom_logger(__name__)
+
+DEFAULT_DESTINATION = "Rämistrasse, Zürich, Switzerland"
+
+# Travel distance / duration for each travel mode
+Distances = Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def _normalize_address(address: str) -> str:
+    """Normalize an address for use as a cache key"""
+    return " ".join(address.lower().replace(",", " ").split())
+
+
+class DistanceMatrix:
+    """Compute distances with the Google Maps Distance Matrix API
+
+    Results are cached per (origin, destination, mode) in the state store.
+    Origins that are requested at the same time (e.g. a burst of new listings)
+    are sent in one Distance Matrix request per travel mode.
     """
-    base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-    scheme, netloc, path, _, fragment = urlsplit(base_url)
 
+    base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
     modes = ["driving", "transit", "bicycling"]
+    # Distance Matrix API limit of origins per request
+    max_origins = 25
+    # Element statuses that are worth caching
+    cacheable_statuses = {"OK", "NOT_FOUND", "ZERO_RESULTS"}
 
-    results = {}
+    def __init__(
+        self,
+        session: ClientSession,
+        gmaps_api_key: str,
+        destination_address: Optional[str] = DEFAULT_DESTINATION,
+        state: Optional[StateStore] = None,
+        cache_ttl: Optional[float] = 30 * 24 * 3600,
+        batch_window: float = 0.05,
+        resilience: Optional[Resilience] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        """
+        Args:
+            session: shared aiohttp client session
+            gmaps_api_key: Google Maps API key
+            destination_address: destination all distances are computed to
+            state: store where the results are cached
+            cache_ttl: seconds after which a cached result is requested again
+            batch_window: seconds that `distance` waits for other origins to batch with
+            resilience: circuit breakers shared with other clients
+            retry_policy: retries and timeouts of a Distance Matrix request
+        """
+        self.session = session
+        self.gmaps_api_key = gmaps_api_key
+        self.destination_address = destination_address or DEFAULT_DESTINATION
+        self.state = state or StateStore()
+        self.cache_ttl = cache_ttl
+        self.batch_window = batch_window
+        self._batch: Optional[Dict[str, asyncio.Future]] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        self.resilience = resilience or Resilience()
+        self.retry_policy = retry_policy or RetryPolicy(timeout=10.0, budget=20.0)
 
-    async def fetch_distance(mode):
+    def _cache_key(self, origin_address: str, mode: str) -> str:
+        return "|".join(
+            (_normalize_address(origin_address), _normalize_address(self.destination_address), mode)
+        )
+
+    async def _request(self, request_url: str) -> Optional[dict]:
+        """Make a single Distance Matrix request, None if it was rejected"""
+        with REQUEST_DURATION.time(target="google_maps"):
+            async with self.session.get(request_url) as resp:
+                if resp.status == 429 or resp.status >= 500:
+                    raise RetryableError(
+                        f"status={resp.status}",
+                        resp.status,
+                        parse_retry_after(resp.headers.get("Retry-After")),
+                    )
+                if resp.status != 200:
+                    return None
+                return await resp.json()
+
+    async def _fetch(self, origins: List[str], mode: str) -> List[Optional[dict]]:
+        """Request the distance matrix elements of the origins for a single travel mode
+
+        Note:
+            Elements are None if the request failed, listings are then sent
+            without distances instead of waiting for Google Maps.
+        """
+        scheme, netloc, path, _, fragment = urlsplit(self.base_url)
         url_params = {
-            "origins": origin_address,
-            "destinations": destination_address,
+            "origins": "|".join(origins),
+            "destinations": self.destination_address,
             "mode": mode,
-            "key": gmaps_api_key
+            "key": self.gmaps_api_key
         }
         query_params = urlencode(url_params)
         request_url = urlunsplit((scheme, netloc, path, query_params, fragment))
 
-        async with session.get(request_url) as resp:
-            if resp.status == 200:
-                resp_json = await resp.json()
+        try:
+            resp_json = await self.resilience.call(
+                urlsplit(self.base_url).hostname,
+                lambda: self._request(request_url),
+                self.retry_policy,
+                target="google_maps",
+            )
+        except (ClientConnectionError, asyncio.TimeoutError, RetryableError, CircuitOpenError) as e:
+            logger.warning("Distance Matrix request failed: %r", e)
+            resp_json = None
+        if resp_json is None:
+            return [None] * len(origins)
+
+        rows = resp_json.get("rows") or []
+        elements = []
+        for i in range(len(origins)):
+            try:
+                elements.append(rows[i]["elements"][0])
+            except (KeyError, IndexError):
+                elements.append(None)
+        return elements
+
+    async def distances(self, origin_addresses: List[str]) -> Dict[str, Distances]:
+        """Compute the distances of many origins to the destination
+
+        Returns:
+            dict: origin address -> travel mode -> (distance, duration), e.g.
+                  {"Musterstrasse 1, 8000 Zürich": {"driving": ("5.2 km", "12 mins"), ...}}
+        """
+        origin_addresses = list(dict.fromkeys(origin_addresses))
+        results: Dict[str, Distances] = {origin: {} for origin in origin_addresses}
+        missing: Dict[str, List[str]] = {mode: [] for mode in self.modes}
+        for origin in origin_addresses:
+            for mode in self.modes:
+                cached = self.state.load_cached(
+                    "distance", self._cache_key(origin, mode), max_age=self.cache_ttl
+                )
+                if cached is None:
+                    missing[mode].append(origin)
+                else:
+                    results[origin][mode] = tuple(cached)
+
+        async def fetch_chunk(mode: str, origins: List[str]):
+            for origin, element in zip(origins, await self._fetch(origins, mode)):
                 try:
-                    element = resp_json["rows"][0]["elements"][0]
                     distance = element["distance"]["text"]
                     duration = element["duration"]["text"]
-                    return mode, (distance, duration)
-                except (KeyError, IndexError):
-                    return mode, (None, None)
-            else:
-                return mode, (None, None)
-
-    results = dict(await asyncio.gather(*(fetch_distance(mode) for mode in modes)))
-    return results
+                except (KeyError, TypeError):
+                    distance, duration = None, None
+                results[origin][mode] = (distance, duration)
+                if element and element.get("status") in self.cacheable_statuses:
+                    self.state.save_cached(
+                        "distance", self._cache_key(origin, mode), [distance, duration]
+                    )
+
+        await asyncio.gather(
+            *(
+                fetch_chunk(mode, origins[i:i + self.max_origins])
+                for mode, origins in missing.items()
+                for i in range(0, len(origins), self.max_origins)
+            )
+        )
+
+        # Keep the mode order stable
+        return {
+            origin: {mode: distances[mode] for mode in self.modes}
+            for origin, distances in results.items()
+        }
+
+    def _schedule_flush(self):
+        self._batch_task = asyncio.create_task(self._flush_batch())
+
+    async def _flush_batch(self):
+        batch, self._batch = self._batch, None
+        try:
+            results = await self.distances(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+        else:
+            for origin, future in batch.items():
+                future.set_result(results[origin])
+
+    async def distance(self, origin_address: str) -> Distances:
+        """Compute the distance of a single origin to the destination
+
+        Note:
+            Concurrent calls within `batch_window` seconds are batched together.
+
+        Returns:
+            dict: travel mode -> (distance, duration)
+        """
+        if self._batch is None:
+            self._batch = {}
+            asyncio.get_running_loop().call_later(self.batch_window, self._schedule_flush)
+        if (future := self._batch.get(origin_address)) is None:
+            future = self._batch[origin_address] = asyncio.get_running_loop().create_future()
+        return await asyncio.shield(future)
+
+
+async def compute_distance(
+    session: ClientSession, gmaps_api_key: str, origin_address: str,
+    destination_address: str = DEFAULT_DESTINATION
+) -> Distances:
+    """Use Google Maps API to compute the distance (minutes and kms)
+    from a given address to the destination
+
+    Returns:
+        dict: travel mode -> (distance in km as string with unit 'km' or None,
+                              duration as string with unit 'mins' or None)
+    """
+    distance_matrix = DistanceMatrix(session, gmaps_api_key, destination_address)
+    return (await distance_matrix.distances([origin_address]))[origin_address]
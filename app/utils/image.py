@@ -1,4 +1,17 @@
 """Utilities for handling images / thumbnails"""
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from aiohttp import ClientSession
+
+from app.resilience import Resilience, RetryableError, RetryPolicy
+
 
 def scaled_image_size(width, height, max_width, max_height) -> tuple[float, float]:
     """Get a new image size given original w/h and given max w/h
@@ -17,3 +30,228 @@ def scaled_image_size(width, height, max_width, max_height) -> tuple[float, floa
     ratio = min(ratio_x, ratio_y)
 
     return width * ratio, height * ratio
+
+
+class ImageCache:
+    """Content-addressed image cache with a memory and an optional disk tier
+
+    Images are stored by the SHA-256 digest of their content, the index maps
+    an image URL to its digest and ETag. Cached images whose URL has an ETag
+    are revalidated with a conditional request, others are served as is.
+    Both tiers evict the least recently used images once they exceed their size,
+    together with the index entries (and on disk the ref files) of their URLs.
+
+    The disk tier is catalogued once on startup. Later reads, writes and
+    evictions only touch the files in a worker thread, the event loop keeps
+    the bookkeeping in memory.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_memory_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        resilience: Optional[Resilience] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        """
+        Args:
+            directory: directory of the disk tier, images are only kept in memory if not set
+            max_memory_bytes: size of the memory tier
+            max_disk_bytes: size of the disk tier, including the ref files of the URLs
+            resilience: circuit breakers shared with other clients
+            retry_policy: retries and timeouts of an image download
+        """
+        self.directory = Path(directory) if directory else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.resilience = resilience or Resilience()
+        self.retry_policy = retry_policy or RetryPolicy(attempts=2, timeout=15.0, budget=20.0)
+        # URL key -> (ETag, content digest), only of URLs whose content is cached
+        self._index: Dict[str, Tuple[Optional[str], str]] = {}
+        # content digest -> URL keys whose content it is
+        self._url_keys: Dict[str, Set[str]] = {}
+        # content digest -> content, least recently used first
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        # content digest -> size of the blob and its ref files on disk, least recently used first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._load_disk()
+
+    @staticmethod
+    def _url_key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.directory / f"{digest}.img"
+
+    def _ref_path(self, url_key: str) -> Path:
+        return self.directory / f"{url_key}.ref"
+
+    @staticmethod
+    def _ref_text(etag: Optional[str], digest: str) -> bytes:
+        return f"{etag or ''}\n{digest}".encode()
+
+    def _load_disk(self):
+        """Catalog the blobs and ref files of the disk tier, dangling refs are deleted"""
+        for tmp_path in self.directory.glob("*.tmp"):
+            # Left over by an interrupted write
+            tmp_path.unlink(missing_ok=True)
+        blobs = sorted(
+            ((path.stem, path.stat()) for path in self.directory.glob("*.img")),
+            key=lambda blob: blob[1].st_mtime,
+        )
+        for digest, stat in blobs:
+            self._disk[digest] = stat.st_size
+        for ref_path in self.directory.glob("*.ref"):
+            ref_text = ref_path.read_bytes()
+            etag, _, digest = ref_text.decode().partition("\n")
+            if digest not in self._disk:
+                ref_path.unlink(missing_ok=True)
+                continue
+            self._add_key(ref_path.stem, etag or None, digest)
+            self._disk[digest] += len(ref_text)
+        self._disk_bytes = sum(self._disk.values())
+
+    def _add_key(self, url_key: str, etag: Optional[str], digest: str):
+        """Point the URL at the content digest"""
+        if (entry := self._index.get(url_key)) is not None and entry[1] != digest:
+            self._remove_key(url_key, entry[1])
+        self._index[url_key] = (etag, digest)
+        self._url_keys.setdefault(digest, set()).add(url_key)
+
+    def _remove_key(self, url_key: str, digest: str):
+        if (url_keys := self._url_keys.get(digest)) is not None:
+            url_keys.discard(url_key)
+            if not url_keys:
+                del self._url_keys[digest]
+
+    def _forget(self, digest: str):
+        """Remove the index entries of content that is in neither tier anymore"""
+        if digest in self._memory or digest in self._disk:
+            return
+        for url_key in self._url_keys.pop(digest, ()):
+            del self._index[url_key]
+
+    async def _get(self, digest: str) -> Optional[bytes]:
+        """Return the content with the given digest from memory or disk"""
+        if (content := self._memory.get(digest)) is not None:
+            self._memory.move_to_end(digest)
+            return content
+        if digest in self._disk:
+            self._disk.move_to_end(digest)
+            try:
+                content = await asyncio.to_thread(self._blob_path(digest).read_bytes)
+            except FileNotFoundError:
+                # Evicted while it was read
+                return None
+            self._put_memory(digest, content)
+            return content
+        return None
+
+    def _put_memory(self, digest: str, content: bytes):
+        if digest in self._memory:
+            return
+        self._memory[digest] = content
+        self._memory_bytes += len(content)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            evicted_digest, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._forget(evicted_digest)
+
+    def _write_disk(self, files: List[Tuple[Path, bytes]], evicted: List[Path]):
+        """Write the files atomically and delete the evicted ones, runs in a worker thread"""
+        for path, data in files:
+            # Concurrent writes of the same file each have their own temporary file
+            tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        for path in evicted:
+            path.unlink(missing_ok=True)
+
+    async def _put_disk(self, url_key: str, etag: Optional[str], digest: str, content: bytes):
+        files = []
+        if digest not in self._disk:
+            files.append((self._blob_path(digest), content))
+            self._disk[digest] = len(content)
+            self._disk_bytes += len(content)
+        else:
+            self._disk.move_to_end(digest)
+        ref_text = self._ref_text(etag, digest)
+        files.append((self._ref_path(url_key), ref_text))
+        self._disk[digest] += len(ref_text)
+        self._disk_bytes += len(ref_text)
+
+        # Evict the least recently used images with the refs of their URLs
+        evicted = []
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            evicted_digest, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(self._blob_path(evicted_digest))
+            evicted.extend(map(self._ref_path, self._url_keys.get(evicted_digest, ())))
+            self._forget(evicted_digest)
+        await asyncio.to_thread(self._write_disk, files, evicted)
+
+    async def put(self, url: str, etag: Optional[str], content: bytes):
+        """Cache the content of the given image URL"""
+        digest = hashlib.sha256(content).hexdigest()
+        url_key = self._url_key(url)
+        if self.directory and (entry := self._index.get(url_key)) is not None:
+            # The URL's ref file is rewritten, it's counted for the new content
+            _, old_digest = entry
+            if old_digest in self._disk:
+                ref_size = len(self._ref_text(*entry))
+                self._disk[old_digest] -= ref_size
+                self._disk_bytes -= ref_size
+        self._add_key(url_key, etag, digest)
+        self._put_memory(digest, content)
+        if self.directory:
+            await self._put_disk(url_key, etag, digest, content)
+
+    async def fetch(self, session: ClientSession, url: str) -> Optional[bytes]:
+        """Return the content of an image URL from the cache or download it
+
+        Note:
+            Transient errors are retried, see app.resilience. The cached
+            content is returned if the revalidation fails.
+
+        Returns:
+            bytes: image content or None if it couldn't be downloaded
+        """
+        headers = {}
+        cached = None
+        if entry := self._index.get(self._url_key(url)):
+            etag, digest = entry
+            cached = await self._get(digest)
+            if cached is not None:
+                if etag is None:
+                    return cached
+                headers["If-None-Match"] = etag
+
+        async def download() -> Tuple[int, Optional[str], Optional[bytes]]:
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 429 or resp.status >= 500:
+                    raise RetryableError(f"status={resp.status}", resp.status)
+                content = await resp.read() if resp.status == 200 else None
+                return resp.status, resp.headers.get("ETag"), content
+
+        try:
+            status, etag, content = await self.resilience.call(
+                urlparse(url).hostname, download, self.retry_policy, target="images"
+            )
+        except Exception:
+            # A stale image is better than none
+            if cached is not None:
+                return cached
+            raise
+
+        if status == 304 and cached is not None:
+            return cached
+        if status != 200:
+            return None
+
+        await self.put(url, etag, content)
+        return content
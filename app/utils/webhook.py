@@ -0,0 +1,132 @@
+"""Rate limited Discord webhook adapter
+
+discord.py is slow to import, this module is only imported once the first
+message is sent (see app.delivery.LazyWebhook).
+"""
+import asyncio
+import json
+import random
+import time
+from typing import Optional
+from urllib.parse import quote
+
+import aiohttp
+from discord import AsyncWebhookAdapter, utils
+from discord.errors import DiscordServerError, Forbidden, HTTPException, NotFound
+
+from app import setup_custom_logger
+from app.metrics import REQUEST_DURATION
+
+
+logger = setup_custom_logger(__name__)
+
+
+class WebhookRateLimit:
+    """Rate limit state of a single webhook, fed by Discord's X-RateLimit-* headers"""
+
+    def __init__(self) -> None:
+        self.remaining: Optional[int] = None
+        # Event loop time before which no request should be made
+        self.blocked_until = 0.0
+        # Requests to the same webhook are sent one at a time
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        """Sleep until the webhook can be used again"""
+        loop = asyncio.get_running_loop()
+        if (delay := self.blocked_until - loop.time()) > 0:
+            logger.debug("webhook rate limited, waiting %.2fs", delay)
+            await asyncio.sleep(delay)
+
+    def block(self, seconds: float):
+        """Don't allow any request for the given amount of seconds"""
+        loop = asyncio.get_running_loop()
+        self.blocked_until = max(self.blocked_until, loop.time() + seconds)
+
+    def update(self, headers):
+        """Update the state from the rate limit headers of a response"""
+        if (remaining := headers.get("X-RateLimit-Remaining")) is not None:
+            self.remaining = int(remaining)
+            if self.remaining == 0:
+                self.block(float(headers.get("X-RateLimit-Reset-After", 1)))
+
+
+class RateLimitedWebhookAdapter(AsyncWebhookAdapter):
+    """AsyncWebhookAdapter that shares the rate limit state of a webhook between senders
+
+    Requests wait for the bucket to reset before they are made instead of
+    running into 429s. 429s and server errors are retried with jittered
+    exponential backoff (or the Retry-After the response asked for).
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, max_tries: int = 5) -> None:
+        super().__init__(session)
+        self.rate_limit = WebhookRateLimit()
+        self.max_tries = max_tries
+
+    @staticmethod
+    def _backoff(tries: int) -> float:
+        return min(2**tries, 30) * random.uniform(0.5, 1.5)
+
+    async def request(self, verb, url, payload=None, multipart=None, *, files=None, reason=None):
+        headers = {}
+        data = None
+        files = files or []
+        if payload:
+            headers["Content-Type"] = "application/json"
+            data = utils.to_json(payload)
+        if reason:
+            headers["X-Audit-Log-Reason"] = quote(reason, safe="/ ")
+
+        async with self.rate_limit.lock:
+            for tries in range(self.max_tries):
+                await self.rate_limit.wait()
+                for file in files:
+                    file.reset(seek=tries)
+                if multipart:
+                    data = aiohttp.FormData()
+                    for key, value in multipart.items():
+                        if key.startswith("file"):
+                            data.add_field(key, value[1], filename=value[0], content_type=value[2])
+                        else:
+                            data.add_field(key, value)
+
+                start = time.perf_counter()
+                async with self.session.request(verb, url, headers=headers, data=data) as r:
+                    response = (await r.text(encoding="utf-8")) or None
+                    REQUEST_DURATION.observe(time.perf_counter() - start, target="discord")
+                    if r.headers.get("Content-Type") == "application/json":
+                        response = json.loads(response)
+                    self.rate_limit.update(r.headers)
+
+                    if 300 > r.status >= 200:
+                        return response
+
+                    if r.status == 429:
+                        if retry_after := r.headers.get("Retry-After"):
+                            delay = float(retry_after)
+                        elif isinstance(response, dict) and "retry_after" in response:
+                            delay = response["retry_after"] / 1000.0
+                        else:
+                            delay = self._backoff(tries)
+                        logger.warning(
+                            "Webhook %s is rate limited, retrying in %.2fs", self._webhook_id, delay
+                        )
+                        self.rate_limit.block(delay)
+                        continue
+
+                    if r.status >= 500:
+                        await asyncio.sleep(self._backoff(tries))
+                        continue
+
+                    if r.status == 403:
+                        raise Forbidden(r, response)
+                    elif r.status == 404:
+                        raise NotFound(r, response)
+                    else:
+                        raise HTTPException(r, response)
+
+        # no more retries
+        if r.status >= 500:
+            raise DiscordServerError(r, response)
+        raise HTTPException(r, response)
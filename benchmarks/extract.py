@@ -0,0 +1,280 @@
+"""Benchmark the per-listing extraction of the parser specs
+
+The listing parsers compiled from app.immo.sites are compared with the
+previous hand-written parsers, which walked `.get()` chains per field.
+
+Usage:
+    python -m benchmarks.extract [--listings 1000] [--repeat 15]
+"""
+import argparse
+import time
+from typing import Callable, List, Optional
+
+from app import setup_custom_logger
+from app.immo.model import ImmoData, ImmoPriceKind
+from app.immo.parser import ImmoParser
+from app.immo.registry import get_parser
+from app.immo.stream import iter_array
+from app.immo.website import ImmoWebsite
+from benchmarks.fixtures import FIXTURE_WEBSITES, result_page
+
+
+logger = setup_custom_logger(__name__)
+
+
+# Previous hand-written parsers, kept for comparison
+
+def _parse_immoscout24(listing: dict) -> Optional[ImmoData]:
+    """Parse a single immoscout24.ch listing
+
+    Returns:
+        ImmoData: data of the listing
+    """
+    if lister_logo_url := listing.get("listerBranding"):
+        lister_logo_url = lister_logo_url.get("logoUrl")
+
+    # unwrap the listing
+    listing = listing["listing"]
+    primary_localization = listing["localization"]["primary"]
+    try:
+        title = listing["localization"][primary_localization]["text"]["title"]
+        loc = listing["address"]["locality"]
+        plz = listing["address"]["postalCode"]
+        street = listing["address"]["street"]
+        address = f"{street}, {plz} {loc}"
+    except KeyError:
+        address = None
+        title = "Wohnung"
+    url = f"/rent/{listing.get('id')}"
+    rent = listing.get("prices").get("rent").get("gross") # gross
+    rooms = listing.get("characteristics").get("numberOfRooms")
+    living_space = listing.get("characteristics").get("livingSpace")
+
+    attachments = listing["localization"][primary_localization].get("attachments") or []
+    images = [
+        attachment["url"].encode().decode("unicode-escape")
+        for attachment in attachments
+        if attachment["type"] == "IMAGE"
+    ]
+
+    return ImmoData(
+        title=title,
+        address=address,
+        url=url,
+        price=rent,
+        rooms=rooms,
+        living_space=living_space,
+        images=images,
+        lister_logo_url=lister_logo_url,
+        id=str(listing.get("id")),
+    )
+
+
+def _parse_homegate(listing: dict) -> Optional[ImmoData]:
+    """Parse a single homegate.ch listing
+
+    Returns:
+        ImmoData: data of the listing
+    """
+    try:
+        listing = listing["listing"]
+        localization = listing["localization"]
+        primary_key = localization["primary"]
+        title = localization[primary_key]["text"]["title"]
+        attachments = localization[primary_key].get("attachments") or []
+        images = [
+            attachment["url"].encode().decode("unicode-escape")
+            for attachment in attachments
+            if attachment["type"] == "IMAGE"
+        ]
+        address = None
+        try:
+            loc = listing["address"]["locality"]
+            plz = listing["address"]["postalCode"]
+            street = listing["address"]["street"]
+            address = f"{street}, {plz} {loc}"
+        except KeyError:
+            pass
+        url = f"/rent/{listing['id']}"
+        rent = listing["prices"]["rent"].get("gross")
+        rooms, living_space = None, None
+        if characteristics := listing.get("characteristics"):
+            rooms = str(characteristics.get("numberOfRooms"))
+            living_space = characteristics.get("livingSpace")
+
+        return ImmoData(
+            title=title,
+            address=address,
+            url=url,
+            price=rent,
+            rooms=rooms,
+            living_space=living_space,
+            images=images,
+            id=str(listing["id"]),
+        )
+    except KeyError:
+        logger.error("homegate.ch key error: %s", listing)
+        return None
+
+
+def _parse_immobilienscout24at(listing: dict) -> Optional[ImmoData]:
+    """Parse a single immobilienscout24.at listing
+
+    Note:
+        Similar to immoscout24.ch
+
+    Returns:
+        ImmoData: data of the listing
+    """
+    title = listing.get("headline", "Object")
+    address = listing.get("addressString")
+    url = "/"
+    if links := listing.get("links"):
+        url = links.get("targetURL")
+    # Price
+    price = None
+    if price_key_facts := listing.get("priceKeyFacts"):
+        price = price_key_facts[0].get("value")
+
+    rooms, living_space = None, None
+    if main_key_facts := listing.get("mainKeyFacts"):
+        for fact in main_key_facts:
+            if label := fact.get("label"):
+                if label == "Zimmer":
+                    rooms = fact.get("value")
+                elif label == "Fläche":
+                    living_space = fact.get("value")
+
+    images = []
+    if image_props := listing.get("primaryPictureImageProps"):
+        for source in image_props.get("sources", []):
+            if type := source.get("type"):
+                if type == "image/jpeg":
+                    if media := source.get("media"):
+                        if media == "(max-width: 1023px)":
+                            if src := source.get("srcSet"):
+                                src = src.split()[0]
+                                images.append(src)
+                                break
+        # Use "src" if the max-width image is not available
+        if not images:
+            if src_image_url := image_props.get("src"):
+                images.append(src_image_url)
+
+    return ImmoData(
+        title=title,
+        address=address,
+        url=url,
+        price=price,
+        price_kind=ImmoPriceKind.PRICE,
+        currency="€",
+        rooms=rooms,
+        living_space=living_space,
+        images=images,
+    )
+
+
+def _parse_immoweltat(listing: dict) -> Optional[ImmoData]:
+    """Parse a single immowelt.at listing
+
+    Returns:
+        ImmoData: data of the listing
+    """
+    title = listing.get("title", "Object")
+    address = None
+    if place := listing.get("place"):
+        address = place.get("city")
+    url = "/"
+    if online_id := listing.get("onlineId"):
+        url = f"/expose/{online_id}"
+    else:
+        online_id = None
+    price = None
+    if primary_price := listing.get("primaryPrice"):
+        price = primary_price.get("amountMin") or primary_price.get("amountMax")
+
+    rooms = listing.get("roomsMin") or listing.get("roomsMax")
+    living_space = None
+    if primary_area := listing.get("primaryArea"):
+        living_space = primary_area.get("sizeMin") or primary_area.get(
+            "sizeMax"
+        )
+
+    images = []
+    if pictures := listing.get("pictures"):
+        for picture in pictures:
+            if image_url := picture.get("imageUri"):
+                images.append(image_url)
+
+    return ImmoData(
+        title=title,
+        address=address,
+        url=url,
+        price=price,
+        price_kind=ImmoPriceKind.PRICE,
+        currency="€",
+        rooms=rooms,
+        living_space=living_space,
+        images=images,
+        id=online_id,
+    )
+
+
+HANDWRITTEN = {
+    ImmoWebsite.IMMOSCOUT24: _parse_immoscout24,
+    ImmoWebsite.HOMEGATE: _parse_homegate,
+    ImmoWebsite.IMMOBILIENSCOUT24AT: _parse_immobilienscout24at,
+    ImmoWebsite.IMMOWELTAT: _parse_immoweltat,
+}
+
+
+def _finished(website: ImmoWebsite, immo_data: ImmoData) -> tuple:
+    """Raw values of a hand-written result with the absolute url that the parsers add"""
+    title, url, *values, listing_id = immo_data._raw()
+    absolute_url = f"https://{website.value}{url}"
+    # The ID of a listing without one is its url
+    return (title, absolute_url, *values, absolute_url if listing_id == url else listing_id)
+
+
+def _listings(website: ImmoWebsite, n_listings: int) -> List[dict]:
+    """Decoded listing JSON of a synthetic result page"""
+    content = result_page(website, n_listings=n_listings, n_filler=0, padding=0)
+    script_text = ImmoParser.extract_script(website, content)
+    return list(iter_array(script_text, get_parser(website).spec.listings_path))
+
+
+def _timed(parse_listing: Callable[[dict], Optional[ImmoData]], listings: List[dict], repeat: int) -> float:
+    """Best seconds per listing, the runs of a few microseconds are easily disturbed"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for listing in listings:
+            parse_listing(listing)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / len(listings)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--listings", type=int, default=1000)
+    arg_parser.add_argument("--repeat", type=int, default=15)
+    args = arg_parser.parse_args()
+
+    print(f"{'website':<26} {'hand-written':>13} {'compiled':>10}")
+    for website in FIXTURE_WEBSITES:
+        listings = _listings(website, args.listings)
+        compiled = get_parser(website).parse_listing
+        # Both parsers have to extract the same values
+        for listing in listings[:100]:
+            expected = _finished(website, HANDWRITTEN[website](listing))
+            assert expected == compiled(listing)._raw(), listing
+
+        handwritten_time = _timed(HANDWRITTEN[website], listings, args.repeat)
+        compiled_time = _timed(compiled, listings, args.repeat)
+        print(
+            f"{website.value:<26} {handwritten_time * 1e6:>11.2f}us {compiled_time * 1e6:>8.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Synthetic result pages for every supported immo website
+
+The pages mimic the structure of the real websites closely enough for the
+parsers: a large HTML document with unrelated markup around the single
+<script> tag that carries the listings JSON.
+"""
+import json
+import random
+
+from app.immo.website import ImmoWebsite
+
+
+# Unrelated markup that makes up the bulk of a real result page
+_FILLER_BLOCK = (
+    '<div class="teaser"><a href="/en/some/link">Some teaser</a>'
+    '<span class="price">CHF 1\'234.–</span><img src="/img/placeholder.png" alt="">'
+    "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p></div>\n"
+)
+
+
+def _smg_listing(i: int, rng: random.Random) -> dict:
+    """homegate.ch and immoscout24.ch share the same listing shape"""
+    return {
+        "listing": {
+            "id": str(3000000000 + i),
+            "address": {
+                "locality": "Zürich",
+                "postalCode": str(8000 + rng.randint(1, 57)),
+                "street": f"Musterstrasse {i}",
+            },
+            "characteristics": {
+                "numberOfRooms": rng.choice([1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5]),
+                "livingSpace": rng.randint(20, 140),
+            },
+            "prices": {"rent": {"gross": rng.randint(900, 4500)}},
+            "localization": {
+                "primary": "de",
+                "de": {
+                    "text": {"title": f"Schöne Wohnung {i}"},
+                    "attachments": [
+                        {"type": "IMAGE", "url": f"https://media.example.com/{i}/{j}.jpg"}
+                        for j in range(6)
+                    ],
+                },
+            },
+        },
+        "listerBranding": {"logoUrl": "https://media.example.com/logo.png"},
+    }
+
+
+def _with_padding(state: dict, padding: int, padding_first: bool) -> dict:
+    """Add unrelated page state that the parser doesn't need"""
+    translations = {f"key{i}": "x" * 64 for i in range(padding)}
+    if padding_first:
+        return {"translations": translations, **state}
+    return {**state, "translations": translations}
+
+
+def _immobilienscout24at_listing(i: int, rng: random.Random) -> dict:
+    return {
+        "headline": f"Eigentumswohnung {i}",
+        "addressString": f"Dorfstrasse {i}, 6020 Innsbruck",
+        "links": {"targetURL": f"/expose/{100000 + i}"},
+        "priceKeyFacts": [{"value": f"€ {rng.randint(150, 900)}.000"}],
+        "mainKeyFacts": [
+            {"label": "Zimmer", "value": str(rng.randint(1, 5))},
+            {"label": "Fläche", "value": f"{rng.randint(30, 150)} m²"},
+        ],
+        "primaryPictureImageProps": {
+            "src": f"https://pictures.example.com/{i}.jpg",
+            "sources": [
+                {
+                    "type": "image/jpeg",
+                    "media": "(max-width: 1023px)",
+                    "srcSet": f"https://pictures.example.com/{i}-s.jpg 1x",
+                }
+            ],
+        },
+    }
+
+
+def _immoweltat_listing(i: int, rng: random.Random) -> dict:
+    return {
+        "title": f"Haus {i}",
+        "place": {"city": "Innsbruck"},
+        "onlineId": f"2{i:06d}",
+        "primaryPrice": {"amountMin": rng.randint(150000, 900000)},
+        "roomsMin": rng.randint(1, 6),
+        "primaryArea": {"sizeMin": rng.randint(30, 200)},
+        "pictures": [
+            {"imageUri": f"https://pictures.example.com/{i}/{j}.jpg"} for j in range(4)
+        ],
+    }
+
+
+def _page(head_script: str, body_script: str, n_filler: int) -> str:
+    filler = _FILLER_BLOCK * n_filler
+    return (
+        "<!DOCTYPE html><html><head><title>Results</title>"
+        f"{head_script}</head><body>{filler}{body_script}{filler}</body></html>"
+    )
+
+
+def result_page(
+    website: ImmoWebsite,
+    n_listings: int = 20,
+    n_filler: int = 2500,
+    padding: int = 2000,
+    seed: int = 0,
+    offset: int = 0,
+    padding_first: bool = False,
+) -> bytes:
+    """Build a synthetic result page for the given website
+
+    Args:
+        website: website whose page structure is mimicked
+        n_listings: number of listings on the page
+        n_filler: number of unrelated HTML blocks around the script (~300 B each)
+        padding: number of unrelated entries in the page state JSON
+        seed: random seed for the listing values
+        offset: id offset of the first listing (e.g. for later result pages)
+        padding_first: put the unrelated page state before the listings
+
+    Returns:
+        bytes: utf-8 encoded HTML document
+    """
+    rng = random.Random(seed)
+    ids = range(offset, offset + n_listings)
+    match website:
+        case ImmoWebsite.IMMOSCOUT24 | ImmoWebsite.HOMEGATE:
+            listings = [_smg_listing(i, rng) for i in ids]
+            state = _with_padding(
+                {"resultList": {"search": {"fullSearch": {"result": {"listings": listings}}}}},
+                padding,
+                padding_first,
+            )
+            script = f"<script>window.__INITIAL_STATE__={json.dumps(state)}</script>"
+            html = _page("", script, n_filler)
+        case ImmoWebsite.IMMOBILIENSCOUT24AT:
+            state = _with_padding(
+                {
+                    "reduxAsyncConnect": {
+                        "pageData": {
+                            "results": {
+                                "hits": [_immobilienscout24at_listing(i, rng) for i in ids]
+                            }
+                        }
+                    },
+                },
+                padding,
+                padding_first,
+            )
+            state_json = json.dumps(state).replace('"translations"', '"tracking":undefined,"translations"')
+            script = (
+                f"<script>window.__INITIAL_STATE__={state_json}\n"
+                "window.__CONFIG__={};\n</script>"
+            )
+            html = _page(script, "", n_filler)
+        case ImmoWebsite.IMMOWELTAT:
+            state = _with_padding(
+                {
+                    "initialState": {
+                        "estateSearch": {
+                            "data": {"estates": [_immoweltat_listing(i, rng) for i in ids]}
+                        }
+                    },
+                },
+                padding,
+                padding_first,
+            )
+            script = (
+                '<script id="serverApp-state" type="application/json"><!--'
+                f"{json.dumps(state)}--></script>"
+            )
+            html = _page("", script, n_filler)
+        case _:
+            raise ValueError(f"No fixture for {website.value}")
+
+    return html.encode("utf-8")
+
+
+# Websites that have a parser (and therefore a fixture)
+FIXTURE_WEBSITES = [
+    ImmoWebsite.IMMOSCOUT24,
+    ImmoWebsite.HOMEGATE,
+    ImmoWebsite.IMMOBILIENSCOUT24AT,
+    ImmoWebsite.IMMOWELTAT,
+]
@@ -0,0 +1,134 @@
+"""Benchmark memory per listing and construction cost of ImmoData
+
+The slotted ImmoData is compared with the previous dataclass, which
+formatted the display values eagerly in __post_init__.
+
+Usage:
+    python -m benchmarks.model [--listings 20000] [--repeat 5]
+"""
+import argparse
+import gc
+import statistics
+import time
+import tracemalloc
+from dataclasses import _MISSING_TYPE, dataclass, fields
+from typing import List, Optional
+
+from app.immo.model import ImmoData, ImmoPriceKind
+
+
+@dataclass
+class DataclassImmoData:
+    """Previous representation of a listing, kept for comparison"""
+
+    title: str
+    url: str
+    images: List[str]
+    address: str = "No address"
+    price: str = "On request"
+    price_kind: ImmoPriceKind = ImmoPriceKind.RENT
+    rooms: str = "-"
+    living_space: str = "-"
+    currency: str = "CHF"
+    lister_logo_url: Optional[str] = None
+    id: Optional[str] = None
+
+    def __post_init__(self):
+        for field in fields(self):
+            if (
+                not isinstance(field.default, _MISSING_TYPE)
+                and getattr(self, field.name) is None
+            ):
+                setattr(self, field.name, field.default)
+
+        self.price = self._add_suffix(self.price, f" {self.currency}")
+        self.living_space = self._add_suffix(self.living_space, " m²")
+
+        if isinstance(self.rooms, int):
+            self.rooms = str(self.rooms)
+
+    def _add_suffix(self, x, suffix) -> str:
+        if not isinstance(x, str):
+            x = str(x)
+        if x.isdigit():
+            x += suffix
+        return x
+
+
+def _listing_kwargs(n: int) -> List[dict]:
+    """Arguments like the parsers pass them"""
+    return [
+        dict(
+            title=f"Schöne {i % 5 + 1}-Zimmer-Wohnung",
+            url=f"/rent/{4000000000 + i}",
+            images=[f"https://media.example.com/{i}/{j}.jpg" for j in range(3)],
+            address=f"Musterstrasse {i % 200}, {8000 + i % 100} Zürich",
+            price=1500 + i % 2000 if i % 10 else None,
+            rooms=str(i % 5 + 1.5),
+            living_space=40 + i % 120,
+            id=str(4000000000 + i),
+        )
+        for i in range(n)
+    ]
+
+
+def _construct(cls, all_kwargs: List[dict]) -> list:
+    return [cls(**kwargs) for kwargs in all_kwargs]
+
+
+def _format(listings: list):
+    for listing in listings:
+        listing.price, listing.rooms, listing.living_space, listing.address
+
+
+def _timed(fn, *args, repeat: int) -> float:
+    """Median seconds of fn(*args)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def _bytes_per_listing(cls, all_kwargs: List[dict]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    listings = _construct(cls, all_kwargs)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del listings
+    return current / len(all_kwargs)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--listings", type=int, default=20000)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    all_kwargs = _listing_kwargs(args.listings)
+    # Both representations have to display the same values
+    for kwargs in all_kwargs[:100]:
+        old, new = DataclassImmoData(**kwargs), ImmoData(**kwargs)
+        assert (old.price, old.rooms, old.living_space, old.address) == (
+            new.price, new.rooms, new.living_space, new.address
+        ), kwargs
+
+    print(
+        f"{'representation':<16} {'bytes/listing':>14} {'construct':>12} {'construct+format':>18}"
+    )
+    for name, cls in (("dataclass", DataclassImmoData), ("slotted", ImmoData)):
+        per_listing = _bytes_per_listing(cls, all_kwargs)
+        construct = _timed(_construct, cls, all_kwargs, repeat=args.repeat)
+        formatted = _timed(
+            lambda: _format(_construct(cls, all_kwargs)), repeat=args.repeat
+        )
+        print(
+            f"{name:<16} {per_listing:>14.0f} "
+            f"{construct / args.listings * 1e6:>10.2f}us {formatted / args.listings * 1e6:>16.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark the parsing paths of a result page
+
+- soup: build the whole HTML tree with BeautifulSoup
+- full: slice the script out of the raw bytes and decode the whole page state
+- stream: slice the script and decode only the listings (ImmoParser.parse)
+
+The stream path is measured with the unrelated page state after ("stream")
+and before ("stream<") the listings.
+
+Usage:
+    python -m benchmarks.parser [--repeat 5] [--filler 2500] [--padding 2000]
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from app.immo.parser import ImmoParser
+from benchmarks.fixtures import FIXTURE_WEBSITES, result_page
+
+
+def _soup_parse(website, content: bytes):
+    """Old behaviour: build the full tree and parse it"""
+    html = BeautifulSoup(content.decode("utf-8"), "html.parser")
+    return ImmoParser.parse_html(website, html)
+
+
+def _full_parse(website, content: bytes):
+    """Decode the whole page state before picking the listings"""
+    script_text = ImmoParser.extract_script(website, content)
+    return ImmoParser._parse_listings_json(website, ImmoParser._load_json(website, script_text))
+
+
+def _measure(fn, website, content: bytes, repeat: int):
+    """Return (median seconds, peak allocated bytes) of the given parse function"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = fn(website, content)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(website, content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return statistics.median(timings), peak, len(results)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--filler", type=int, default=2500)
+    arg_parser.add_argument("--listings", type=int, default=20)
+    arg_parser.add_argument("--padding", type=int, default=2000, help="unrelated page state entries")
+    args = arg_parser.parse_args()
+
+    print(
+        f"{'website':<26} {'path':<7} {'page':>8} {'listings':>8} "
+        f"{'median':>10} {'peak mem':>10}"
+    )
+    for website in FIXTURE_WEBSITES:
+        content = result_page(
+            website, n_listings=args.listings, n_filler=args.filler, padding=args.padding
+        )
+        content_padding_first = result_page(
+            website,
+            n_listings=args.listings,
+            n_filler=args.filler,
+            padding=args.padding,
+            padding_first=True,
+        )
+        for name, fn, page in (
+            ("soup", _soup_parse, content),
+            ("full", _full_parse, content),
+            ("stream", ImmoParser.parse, content),
+            ("stream<", ImmoParser.parse, content_padding_first),
+        ):
+            seconds, peak, n = _measure(fn, website, page, args.repeat)
+            print(
+                f"{website.value:<26} {name:<7} {len(content) / 1e6:>6.2f}MB {n:>8} "
+                f"{seconds * 1e3:>8.1f}ms {peak / 1e6:>8.2f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Benchmark scrape -> extract -> parse -> diff for every website against a local stub server
+
+The result pages are either synthetic (see benchmarks.fixtures) or recorded
+pages from a directory, e.g. `etc/fixtures/www.homegate.ch.html`. Every stage is
+timed per page and allocations are measured in a separate traced pass so that
+tracing doesn't skew the timings.
+
+Usage:
+    python -m benchmarks.pipeline [--rounds 50] [--output results.json]
+    python -m benchmarks.pipeline --compare results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from app.immo.parser import ImmoParser
+from app.immo.website import ImmoWebsite
+from app.scraper import Scraper
+from app.seen import SeenIndex
+from benchmarks.fixtures import FIXTURE_WEBSITES, result_page
+
+
+STAGES = ["scrape", "extract", "parse", "diff"]
+
+
+def _load_pages(fixtures_dir: Optional[str], n_pages: int) -> Dict[ImmoWebsite, List[bytes]]:
+    """Load recorded pages per website or generate synthetic ones"""
+    pages = {}
+    for website in FIXTURE_WEBSITES:
+        recorded = []
+        if fixtures_dir:
+            recorded = [p.read_bytes() for p in sorted(Path(fixtures_dir).glob(f"{website.value}*.html"))]
+        pages[website] = recorded or [
+            result_page(website, seed=i, offset=i * 20) for i in range(n_pages)
+        ]
+    return pages
+
+
+async def _start_server(pages: Dict[ImmoWebsite, List[bytes]]) -> web.AppRunner:
+    async def handler(request: web.Request) -> web.Response:
+        website_pages = pages[ImmoWebsite(request.match_info["hostname"])]
+        page = website_pages[int(request.match_info["page"]) % len(website_pages)]
+        return web.Response(body=page, content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{hostname}/{page}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+def _timed(timings: List[float], fn: Callable, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    timings.append(time.perf_counter() - start)
+    return result
+
+
+def _process(website: ImmoWebsite, content: bytes, seen: SeenIndex, timings: Dict[str, List[float]]):
+    """Run the CPU stages of a single page"""
+    script_text = _timed(timings["extract"], ImmoParser.extract_script, website, content)
+    listings = _timed(
+        timings["parse"], lambda: list(ImmoParser.iter_listings(website, script_text))
+    )
+
+    def diff():
+        new = [listing for listing in listings if listing.id not in seen]
+        seen.update(listing.id for listing in listings)
+        return new
+
+    _timed(timings["diff"], diff)
+    return listings
+
+
+def _allocations(website: ImmoWebsite, content: bytes) -> Dict[str, dict]:
+    """Peak traced memory and number of allocated blocks of every CPU stage"""
+    seen = SeenIndex()
+    results = {}
+    state = {"content": content}
+
+    steps = [
+        ("extract", lambda: ImmoParser.extract_script(website, state["content"])),
+        ("parse", lambda: list(ImmoParser.iter_listings(website, state["extract"]))),
+        ("diff", lambda: seen.update(listing.id for listing in state["parse"])),
+    ]
+    for stage, fn in steps:
+        tracemalloc.start()
+        state[stage] = fn()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+        results[stage] = {"peak_bytes": peak, "retained_blocks": blocks}
+    return results
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def run(rounds: int, fixtures_dir: Optional[str], n_pages: int) -> dict:
+    pages = _load_pages(fixtures_dir, n_pages)
+    runner = await _start_server(pages)
+    port = runner.addresses[0][1]
+
+    results = {}
+    async with aiohttp.ClientSession() as session:
+        for website, website_pages in pages.items():
+            timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+            seen = SeenIndex()
+            n_listings, n_bytes = 0, 0
+
+            start = time.perf_counter()
+            for i in range(rounds):
+                scraper = Scraper(f"http://127.0.0.1:{port}/{website.value}/{i}", session, conditional=False)
+                scrape_start = time.perf_counter()
+                content = await scraper.scrape()
+                timings["scrape"].append(time.perf_counter() - scrape_start)
+                n_listings += len(_process(website, content, seen, timings))
+                n_bytes += len(content)
+            elapsed = time.perf_counter() - start
+
+            results[website.value] = {
+                "pages_per_second": rounds / elapsed,
+                "listings_per_second": n_listings / elapsed,
+                "mean_page_bytes": n_bytes / rounds,
+                "stages": {
+                    stage: {
+                        "p50_ms": statistics.median(values) * 1e3,
+                        "p99_ms": _percentile(values, 0.99) * 1e3,
+                    }
+                    for stage, values in timings.items()
+                },
+                "allocations": _allocations(website, website_pages[0]),
+            }
+
+    await runner.cleanup()
+    return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(results: dict, baseline: Optional[dict] = None):
+    def delta(current: float, previous: Optional[float]) -> str:
+        if not previous:
+            return ""
+        return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+    for hostname, result in results["websites"].items():
+        base = (baseline or {}).get("websites", {}).get(hostname, {})
+        print(
+            f"{hostname}: {result['pages_per_second']:.1f} pages/s"
+            f"{delta(result['pages_per_second'], base.get('pages_per_second'))}, "
+            f"{result['listings_per_second']:.0f} listings/s"
+        )
+        for stage, stats in result["stages"].items():
+            base_stats = base.get("stages", {}).get(stage, {})
+            allocations = result["allocations"].get(stage)
+            line = (
+                f"  {stage:<8} p50 {stats['p50_ms']:8.3f}ms{delta(stats['p50_ms'], base_stats.get('p50_ms')):<8}"
+                f" p99 {stats['p99_ms']:8.3f}ms{delta(stats['p99_ms'], base_stats.get('p99_ms')):<8}"
+            )
+            if allocations:
+                line += (
+                    f" peak {allocations['peak_bytes'] / 1e3:9.1f}kB"
+                    f" blocks {allocations['retained_blocks']:6d}"
+                )
+            print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--rounds", type=int, default=50, help="pages scraped per website")
+    arg_parser.add_argument("--pages", type=int, default=5, help="distinct synthetic pages per website")
+    arg_parser.add_argument("--fixtures", help="directory with recorded <hostname>*.html pages")
+    arg_parser.add_argument("--output", help="write the results as JSON to this file")
+    arg_parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = arg_parser.parse_args()
+
+    results = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "rounds": args.rounds,
+        "websites": asyncio.run(run(args.rounds, args.fixtures, args.pages)),
+    }
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        print(f"Comparing {results['revision']} with {baseline.get('revision')}")
+    _print_results(results, baseline)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
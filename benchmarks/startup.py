@@ -0,0 +1,192 @@
+"""Benchmark the startup of `python -m app.main` up to its first scrape
+
+Every run starts a fresh interpreter (like a rescheduled pod) that scrapes
+a homegate.ch URL whose host name resolves to a local stub server. The child
+reports how long the imports, the config and the first scrape took, the
+parent measures the total from spawning the process until it exited after
+the first scrape.
+The import-time profile (`python -X importtime`) shows which packages the
+import of app.main spends its time in.
+
+Usage:
+    python -m benchmarks.startup [--runs 10] [--profile 15]
+"""
+# Only the standard library is imported at module level, the child times
+# the import of the app itself
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+
+# Host names of the scrape URL that are resolved to the stub server
+STUB_HOSTS = {"www.homegate.ch"}
+
+# Packages that app.main shouldn't import before they are used
+LAZY_MODULES = ("discord", "bs4", "sentry_sdk", "aiohttp.web")
+
+PHASES = ["import", "config", "first_scrape", "total"]
+
+_RESULT_PREFIX = "STARTUP_RESULT "
+
+
+def _child():
+    """Run app.main until its first scrape finished and print the phase timings"""
+    start = time.perf_counter()
+
+    import socket
+
+    getaddrinfo = socket.getaddrinfo
+
+    def stub_getaddrinfo(host, *args, **kwargs):
+        return getaddrinfo("127.0.0.1" if host in STUB_HOSTS else host, *args, **kwargs)
+
+    socket.getaddrinfo = stub_getaddrinfo
+
+    import app.main
+    from app.config import Config
+    from app.manager import ImmoManager
+
+    imported = time.perf_counter()
+    config = Config()
+    configured = time.perf_counter()
+
+    async def run() -> int:
+        first_scrape = asyncio.get_running_loop().create_future()
+
+        class FirstScrapeManager(ImmoManager):
+            async def scrape_once(self) -> int:
+                n_new = await super().scrape_once()
+                if not first_scrape.done():
+                    first_scrape.set_result(len(self.seen))
+                return n_new
+
+        task = asyncio.create_task(app.main.main(config, manager_class=FirstScrapeManager))
+        await asyncio.wait([task, first_scrape], return_when=asyncio.FIRST_COMPLETED)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return first_scrape.result()
+
+    n_seen = asyncio.run(run())
+    scraped = time.perf_counter()
+    # A first scrape doesn't send anything, so none of them should be needed yet
+    lazy_imported = [module for module in LAZY_MODULES if module in sys.modules]
+    result = {
+        "import": imported - start,
+        "config": configured - imported,
+        "first_scrape": scraped - configured,
+        "listings": n_seen,
+        "lazy_imported": lazy_imported,
+    }
+    print(_RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def _run_child(port: int) -> Dict[str, float]:
+    env = dict(
+        os.environ,
+        SCRAPE_URLS=json.dumps([f"http://www.homegate.ch:{port}/rent/real-estate/city-zurich/matching-list"]),
+        DISCORD_WEBHOOK="https://discord.com/api/webhooks/123456789012345678/" + "x" * 68,
+        SCRAPING_INTERVAL="3600",
+    )
+    for name in ("STATE_PATH", "LEASE_STORE_PATH", "METRICS_PORT", "SENTRY_DSN", "SUBSCRIPTIONS"):
+        env.pop(name, None)
+
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    total = time.perf_counter() - start
+
+    for line in output.splitlines():
+        if line.startswith(_RESULT_PREFIX):
+            result = json.loads(line[len(_RESULT_PREFIX):])
+            result["total"] = total
+            return result
+    raise RuntimeError(f"The child didn't finish its first scrape:\n{output}")
+
+
+async def _serve_and_run(runs: int) -> List[Dict[str, float]]:
+    from aiohttp import web
+
+    from app.immo.website import ImmoWebsite
+    from benchmarks.fixtures import result_page
+
+    page = result_page(ImmoWebsite.HOMEGATE)
+
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(body=page, content_type="text/html")
+
+    stub = web.Application()
+    stub.router.add_get("/{path:.*}", handler)
+    runner = web.AppRunner(stub)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+    try:
+        results = []
+        for _ in range(runs):
+            # The stub server keeps serving while a thread waits for the child
+            results.append(await asyncio.get_running_loop().run_in_executor(None, _run_child, port))
+        return results
+    finally:
+        await runner.cleanup()
+
+
+def import_profile(top: int) -> List[tuple]:
+    """Self import time of app.main per top-level package
+
+    Returns:
+        list of (package, seconds): the `top` slowest packages
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    packages: Dict[str, float] = defaultdict(float)
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--runs", type=int, default=10)
+    arg_parser.add_argument("--profile", type=int, default=15, help="packages in the import profile")
+    arg_parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.child:
+        _child()
+        return
+
+    results = asyncio.run(_serve_and_run(args.runs))
+    print(f"startup of app.main until the first scrape, median of {args.runs} runs")
+    for phase in PHASES:
+        print(f"  {phase:<14}{statistics.median(r[phase] for r in results) * 1e3:8.1f} ms")
+    print(f"  listings seen {results[0]['listings']:8d}")
+    print(f"  imported early: {', '.join(results[0]['lazy_imported']) or 'none of ' + ', '.join(LAZY_MODULES)}")
+
+    if args.profile:
+        print(f"\nimport profile of app.main (self time per package, top {args.profile})")
+        for package, seconds in import_profile(args.profile):
+            print(f"  {package:<20}{seconds * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()